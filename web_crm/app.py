@@ -19,6 +19,10 @@ from blueprints.hr import hr_bp
 from blueprints.finance import finance_bp
 from blueprints.dashboard import main_bp
 from blueprints.location import location_bp
+from blueprints.search import search_bp
+from commands import audit_cli, campaigns_cli, finance_cli, geo_cli, sites_cli
+from blueprints.campaigns.similarity import proof_hash_index
+from blueprints.campaigns.lifecycle import LifecycleScheduler
 
 # Import de la configuration et de la base de données
 from config import Config
@@ -42,6 +46,16 @@ logging.basicConfig(
 # Initialisation de la base de données
 init_db()
 
+def start_background_tasks():
+    """Tâches de fond du serveur web, lancées par worker (gunicorn.conf.py) ou par le
+    serveur de développement, jamais par les commandes 'flask ...'"""
+    # Index des quasi-doublons de preuves, construit en arrière-plan
+    proof_hash_index.warm_up()
+
+    # Statuts des campagnes tenus à jour d'après leurs dates (un seul worker à la fois)
+    if Config.CAMPAIGN_LIFECYCLE_ENABLED:
+        LifecycleScheduler(Config.CAMPAIGN_LIFECYCLE_INTERVAL_SECONDS).start()
+
 # Enregistrement des blueprints
 app.register_blueprint(auth_bp, url_prefix='/auth')
 app.register_blueprint(admin_bp, url_prefix='/admin')
@@ -55,6 +69,14 @@ app.register_blueprint(hr_bp, url_prefix='/hr')
 app.register_blueprint(finance_bp, url_prefix='/finance')
 app.register_blueprint(main_bp, url_prefix='/dashboard')
 app.register_blueprint(location_bp, url_prefix='/location')
+app.register_blueprint(search_bp, url_prefix='/search')
+
+# Commandes CLI (flask <groupe> <commande>)
+app.cli.add_command(audit_cli)
+app.cli.add_command(campaigns_cli)
+app.cli.add_command(finance_cli)
+app.cli.add_command(geo_cli)
+app.cli.add_command(sites_cli)
 
 @app.before_request
 def before_request():
@@ -244,5 +266,9 @@ if __name__ == '__main__':
     os.makedirs('logs', exist_ok=True)
     os.makedirs('static/uploads', exist_ok=True)
     
+    # Tâches de fond dans le processus servant les requêtes (pas dans le superviseur du reloader)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_tasks()
+    
     # Lancement de l'application
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -6,6 +6,7 @@ from blueprints.auth.utils import hash_password
 from datetime import datetime, timedelta
 import json
 from utils.decorators import login_required, admin_required, permission_required
+from utils.pagination import get_page_size, decode_cursor, keyset_condition, build_page
 
 @admin_bp.route('/dashboard')
 @login_required
@@ -461,9 +462,71 @@ def entities():
 @login_required
 @admin_required
 def audit_logs():
-    """Afficher les logs d’audit"""
-    logs = execute_query("SELECT * FROM audit_logs ORDER BY created_at DESC", fetch_all=True)
-    return render_template('admin/audit_logs.html', logs=logs)
+    """Afficher les logs d’audit (chargés page par page via l'API)"""
+    users_list = execute_query("""
+        SELECT id, first_name || ' ' || last_name as name
+        FROM users
+        ORDER BY name
+    """, fetch_all=True)
+    return render_template('admin/audit_logs.html', users=users_list)
+
+@admin_bp.route('/api/audit-logs')
+@login_required
+@admin_required
+def api_audit_logs():
+    """Logs d'audit paginés par curseur sur (created_at, id)"""
+    conditions = []
+    params = []
+
+    try:
+        if request.args.get('user_id'):
+            conditions.append("a.user_id = %s")
+            params.append(int(request.args['user_id']))
+
+        if request.args.get('action'):
+            conditions.append("a.action = %s")
+            params.append(request.args['action'])
+
+        if request.args.get('resource_type'):
+            conditions.append("a.resource_type = %s")
+            params.append(request.args['resource_type'])
+
+        # Bornes de dates : permettent l'élagage des partitions mensuelles
+        if request.args.get('date_from'):
+            conditions.append("a.created_at >= %s")
+            params.append(request.args['date_from'])
+
+        if request.args.get('date_to'):
+            conditions.append("a.created_at < %s::date + 1")
+            params.append(request.args['date_to'])
+
+        cursor = decode_cursor(request.args.get('cursor'), 2)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if cursor:
+        condition, cursor_params = keyset_condition(['a.created_at', 'a.id'], cursor)
+        conditions.append(condition)
+        params.extend(cursor_params)
+
+    limit = get_page_size(request.args.get('limit'))
+    params.append(limit + 1)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    try:
+        logs = execute_query(f"""
+            SELECT a.*, u.first_name || ' ' || u.last_name as user_name
+            FROM audit_logs a
+            LEFT JOIN users u ON a.user_id = u.id
+            {where}
+            ORDER BY a.created_at DESC, a.id DESC
+            LIMIT %s
+        """, params, fetch_all=True)
+
+        logs, next_cursor = build_page(logs, limit, ['created_at', 'id'])
+        return jsonify({'success': True, 'items': logs, 'next_cursor': next_cursor})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 
 @admin_bp.route('/settings')
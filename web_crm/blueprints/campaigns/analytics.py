@@ -0,0 +1,181 @@
+from datetime import date, timedelta
+
+from database.db import execute_query, get_db_cursor, release_connection
+
+BUCKETS = {'day': 1, 'week': 7}
+
+# Une preuve reçue : +1 preuve pour (campagne, partenaire, jour) et le site rejoint
+# la liste des sites actifs du jour
+RECORD_UPLOAD_SQL = """
+    INSERT INTO campaign_delivery_daily (campaign_id, partner_id, day, proofs_count, site_ids)
+    VALUES (%(campaign_id)s, %(partner_id)s, %(day)s, 1, ARRAY[%(site_id)s]::int[])
+    ON CONFLICT (campaign_id, partner_id, day) DO UPDATE
+    SET proofs_count = campaign_delivery_daily.proofs_count + 1,
+        site_ids = CASE WHEN %(site_id)s = ANY(campaign_delivery_daily.site_ids)
+                        THEN campaign_delivery_daily.site_ids
+                        ELSE campaign_delivery_daily.site_ids || %(site_id)s END
+"""
+
+# Preuves passées à (delta = 1) ou sorties de (delta = -1) l'état validé, comptées sur leur jour d'upload
+RECORD_VALIDATIONS_SQL = """
+    INSERT INTO campaign_delivery_daily (campaign_id, partner_id, day, validated_count)
+    SELECT campaign_id, partner_id, upload_date::date, %(delta)s * COUNT(*)
+    FROM campaign_proofs
+    WHERE id = ANY(%(proof_ids)s::int[])
+    GROUP BY campaign_id, partner_id, upload_date::date
+    ON CONFLICT (campaign_id, partner_id, day) DO UPDATE
+    SET validated_count = campaign_delivery_daily.validated_count + EXCLUDED.validated_count
+"""
+
+REBUILD_SQL = """
+    INSERT INTO campaign_delivery_daily (campaign_id, partner_id, day, proofs_count, validated_count, site_ids)
+    SELECT campaign_id, partner_id, upload_date::date, COUNT(*),
+           COUNT(*) FILTER (WHERE status = 'approved'),
+           COALESCE(array_agg(DISTINCT site_id) FILTER (WHERE site_id IS NOT NULL), '{}')
+    FROM campaign_proofs
+    WHERE campaign_id IS NOT NULL AND partner_id IS NOT NULL
+    AND (%(campaign_id)s::int IS NULL OR campaign_id = %(campaign_id)s::int)
+    GROUP BY campaign_id, partner_id, upload_date::date
+"""
+
+# Séries par partenaire et par tranche : ne lit que l'agrégat (une ligne par partenaire
+# et par jour), quel que soit le nombre de preuves de la campagne
+SERIES_SQL = """
+    WITH daily AS (
+        SELECT * FROM campaign_delivery_daily
+        WHERE campaign_id = %(campaign_id)s
+        AND (%(partner_id)s::int IS NULL OR partner_id = %(partner_id)s::int)
+    ),
+    totals AS (
+        SELECT date_trunc(%(bucket)s, day)::date as period, partner_id,
+               SUM(proofs_count) as proofs, SUM(validated_count) as validated
+        FROM daily
+        GROUP BY 1, 2
+    ),
+    sites AS (
+        SELECT date_trunc(%(bucket)s, daily.day)::date as period, daily.partner_id,
+               COUNT(DISTINCT s.site_id) as active_sites
+        FROM daily
+        CROSS JOIN LATERAL unnest(daily.site_ids) s(site_id)
+        GROUP BY 1, 2
+    )
+    SELECT totals.*, COALESCE(sites.active_sites, 0) as active_sites
+    FROM totals
+    LEFT JOIN sites ON sites.period = totals.period AND sites.partner_id = totals.partner_id
+    ORDER BY totals.period
+"""
+
+# Partenaires de la campagne avec leurs sites affectés et leur couverture sur toute la période
+PARTNERS_SQL = """
+    SELECT e.id as partner_id, e.name as partner_name,
+           (SELECT COUNT(*) FROM campaign_sites cs
+            WHERE cs.campaign_id = %(campaign_id)s AND cs.entity_id = e.id) as assigned_sites,
+           cover.covered_sites, cover.last_proof_day
+    FROM campaign_revenue_distribution crd
+    JOIN entities e ON crd.entity_id = e.id AND e.type = 'partner'
+    CROSS JOIN LATERAL (
+        SELECT COUNT(DISTINCT s.site_id) as covered_sites, MAX(d.day) as last_proof_day
+        FROM campaign_delivery_daily d
+        LEFT JOIN LATERAL unnest(d.site_ids) s(site_id) ON TRUE
+        WHERE d.campaign_id = crd.campaign_id AND d.partner_id = e.id
+    ) cover
+    WHERE crd.campaign_id = %(campaign_id)s
+    AND (%(partner_id)s::int IS NULL OR e.id = %(partner_id)s::int)
+"""
+
+
+def record_upload(cur, campaign_id, partner_id, site_id, day):
+    """Compte une nouvelle preuve dans l'agrégat (dans la transaction de `cur`)"""
+    cur.execute(RECORD_UPLOAD_SQL, {
+        'campaign_id': campaign_id, 'partner_id': partner_id, 'site_id': int(site_id), 'day': day,
+    })
+
+
+def record_validations(cur, proof_ids, delta):
+    """Répercute des validations (delta 1) ou annulations (delta -1) (dans la transaction de `cur`)"""
+    if proof_ids:
+        cur.execute(RECORD_VALIDATIONS_SQL, {'proof_ids': list(proof_ids), 'delta': delta})
+
+
+def rebuild(campaign_id=None):
+    """Recalcule l'agrégat depuis campaign_proofs (reprise de l'existant); renvoie le nombre de lignes"""
+    conn, cur = get_db_cursor()
+    try:
+        if campaign_id is None:
+            cur.execute("TRUNCATE campaign_delivery_daily")
+        else:
+            cur.execute("DELETE FROM campaign_delivery_daily WHERE campaign_id = %s", (campaign_id,))
+        cur.execute(REBUILD_SQL, {'campaign_id': campaign_id})
+        rows = cur.rowcount
+        conn.commit()
+        return rows
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        release_connection(conn)
+
+
+def _periods(start, end, bucket):
+    """Débuts de tranche de `start` à `end` (semaines ISO commençant le lundi)"""
+    if bucket == 'week':
+        start -= timedelta(days=start.weekday())
+    periods = []
+    while start <= end:
+        periods.append(start)
+        start += timedelta(days=BUCKETS[bucket])
+    return periods
+
+
+def delivery_analytics(campaign, bucket='day', partner_id=None):
+    """Séries (preuves, validées, sites actifs) par partenaire, une valeur par tranche de la période"""
+    params = {'campaign_id': campaign['id'], 'partner_id': partner_id, 'bucket': bucket}
+    rows = execute_query(SERIES_SQL, params, fetch_all=True)
+    partners = execute_query(PARTNERS_SQL, params, fetch_all=True)
+
+    today = date.today()
+    end = min(campaign['end_date'], today) if campaign['start_date'] <= today else campaign['start_date']
+    periods = _periods(campaign['start_date'], end, bucket)
+    elapsed_days = max((min(campaign['end_date'], today) - campaign['start_date']).days + 1, 0)
+
+    values = {(row['partner_id'], row['period']): row for row in rows}
+    results = []
+    for partner in partners:
+        series = []
+        proofs = validated = 0
+        for period in periods:
+            row = values.get((partner['partner_id'], period))
+            point = {
+                'period': period.isoformat(),
+                'proofs': int(row['proofs']) if row else 0,
+                'validated': int(row['validated']) if row else 0,
+                'active_sites': row['active_sites'] if row else 0,
+            }
+            proofs += point['proofs']
+            validated += point['validated']
+            series.append(point)
+
+        assigned = partner['assigned_sites']
+        results.append({
+            'partner_id': partner['partner_id'],
+            'partner_name': partner['partner_name'],
+            'assigned_sites': assigned,
+            'covered_sites': partner['covered_sites'],
+            'coverage': round(partner['covered_sites'] / assigned, 4) if assigned else None,
+            'proofs': proofs,
+            'validated': validated,
+            'last_proof_day': partner['last_proof_day'].isoformat() if partner['last_proof_day'] else None,
+            'days_without_proof': (
+                (today - partner['last_proof_day']).days if partner['last_proof_day'] else elapsed_days
+            ),
+            'series': series,
+        })
+
+    # Partenaires en retard (couverture la plus faible) en premier
+    results.sort(key=lambda item: (item['coverage'] if item['coverage'] is not None else 1, item['partner_name']))
+    return {
+        'bucket': bucket,
+        'periods': [period.isoformat() for period in periods],
+        'partners': results,
+    }
@@ -0,0 +1,110 @@
+import logging
+import threading
+
+from database.db import get_db_cursor, release_connection
+
+# Verrou consultatif : un seul worker gunicorn applique les transitions à la fois
+LIFECYCLE_LOCK_KEY = 720431
+
+# (nom, statuts de départ, condition de date, nouveau statut, type de notification, message).
+# Seule une campagne validée ('scheduled') démarre seule; un brouillon n'est jamais touché.
+# Une campagne en pause n'est pas relancée automatiquement, mais elle est terminée une fois
+# sa date de fin passée.
+TRANSITIONS = (
+    ('started', ('scheduled',), "start_date <= CURRENT_DATE AND end_date >= CURRENT_DATE",
+     'active', 'info', 'La campagne « %s » a démarré'),
+    ('completed', ('scheduled', 'active', 'paused'), "end_date < CURRENT_DATE",
+     'completed', 'success', 'La campagne « %s » est terminée'),
+)
+
+# Mise à jour d'un lot de campagnes et notification du créateur et des utilisateurs
+# du client dans la même requête
+TRANSITION_SQL = """
+    WITH changed AS (
+        UPDATE campaigns SET status = %(status)s, updated_at = CURRENT_TIMESTAMP,
+                             stats_version = stats_version + 1
+        WHERE id IN (
+            SELECT id FROM campaigns
+            WHERE status = ANY(%(from_statuses)s) AND {condition}
+            ORDER BY id
+            LIMIT %(batch_size)s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, name, client_id, created_by
+    ),
+    recipients AS (
+        SELECT id, name, created_by as user_id FROM changed WHERE created_by IS NOT NULL
+        UNION
+        SELECT changed.id, changed.name, u.id
+        FROM changed
+        JOIN users u ON u.entity_id = changed.client_id AND u.is_active = TRUE
+    ),
+    notified AS (
+        INSERT INTO notifications (user_id, type, message)
+        SELECT user_id, %(type)s, format(%(message)s, name) FROM recipients
+    )
+    SELECT id FROM changed
+"""
+
+
+def apply_transitions(batch_size=500):
+    """Fait avancer les campagnes selon leurs dates; renvoie {transition: nombre} ou None
+    si un autre processus détient le verrou"""
+    conn, cur = get_db_cursor()
+    try:
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s) as locked", (LIFECYCLE_LOCK_KEY,))
+        if not cur.fetchone()['locked']:
+            conn.rollback()
+            return None
+
+        counts = {}
+        for name, from_statuses, condition, status, notification_type, message in TRANSITIONS:
+            counts[name] = 0
+            while True:
+                cur.execute(TRANSITION_SQL.format(condition=condition), {
+                    'status': status,
+                    'from_statuses': list(from_statuses),
+                    'batch_size': batch_size,
+                    'type': notification_type,
+                    'message': message,
+                })
+                ids = [row['id'] for row in cur.fetchall()]
+                counts[name] += len(ids)
+                if len(ids) < batch_size:
+                    break
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        release_connection(conn)
+    return counts
+
+
+class LifecycleScheduler:
+    """Thread de fond qui applique les transitions toutes les `interval_seconds`"""
+
+    def __init__(self, interval_seconds, batch_size=500):
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='campaign-lifecycle', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                counts = apply_transitions(self.batch_size)
+                if counts and any(counts.values()):
+                    logging.info(f"Cycle de vie des campagnes : {counts}")
+            except Exception as e:
+                logging.error(f"Cycle de vie des campagnes : {e}")
+            self._stop.wait(self.interval_seconds)
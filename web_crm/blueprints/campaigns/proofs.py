@@ -0,0 +1,205 @@
+import hashlib
+import logging
+import math
+import mimetypes
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from PIL import ExifTags, Image, ImageOps
+from werkzeug.formparser import parse_form_data
+from werkzeug.utils import secure_filename
+
+from config import Config
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'webp'}
+VIDEO_EXTENSIONS = {'mp4', 'mov', 'webm'}
+THUMBNAIL_SIZE = (320, 320)
+# pHash : DCT d'une image 32x32 en niveaux de gris, on garde les 8x8 basses fréquences
+PHASH_SIZE = 32
+HASH_SIZE = 8
+DCT_TABLE = [[math.cos(math.pi * (2 * x + 1) * u / (2 * PHASH_SIZE)) for x in range(PHASH_SIZE)]
+             for u in range(HASH_SIZE)]
+
+# Miniatures générées hors requête : l'upload répond dès que les fichiers sont rangés
+thumbnail_executor = ThreadPoolExecutor(max_workers=Config.PROOF_THUMBNAIL_WORKERS,
+                                        thread_name_prefix='thumbnails')
+
+
+class HashingFile:
+    """Fichier temporaire écrit par morceaux pendant le parsing multipart, haché au fil de l'eau"""
+
+    def __init__(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=folder, suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk):
+        self._sha256.update(chunk)
+        self.size += len(chunk)
+        return self._file.write(chunk)
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+def parse_upload(environ):
+    """Parse le formulaire en écrivant chaque fichier directement dans le dossier des preuves"""
+    writers = []
+
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        writer = HashingFile(os.path.join(Config.PROOF_UPLOAD_FOLDER, 'tmp'))
+        writers.append(writer)
+        return writer
+
+    _, form, files = parse_form_data(environ, stream_factory=stream_factory,
+                                     max_content_length=Config.MAX_CONTENT_LENGTH)
+    return form, files, writers
+
+
+def _extension(filename):
+    name = secure_filename(filename or '')
+    return name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+
+
+def _gps_degrees(values, ref):
+    degrees, minutes, seconds = (float(value) for value in values)
+    value = degrees + minutes / 60 + seconds / 3600
+    return -value if ref in ('S', 'W') else value
+
+
+def read_image_metadata(path):
+    """Dimensions, date de prise de vue et position GPS (EXIF) d'une image"""
+    metadata = {'width': None, 'height': None, 'taken_at': None, 'gps': None}
+    try:
+        with Image.open(path) as image:
+            metadata['width'], metadata['height'] = image.size
+            exif = image.getexif()
+            exif_ifd = exif.get_ifd(ExifTags.IFD.Exif)
+            taken = exif_ifd.get(ExifTags.Base.DateTimeOriginal) or exif.get(ExifTags.Base.DateTime)
+            if taken:
+                metadata['taken_at'] = datetime.strptime(str(taken).strip('\x00 '), '%Y:%m:%d %H:%M:%S').isoformat()
+
+            gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+            if gps.get(ExifTags.GPS.GPSLatitude) and gps.get(ExifTags.GPS.GPSLongitude):
+                metadata['gps'] = {
+                    'lat': _gps_degrees(gps[ExifTags.GPS.GPSLatitude], gps.get(ExifTags.GPS.GPSLatitudeRef)),
+                    'lng': _gps_degrees(gps[ExifTags.GPS.GPSLongitude], gps.get(ExifTags.GPS.GPSLongitudeRef)),
+                }
+    except Exception as e:
+        logging.warning(f"Métadonnées illisibles pour {path}: {e}")
+    return metadata
+
+
+def _bits(values, threshold):
+    value = 0
+    for pixel in values:
+        value = (value << 1) | (pixel > threshold)
+    return value
+
+
+def average_hash(image):
+    """aHash 64 bits : pixels 8x8 comparés à la moyenne"""
+    pixels = list(image.convert('L').resize((HASH_SIZE, HASH_SIZE), Image.LANCZOS).getdata())
+    return _bits(pixels, sum(pixels) / len(pixels))
+
+
+def perceptual_hash(image):
+    """pHash 64 bits : coefficients DCT basses fréquences comparés à leur médiane"""
+    pixels = list(image.convert('L').resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS).getdata())
+    rows = [pixels[y * PHASH_SIZE:(y + 1) * PHASH_SIZE] for y in range(PHASH_SIZE)]
+    # DCT séparable : lignes puis colonnes, limitée aux fréquences conservées
+    row_dct = [[sum(c * p for c, p in zip(cosines, row)) for cosines in DCT_TABLE] for row in rows]
+    coefficients = [sum(cosines[y] * row_dct[y][u] for y in range(PHASH_SIZE))
+                    for cosines in DCT_TABLE for u in range(HASH_SIZE)]
+    return _bits(coefficients, sorted(coefficients)[len(coefficients) // 2])
+
+
+def image_hashes(path):
+    """(aHash, pHash) d'une image, orientation EXIF appliquée; None si illisible"""
+    try:
+        with Image.open(path) as image:
+            image = ImageOps.exif_transpose(image)
+            return average_hash(image), perceptual_hash(image)
+    except Exception as e:
+        logging.warning(f"Hash perceptuel impossible pour {path}: {e}")
+        return None
+
+
+def make_thumbnail(source, target):
+    try:
+        if os.path.exists(target):
+            return
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail(THUMBNAIL_SIZE)
+            image.convert('RGB').save(target + '.tmp', 'JPEG', quality=80)
+        os.replace(target + '.tmp', target)
+    except Exception as e:
+        logging.error(f"Miniature impossible pour {source}: {e}")
+
+
+def proof_path(filename):
+    """Chemin sur disque d'un fichier de preuve enregistré sous 'proofs/...'"""
+    relative = filename.split('/', 1)[1] if filename.startswith('proofs/') else filename
+    return os.path.join(Config.PROOF_UPLOAD_FOLDER, relative)
+
+
+def store_proof_file(file):
+    """Décrit le fichier reçu (SHA-256, métadonnées, hashes) sans le déplacer : il reste dans
+    son fichier temporaire jusqu'à publish_proof_file, après l'enregistrement de la preuve"""
+    writer = file.stream
+    extension = _extension(file.filename)
+    if extension not in IMAGE_EXTENSIONS | VIDEO_EXTENSIONS:
+        raise ValueError(f"Type de fichier non autorisé : {file.filename}")
+
+    writer.close()
+    sha256 = writer.hexdigest()
+    relative = f"{sha256[:2]}/{sha256}.{extension}"
+
+    entry = {
+        'filename': f"proofs/{relative}",
+        'original_name': file.filename,
+        'upload_date': datetime.now().isoformat(),
+        'sha256': sha256,
+        'size': writer.size,
+        'mime_type': mimetypes.guess_type(relative)[0] or file.mimetype,
+        'width': None,
+        'height': None,
+        'taken_at': None,
+        'gps': None,
+        'thumbnail': None,
+        'ahash': None,
+        'phash': None,
+    }
+    if extension in IMAGE_EXTENSIONS:
+        entry.update(read_image_metadata(writer.path))
+        hashes = image_hashes(writer.path)
+        if hashes:
+            entry['ahash'], entry['phash'] = (f"{value:016x}" for value in hashes)
+        entry['thumbnail'] = f"proofs/{sha256[:2]}/{sha256}_thumb.jpg"
+    return entry
+
+
+def publish_proof_file(writer, entry):
+    """Range le fichier sous son SHA-256 (un contenu identique n'est stocké qu'une fois)
+    et lance sa miniature"""
+    path = proof_path(entry['filename'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        writer.discard()
+    else:
+        os.replace(writer.path, path)
+    if entry['thumbnail']:
+        thumbnail_executor.submit(make_thumbnail, path, proof_path(entry['thumbnail']))
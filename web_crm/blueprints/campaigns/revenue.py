@@ -0,0 +1,285 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from database.db import execute_query, get_db_cursor, release_connection
+from .stats import bump_stats_version
+
+# Part de l'admin sur le budget; le reste est réparti entre partenaires au prorata des sites actifs
+ADMIN_SHARE_RATE = Decimal('0.70')
+CENT = Decimal('0.01')
+
+
+def split_budget(budget):
+    """(budget, part admin, part partenaires) arrondis au centime, la somme des parts égale le budget"""
+    budget = Decimal(str(budget)).quantize(CENT, rounding=ROUND_HALF_UP)
+    admin_share = (budget * ADMIN_SHARE_RATE).quantize(CENT, rounding=ROUND_HALF_UP)
+    return budget, admin_share, budget - admin_share
+
+
+# Sites actifs des partenaires rattachés à la campagne (campaign_sites fait foi)
+ASSIGN_SITES_SQL = """
+    WITH added AS (
+        INSERT INTO campaign_sites (campaign_id, site_id, entity_id)
+        SELECT %(campaign_id)s, s.id, s.entity_id
+        FROM sites s
+        JOIN entities e ON s.entity_id = e.id
+        WHERE e.type = 'partner' AND s.is_active = TRUE
+        ON CONFLICT (campaign_id, site_id) DO NOTHING
+        RETURNING site_id
+    )
+    UPDATE campaigns SET sites_count = sites_count + (SELECT COUNT(*) FROM added)
+    WHERE id = %(campaign_id)s
+"""
+
+# Répartition en une requête : pourcentages et montants tronqués au centime, puis les
+# centimes restants vont aux plus forts restes (à égalité, au plus petit entity_id),
+# de sorte que les pourcentages totalisent 100 et les montants partners_share.
+DISTRIBUTE_SQL = """
+    WITH campaign AS (
+        SELECT id, admin_share, partners_share FROM campaigns WHERE id = %(campaign_id)s
+    ),
+    partner_sites AS (
+        SELECT entity_id, COUNT(*) as site_count
+        FROM campaign_sites
+        WHERE campaign_id = %(campaign_id)s
+        GROUP BY entity_id
+    ),
+    exact AS (
+        SELECT ps.entity_id, ps.site_count, c.partners_share,
+               100 * ps.site_count::numeric / SUM(ps.site_count) OVER () as exact_percentage,
+               c.partners_share * ps.site_count / SUM(ps.site_count) OVER () as exact_amount
+        FROM partner_sites ps
+        CROSS JOIN campaign c
+    ),
+    truncated AS (
+        SELECT exact.*,
+               trunc(exact_percentage, 2) as base_percentage,
+               trunc(exact_amount, 2) as base_amount
+        FROM exact
+    ),
+    ranked AS (
+        SELECT truncated.*,
+               (100 - SUM(base_percentage) OVER ()) * 100 as percentage_cents_left,
+               (partners_share - SUM(base_amount) OVER ()) * 100 as amount_cents_left,
+               ROW_NUMBER() OVER (ORDER BY exact_percentage - base_percentage DESC, entity_id) as percentage_rank,
+               ROW_NUMBER() OVER (ORDER BY exact_amount - base_amount DESC, entity_id) as amount_rank
+        FROM truncated
+    )
+    INSERT INTO campaign_revenue_distribution (campaign_id, entity_id, site_count, percentage, amount)
+    SELECT %(campaign_id)s, entity_id, site_count,
+           base_percentage + CASE WHEN percentage_rank <= percentage_cents_left THEN 0.01 ELSE 0 END,
+           base_amount + CASE WHEN amount_rank <= amount_cents_left THEN 0.01 ELSE 0 END
+    FROM ranked
+    UNION ALL
+    SELECT c.id, a.id, 0, %(admin_percentage)s, c.admin_share
+    FROM campaign c
+    CROSS JOIN (SELECT id FROM entities WHERE type = 'admin' ORDER BY id LIMIT 1) a
+"""
+
+
+def distribute_revenue(cur, campaign_id):
+    """Rattache les sites puis insère la répartition partenaires + admin (dans la transaction de `cur`)"""
+    cur.execute(ASSIGN_SITES_SQL, {'campaign_id': campaign_id})
+    cur.execute(DISTRIBUTE_SQL, {
+        'campaign_id': campaign_id,
+        'admin_percentage': ADMIN_SHARE_RATE * 100,
+    })
+    return cur.rowcount
+
+
+QUEUE_REDISTRIBUTION_SQL = """
+    INSERT INTO revenue_redistribution_queue (entity_id)
+    SELECT unnest(%s::int[])
+"""
+
+
+def queue_redistribution(entity_ids, cur=None):
+    """Signale des partenaires dont les sites actifs ont changé (traité par 'flask campaigns redistribute');
+    dans la transaction de `cur` s'il est fourni"""
+    entity_ids = sorted({int(entity_id) for entity_id in entity_ids if entity_id})
+    if not entity_ids:
+        return
+    if cur is not None:
+        cur.execute(QUEUE_REDISTRIBUTION_SQL, (entity_ids,))
+    else:
+        execute_query(QUEUE_REDISTRIBUTION_SQL, (entity_ids,), commit=True)
+
+
+CLAIM_QUEUE_SQL = """
+    UPDATE revenue_redistribution_queue SET processed_at = CURRENT_TIMESTAMP
+    WHERE id IN (
+        SELECT id FROM revenue_redistribution_queue
+        WHERE processed_at IS NULL
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING entity_id
+"""
+
+# Campagnes dont la répartition suit encore les sites : brouillons, planifiées ou actives, non terminées
+AFFECTED_CAMPAIGNS = """
+    SELECT id FROM campaigns
+    WHERE status IN ('draft', 'scheduled', 'active') AND end_date >= CURRENT_DATE
+"""
+
+# Delta sur campaign_sites pour les partenaires modifiés : on retire les sites désactivés
+# ou réaffectés, on ajoute les nouveaux, et sites_count suit le nombre de lignes touchées.
+REMOVE_SITES_SQL = f"""
+    WITH removed AS (
+        DELETE FROM campaign_sites cs
+        USING ({AFFECTED_CAMPAIGNS}) affected
+        WHERE cs.campaign_id = affected.id AND cs.entity_id = ANY(%(entity_ids)s)
+        AND NOT EXISTS (
+            SELECT 1 FROM sites s
+            WHERE s.id = cs.site_id AND s.entity_id = cs.entity_id AND s.is_active = TRUE
+        )
+        RETURNING cs.campaign_id
+    ),
+    delta AS (
+        SELECT campaign_id, COUNT(*) as site_count FROM removed GROUP BY campaign_id
+    )
+    UPDATE campaigns c SET sites_count = c.sites_count - delta.site_count,
+                           stats_version = c.stats_version + 1
+    FROM delta
+    WHERE c.id = delta.campaign_id
+"""
+
+ADD_SITES_SQL = f"""
+    WITH added AS (
+        INSERT INTO campaign_sites (campaign_id, site_id, entity_id)
+        SELECT affected.id, s.id, s.entity_id
+        FROM ({AFFECTED_CAMPAIGNS}) affected
+        CROSS JOIN sites s
+        JOIN entities e ON s.entity_id = e.id
+        WHERE s.entity_id = ANY(%(entity_ids)s) AND s.is_active = TRUE AND e.type = 'partner'
+        ON CONFLICT (campaign_id, site_id) DO NOTHING
+        RETURNING campaign_id
+    ),
+    delta AS (
+        SELECT campaign_id, COUNT(*) as site_count FROM added GROUP BY campaign_id
+    )
+    UPDATE campaigns c SET sites_count = c.sites_count + delta.site_count,
+                           stats_version = c.stats_version + 1
+    FROM delta
+    WHERE c.id = delta.campaign_id
+"""
+
+# Seules les lignes en attente des partenaires modifiés reçoivent leur nouveau nombre
+# de sites (lu dans campaign_sites); les autres partenaires gardent le nombre enregistré
+# et les lignes payées ne bougent pas.
+SYNC_SITE_COUNTS_SQL = f"""
+    WITH counts AS (
+        SELECT affected.id as campaign_id, e.id as entity_id, COUNT(cs.site_id) as site_count
+        FROM ({AFFECTED_CAMPAIGNS}) affected
+        CROSS JOIN entities e
+        LEFT JOIN campaign_sites cs ON cs.campaign_id = affected.id AND cs.entity_id = e.id
+        WHERE e.id = ANY(%(entity_ids)s) AND e.type = 'partner'
+        GROUP BY affected.id, e.id
+    ),
+    updated AS (
+        UPDATE campaign_revenue_distribution crd
+        SET site_count = counts.site_count
+        FROM counts
+        WHERE crd.campaign_id = counts.campaign_id AND crd.entity_id = counts.entity_id
+        AND crd.status = 'pending' AND crd.site_count IS DISTINCT FROM counts.site_count
+        RETURNING crd.campaign_id
+    ),
+    inserted AS (
+        INSERT INTO campaign_revenue_distribution (campaign_id, entity_id, site_count, percentage, amount)
+        SELECT counts.campaign_id, counts.entity_id, counts.site_count, 0, 0
+        FROM counts
+        WHERE counts.site_count > 0 AND NOT EXISTS (
+            SELECT 1 FROM campaign_revenue_distribution crd
+            WHERE crd.campaign_id = counts.campaign_id AND crd.entity_id = counts.entity_id
+        )
+        RETURNING campaign_id
+    )
+    SELECT campaign_id FROM updated
+    UNION
+    SELECT campaign_id FROM inserted
+"""
+
+# Réalloue le reste à payer (partners_share moins les parts déjà payées) et le reste des
+# pourcentages (100 moins ceux des parts payées) entre les lignes en attente, au prorata de
+# leurs sites, avec la même règle des plus forts restes que DISTRIBUTE_SQL pour les deux :
+# les pourcentages totalisent 100 et les montants partners_share.
+REALLOCATE_SQL = """
+    WITH partner_rows AS (
+        SELECT crd.id, crd.campaign_id, crd.site_count, crd.status, crd.amount, crd.percentage, c.partners_share
+        FROM campaign_revenue_distribution crd
+        JOIN campaigns c ON crd.campaign_id = c.id
+        JOIN entities e ON crd.entity_id = e.id AND e.type = 'partner'
+        WHERE crd.campaign_id = ANY(%(campaign_ids)s)
+    ),
+    totals AS (
+        SELECT campaign_id,
+               SUM(site_count) FILTER (WHERE status = 'pending') as pending_sites,
+               GREATEST(MAX(partners_share) - COALESCE(SUM(amount) FILTER (WHERE status = 'paid'), 0), 0) as pending_pool,
+               GREATEST(100 - COALESCE(SUM(percentage) FILTER (WHERE status = 'paid'), 0), 0) as percentage_pool
+        FROM partner_rows
+        GROUP BY campaign_id
+    ),
+    exact AS (
+        SELECT r.id, r.campaign_id,
+               CASE WHEN t.pending_sites > 0 THEN t.pending_pool ELSE 0 END as pending_pool,
+               CASE WHEN t.pending_sites > 0 THEN t.percentage_pool ELSE 0 END as percentage_pool,
+               CASE WHEN t.pending_sites > 0 THEN t.percentage_pool * r.site_count / t.pending_sites ELSE 0 END as exact_percentage,
+               CASE WHEN t.pending_sites > 0 THEN t.pending_pool * r.site_count / t.pending_sites ELSE 0 END as exact_amount
+        FROM partner_rows r
+        JOIN totals t ON r.campaign_id = t.campaign_id
+        WHERE r.status = 'pending'
+    ),
+    truncated AS (
+        SELECT exact.*,
+               trunc(exact_percentage, 2) as base_percentage,
+               trunc(exact_amount, 2) as base_amount
+        FROM exact
+    ),
+    ranked AS (
+        SELECT truncated.id, base_percentage, base_amount,
+               (percentage_pool - SUM(base_percentage) OVER (PARTITION BY campaign_id)) * 100 as percentage_cents_left,
+               (pending_pool - SUM(base_amount) OVER (PARTITION BY campaign_id)) * 100 as amount_cents_left,
+               ROW_NUMBER() OVER (PARTITION BY campaign_id
+                                  ORDER BY exact_percentage - base_percentage DESC, id) as percentage_rank,
+               ROW_NUMBER() OVER (PARTITION BY campaign_id
+                                  ORDER BY exact_amount - base_amount DESC, id) as amount_rank
+        FROM truncated
+    )
+    UPDATE campaign_revenue_distribution crd
+    SET percentage = ranked.base_percentage + CASE WHEN ranked.percentage_rank <= ranked.percentage_cents_left THEN 0.01 ELSE 0 END,
+        amount = ranked.base_amount + CASE WHEN ranked.amount_rank <= ranked.amount_cents_left THEN 0.01 ELSE 0 END
+    FROM ranked
+    WHERE crd.id = ranked.id AND crd.status = 'pending'
+"""
+
+
+def redistribute_pending(batch_size=100):
+    """Traite la file par lots de `batch_size` partenaires; renvoie (partenaires, campagnes recalculées)"""
+    partners = campaigns = 0
+    while True:
+        conn, cur = get_db_cursor()
+        try:
+            cur.execute(CLAIM_QUEUE_SQL, (batch_size,))
+            entity_ids = sorted({row['entity_id'] for row in cur.fetchall()})
+            if not entity_ids:
+                conn.commit()
+                return partners, campaigns
+
+            params = {'entity_ids': entity_ids}
+            cur.execute(REMOVE_SITES_SQL, params)
+            cur.execute(ADD_SITES_SQL, params)
+            cur.execute(SYNC_SITE_COUNTS_SQL, params)
+            campaign_ids = [row['campaign_id'] for row in cur.fetchall()]
+            if campaign_ids:
+                cur.execute(REALLOCATE_SQL, {'campaign_ids': campaign_ids})
+                bump_stats_version(cur, campaign_ids)
+            conn.commit()
+
+            partners += len(entity_ids)
+            campaigns += len(campaign_ids)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            release_connection(conn)
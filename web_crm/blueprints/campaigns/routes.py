@@ -1,9 +1,19 @@
-from flask import render_template, request, jsonify, flash, redirect, url_for, g
+from flask import render_template, request, jsonify, flash, redirect, url_for, g, send_file
 from . import campaigns_bp
-from database.db import execute_query
+from database.db import execute_query, get_db_cursor, release_connection
 from utils.decorators import login_required, permission_required
+from utils.pagination import get_page_size, decode_cursor, keyset_condition, build_page
+from .revenue import split_budget, distribute_revenue
+from .settlement import settle, IdempotencyConflict
+from .proofs import parse_upload, proof_path, publish_proof_file, store_proof_file
+from .similarity import proof_files, proof_hash_index, save_hashes, to_unsigned
+from . import stats as campaign_stats_cache
+from .analytics import BUCKETS, delivery_analytics, record_upload, record_validations
+from config import Config
 from datetime import datetime
+from decimal import InvalidOperation
 import json
+import os
 
 @campaigns_bp.route('/')
 @login_required
@@ -35,15 +45,12 @@ def index():
     print(f"DEBUG - Final user_role: {user_role}")
     
     if user_role == 'client':
+        # sites_count est maintenu sur campaigns (voir campaign_sites)
         campaigns = execute_query(""" 
-            SELECT c.*, e.name as client_name,
-                   COUNT(DISTINCT s.id) as sites_count
+            SELECT c.*, e.name as client_name
             FROM campaigns c
             LEFT JOIN entities e ON c.client_id = e.id
-            LEFT JOIN campaign_revenue_distribution crd ON c.id = crd.campaign_id
-            LEFT JOIN sites s ON crd.entity_id = s.entity_id
             WHERE c.client_id = %s
-            GROUP BY c.id, e.name
             ORDER BY c.created_at DESC
         """, (g.user['entity_id'],), fetch_all=True)
     elif user_role == 'partner':
@@ -124,9 +131,10 @@ def create():
         if not data:
             return jsonify({'success': False, 'error': 'Données JSON manquantes'}), 400
         
-        budget = float(data.get('budget', 0))
-        admin_share = budget * 0.7
-        partners_share = budget * 0.3
+        try:
+            budget, admin_share, partners_share = split_budget(data.get('budget', 0))
+        except InvalidOperation:
+            return jsonify({'success': False, 'error': 'Budget invalide'}), 400
         
         # DEBUG: Afficher la structure de g.user pour comprendre
         print("DEBUG - g.user structure:", dict(g.user))
@@ -146,63 +154,37 @@ def create():
             if not data.get(field):
                 return jsonify({'success': False, 'error': f'Le champ {field} est obligatoire'}), 400
         
-        # Créer la campagne
-        campaign_id = execute_query("""
-            INSERT INTO campaigns (
-                name, client_id, budget, admin_share, partners_share,
-                start_date, end_date, status, creative_assets, targeting, created_by
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """, (
-            data.get('name'),
-            client_id,
-            budget,
-            admin_share,
-            partners_share,
-            data.get('start_date'),
-            data.get('end_date'),
-            'draft',
-            json.dumps(data.get('creative_assets', [])),
-            json.dumps(data.get('targeting', {})),
-            g.user['id']
-        ), fetch_one=True, commit=True)['id']
-        
-        # Calculer la répartition pour les partenaires
-        partners_sites = execute_query("""
-            SELECT e.id as entity_id, COUNT(s.id) as site_count
-            FROM entities e
-            JOIN sites s ON e.id = s.entity_id
-            WHERE e.type = 'partner' AND s.is_active = TRUE
-            GROUP BY e.id
-        """, fetch_all=True)
-        
-        total_sites = sum(p['site_count'] for p in partners_sites)
-        
-        if total_sites > 0:
-            for partner in partners_sites:
-                percentage = (partner['site_count'] / total_sites) * 100
-                amount = partners_share * (percentage / 100)
-                
-                execute_query("""
-                    INSERT INTO campaign_revenue_distribution (
-                        campaign_id, entity_id, site_count, percentage, amount
-                    ) VALUES (%s, %s, %s, %s, %s)
-                """, (
-                    campaign_id,
-                    partner['entity_id'],
-                    partner['site_count'],
-                    percentage,
-                    amount
-                ), commit=True)
-        
-        # Ajouter la part admin
-        admin_entity = execute_query("SELECT id FROM entities WHERE type = 'admin' LIMIT 1", fetch_one=True)
-        if admin_entity:
-            execute_query("""
-                INSERT INTO campaign_revenue_distribution (
-                    campaign_id, entity_id, site_count, percentage, amount
-                ) VALUES (%s, %s, 0, 70, %s)
-            """, (campaign_id, admin_entity['id'], admin_share), commit=True)
+        # Campagne et répartition dans une même transaction (2 requêtes quel que soit le nombre de partenaires)
+        conn, cur = get_db_cursor()
+        try:
+            cur.execute("""
+                INSERT INTO campaigns (
+                    name, client_id, budget, admin_share, partners_share,
+                    start_date, end_date, status, creative_assets, targeting, created_by
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            """, (
+                data.get('name'),
+                client_id,
+                budget,
+                admin_share,
+                partners_share,
+                data.get('start_date'),
+                data.get('end_date'),
+                'draft',
+                json.dumps(data.get('creative_assets', [])),
+                json.dumps(data.get('targeting', {})),
+                g.user['id']
+            ))
+            campaign_id = cur.fetchone()['id']
+            distribute_revenue(cur, campaign_id)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            release_connection(conn)
         
         return jsonify({'success': True, 'id': campaign_id})
         
@@ -271,30 +253,24 @@ def api_campaign_detail(campaign_id):
             ORDER BY crd.amount DESC
         """, (campaign_id,), fetch_all=True)
     
-    # Sites concernés - filtrer pour les partenaires
+    # Sites concernés (campaign_sites) - filtrer pour les partenaires
     if user_role == 'partner':
         sites = execute_query("""
             SELECT s.*, cities.name as city_name, e.name as entity_name
-            FROM sites s
-            JOIN cities ON s.city_id = cities.geonameid
-            JOIN entities e ON s.entity_id = e.id
-            WHERE s.entity_id = %s AND e.id IN (
-                SELECT entity_id FROM campaign_revenue_distribution 
-                WHERE campaign_id = %s
-            )
-        """, (g.user['entity_id'], campaign_id), fetch_all=True)
+            FROM campaign_sites cs
+            JOIN sites s ON cs.site_id = s.id
+            LEFT JOIN cities ON s.city_id = cities.geonameid
+            JOIN entities e ON cs.entity_id = e.id
+            WHERE cs.campaign_id = %s AND cs.entity_id = %s
+        """, (campaign_id, g.user['entity_id']), fetch_all=True)
     else:
         sites = execute_query("""
             SELECT s.*, cities.name as city_name, e.name as entity_name
-            FROM sites s
-            JOIN cities ON s.city_id = cities.geonameid
-            JOIN entities e ON s.entity_id = e.id
-            WHERE e.id IN (
-                SELECT entity_id FROM campaign_revenue_distribution 
-                WHERE campaign_id = %s AND entity_id != (
-                    SELECT id FROM entities WHERE type = 'admin' LIMIT 1
-                )
-            )
+            FROM campaign_sites cs
+            JOIN sites s ON cs.site_id = s.id
+            LEFT JOIN cities ON s.city_id = cities.geonameid
+            JOIN entities e ON cs.entity_id = e.id
+            WHERE cs.campaign_id = %s
         """, (campaign_id,), fetch_all=True)
     
     return jsonify({
@@ -324,56 +300,117 @@ def upload_campaign_proof(campaign_id):
         if not has_access:
             return jsonify({'error': 'Accès non autorisé à cette campagne'}), 403
         
-        # Récupérer les fichiers
-        if 'proof_images' not in request.files:
-            return jsonify({'error': 'Aucun fichier fourni'}), 400
-        
-        files = request.files.getlist('proof_images')
-        site_id = request.form.get('site_id')
-        
-        if not site_id:
-            return jsonify({'error': 'Site ID requis'}), 400
-        
-        # Vérifier que le site appartient au partenaire
-        site_belongs = execute_query("""
-            SELECT 1 FROM sites 
-            WHERE id = %s AND entity_id = %s
-        """, (site_id, g.user['entity_id']), fetch_one=True)
-        
-        if not site_belongs:
-            return jsonify({'error': 'Site non autorisé'}), 403
-        
-        # Traiter les fichiers (à adapter selon votre système de stockage)
-        uploaded_files = []
-        for file in files:
-            if file.filename == '':
-                continue
+        # Fichiers écrits sur disque et hachés pendant la lecture du corps de la requête
+        form, files, writers = parse_upload(request.environ)
+        try:
+            if 'proof_images' not in files:
+                return jsonify({'error': 'Aucun fichier fourni'}), 400
+            
+            site_id = form.get('site_id')
+            
+            if not site_id:
+                return jsonify({'error': 'Site ID requis'}), 400
+            
+            # Vérifier que le site appartient au partenaire
+            site_belongs = execute_query("""
+                SELECT 1 FROM sites 
+                WHERE id = %s AND entity_id = %s
+            """, (site_id, g.user['entity_id']), fetch_one=True)
+            
+            if not site_belongs:
+                return jsonify({'error': 'Site non autorisé'}), 403
             
-            # Ici vous devriez sauvegarder le fichier et stocker le chemin
-            # Exemple simplifié :
-            filename = f"campaign_{campaign_id}_site_{site_id}_{file.filename}"
-            # file.save(os.path.join('uploads', filename))
+            # Tous les fichiers sont validés avant d'en ranger un seul
+            uploaded_files = []
+            staged = []
+            seen = set()
+            try:
+                for file in files.getlist('proof_images'):
+                    if file.filename == '':
+                        continue
+                    entry = store_proof_file(file)
+                    if entry['sha256'] in seen:
+                        continue
+                    seen.add(entry['sha256'])
+                    
+                    # Même contenu déjà envoyé comme preuve (index GIN sur proof_data)
+                    duplicates = execute_query("""
+                        SELECT id FROM campaign_proofs WHERE proof_data @> %s::jsonb
+                    """, (json.dumps([{'sha256': entry['sha256']}]),), fetch_all=True)
+                    entry['duplicate_of'] = [row['id'] for row in duplicates]
+                    
+                    # Copie retouchée d'une image déjà reçue (pHash à quelques bits près)
+                    entry['similar_to'] = []
+                    if entry['phash']:
+                        entry['similar_to'] = [
+                            match for match in proof_hash_index.similar(int(entry['phash'], 16), Config.PROOF_PHASH_THRESHOLD)
+                            if match['proof_id'] not in entry['duplicate_of']
+                        ]
+                    uploaded_files.append(entry)
+                    staged.append((file.stream, entry))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            if not uploaded_files:
+                return jsonify({'error': 'Aucun fichier fourni'}), 400
+            
+            # Les preuves supprimées depuis le chargement de l'index ne sont pas signalées
+            similar_ids = list({match['proof_id'] for entry in uploaded_files for match in entry['similar_to']})
+            if similar_ids:
+                existing = execute_query("""
+                    SELECT id FROM campaign_proofs WHERE id = ANY(%s)
+                """, (similar_ids,), fetch_all=True)
+                existing = {row['id'] for row in existing}
+                for entry in uploaded_files:
+                    entry['similar_to'] = [match for match in entry['similar_to'] if match['proof_id'] in existing]
+            
+            # Enregistrer la preuve et les hashes de ses images dans la même transaction
+            conn, cur = get_db_cursor()
+            try:
+                cur.execute("""
+                    INSERT INTO campaign_proofs 
+                    (campaign_id, site_id, partner_id, proof_data, uploaded_by)
+                    VALUES (%s, %s, %s, %s, %s)
+                    RETURNING id, upload_date
+                """, (
+                    campaign_id,
+                    site_id,
+                    g.user['entity_id'],
+                    json.dumps(uploaded_files),
+                    g.user['id']
+                ))
+                proof = cur.fetchone()
+                proof_id = proof['id']
+                hashes = save_hashes(cur, proof_id, uploaded_files)
+                record_upload(cur, campaign_id, g.user['entity_id'], site_id, proof['upload_date'].date())
+                campaign_stats_cache.bump_stats_version(cur, [campaign_id])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+                release_connection(conn)
             
-            uploaded_files.append({
-                'filename': filename,
-                'original_name': file.filename,
-                'upload_date': datetime.now().isoformat()
-            })
+            # Fichiers rangés seulement une fois la preuve enregistrée
+            for writer, entry in staged:
+                publish_proof_file(writer, entry)
+        finally:
+            # Fichiers temporaires non rangés (requête rejetée ou échec de l'enregistrement)
+            for writer in writers:
+                writer.discard()
         
-        # Enregistrer dans la base de données
-        execute_query("""
-            INSERT INTO campaign_proofs 
-            (campaign_id, site_id, partner_id, proof_data, uploaded_by)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (
-            campaign_id,
-            site_id,
-            g.user['entity_id'],
-            json.dumps(uploaded_files),
-            g.user['id']
-        ), commit=True)
+        for row in hashes:
+            proof_hash_index.added(row['id'], row['proof_id'], to_unsigned(row['phash']), row['created_at'])
         
-        return jsonify({'success': True, 'message': 'Preuves uploadées avec succès'})
+        return jsonify({
+            'success': True,
+            'message': 'Preuves uploadées avec succès',
+            'proof_id': proof_id,
+            'files': uploaded_files,
+            'duplicates': sum(1 for entry in uploaded_files if entry['duplicate_of']),
+            'similar': sum(1 for entry in uploaded_files if entry['similar_to'])
+        })
         
     except Exception as e:
         print(f"Error uploading proof: {str(e)}")
@@ -402,12 +439,11 @@ def get_partner_sites(campaign_id):
     # Récupérer les sites du partenaire pour cette campagne
     sites = execute_query("""
         SELECT s.id, s.name, cities.name as city_name
-        FROM sites s
-        JOIN cities ON s.city_id = cities.geonameid
-        WHERE s.entity_id = %s AND s.id IN (
-            SELECT site_id FROM campaign_sites WHERE campaign_id = %s
-        )
-    """, (g.user['entity_id'], campaign_id), fetch_all=True)
+        FROM campaign_sites cs
+        JOIN sites s ON cs.site_id = s.id
+        LEFT JOIN cities ON s.city_id = cities.geonameid
+        WHERE cs.campaign_id = %s AND cs.entity_id = %s
+    """, (campaign_id, g.user['entity_id']), fetch_all=True)
     
     return jsonify(sites)
 
@@ -418,13 +454,29 @@ def activate_campaign(campaign_id):
     """Activer une campagne"""
     try:
         execute_query("""
-            UPDATE campaigns SET status = 'active' WHERE id = %s
+            UPDATE campaigns SET status = 'active', stats_version = stats_version + 1 WHERE id = %s
         """, (campaign_id,), commit=True)
         
         return jsonify({'success': True, 'message': 'Campagne activée avec succès'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@campaigns_bp.route('/<int:campaign_id>/schedule', methods=['POST'])
+@login_required
+@permission_required('campaigns', 'write')
+def schedule_campaign(campaign_id):
+    """Valider un brouillon : la campagne démarrera seule à sa date de début"""
+    campaign = execute_query("""
+        UPDATE campaigns SET status = 'scheduled', updated_at = CURRENT_TIMESTAMP,
+                             stats_version = stats_version + 1
+        WHERE id = %s AND status = 'draft'
+        RETURNING id
+    """, (campaign_id,), fetch_one=True, commit=True)
+    if not campaign:
+        return jsonify({'success': False, 'error': 'Seuls les brouillons peuvent être planifiés'}), 400
+    
+    return jsonify({'success': True, 'message': 'Campagne planifiée avec succès'})
+
 @campaigns_bp.route('/<int:campaign_id>/pause', methods=['POST'])
 @login_required
 @permission_required('campaigns', 'write')
@@ -432,7 +484,7 @@ def pause_campaign(campaign_id):
     """Mettre une campagne en pause"""
     try:
         execute_query("""
-            UPDATE campaigns SET status = 'paused' WHERE id = %s
+            UPDATE campaigns SET status = 'paused', stats_version = stats_version + 1 WHERE id = %s
         """, (campaign_id,), commit=True)
         
         return jsonify({'success': True, 'message': 'Campagne mise en pause avec succès'})
@@ -446,7 +498,7 @@ def complete_campaign(campaign_id):
     """Marquer une campagne comme terminée"""
     try:
         execute_query("""
-            UPDATE campaigns SET status = 'completed' WHERE id = %s
+            UPDATE campaigns SET status = 'completed', stats_version = stats_version + 1 WHERE id = %s
         """, (campaign_id,), commit=True)
         
         return jsonify({'success': True, 'message': 'Campagne terminée avec succès'})
@@ -468,7 +520,7 @@ def resume_campaign(campaign_id):
     
     # Mise à jour du statut
     execute_query(
-        "UPDATE campaigns SET status = %s, updated_at = %s WHERE id = %s",
+        "UPDATE campaigns SET status = %s, updated_at = %s, stats_version = stats_version + 1 WHERE id = %s",
         ('active', datetime.utcnow(), campaign_id),
         commit=True
     )
@@ -492,14 +544,20 @@ def delete_campaign(campaign_id):
         if user_role == 'client' and campaign['client_id'] != g.user['entity_id']:
             return jsonify({'success': False, 'error': 'Accès non autorisé'}), 403
         
-        # Supprimer d'abord les distributions de revenus
-        execute_query("DELETE FROM campaign_revenue_distribution WHERE campaign_id = %s", (campaign_id,), commit=True)
-        
-        # Supprimer les preuves
-        execute_query("DELETE FROM campaign_proofs WHERE campaign_id = %s", (campaign_id,), commit=True)
-        
-        # Supprimer la campagne
-        execute_query("DELETE FROM campaigns WHERE id = %s", (campaign_id,), commit=True)
+        # Distributions de revenus, preuves puis campagne en une transaction : les statistiques
+        # en cache disparaissent avec la campagne
+        conn, cur = get_db_cursor()
+        try:
+            cur.execute("DELETE FROM campaign_revenue_distribution WHERE campaign_id = %s", (campaign_id,))
+            cur.execute("DELETE FROM campaign_proofs WHERE campaign_id = %s", (campaign_id,))
+            cur.execute("DELETE FROM campaigns WHERE id = %s", (campaign_id,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            release_connection(conn)
         
         return jsonify({'success': True, 'message': 'Campagne supprimée avec succès'})
     except Exception as e:
@@ -537,6 +595,12 @@ def campaign_payment_info(campaign_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def idempotency_key():
+    """Clé fournie par le client (en-tête Idempotency-Key ou champ JSON idempotency_key)"""
+    data = request.get_json(silent=True) or {}
+    key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    return key[:100] if key else None
+
 @campaigns_bp.route('/revenue/<int:revenue_id>/mark-paid', methods=['POST'])
 @login_required
 @permission_required('campaigns', 'write')
@@ -544,82 +608,28 @@ def campaign_payment_info(campaign_id):
 def mark_revenue_paid(revenue_id):
     """Marquer une distribution de revenu comme payée, créer une facture et enregistrer le paiement"""
     try:
-        # Récupérer les informations de la distribution de revenu
-        revenue = execute_query("""
-            SELECT crd.*, c.name as campaign_name, e.name as partner_name
-            FROM campaign_revenue_distribution crd
-            JOIN campaigns c ON crd.campaign_id = c.id
-            JOIN entities e ON crd.entity_id = e.id
-            WHERE crd.id = %s
-        """, (revenue_id,), fetch_one=True)
-        
+        revenue = execute_query("SELECT status, campaign_id FROM campaign_revenue_distribution WHERE id = %s",
+                                (revenue_id,), fetch_one=True)
         if not revenue:
             return jsonify({'success': False, 'error': 'Distribution de revenu introuvable'}), 404
-        
-        # Marquer comme payé
-        execute_query("""
-            UPDATE campaign_revenue_distribution 
-            SET status = 'paid', paid_at = CURRENT_TIMESTAMP
-            WHERE id = %s
-        """, (revenue_id,), commit=True)
-        
-        # Créer une facture dans le module finance
-        invoice_number = f"INV-{datetime.now().strftime('%Y%m%d')}-{revenue_id}"
-        amount_float = float(revenue['amount'])
-        
-        invoice = execute_query("""
-            INSERT INTO invoices (
-                invoice_number, client_id, amount, tax_amount, total_amount,
-                due_date, status, items, created_by, paid_amount
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id, total_amount, paid_amount
-        """, (
-            invoice_number,
-            revenue['entity_id'],
-            amount_float,
-            0,
-            amount_float,
-            datetime.now().date(),
-            'paid',
-            json.dumps([{
-                'description': f"Paiement campagne: {revenue['campaign_name']}",
-                'quantity': 1,
-                'unit_price': amount_float,
-                'total': amount_float
-            }]),
-            g.user['id'],
-            amount_float  # payé immédiatement
-        ), fetch_one=True, commit=True)
-        
-        invoice_id = invoice['id']
-        
-        # Enregistrer le paiement lié
-        execute_query("""
-            INSERT INTO payments (
-                invoice_id, amount, payment_date, payment_method,
-                reference, recorded_by
-            ) VALUES (%s, %s, %s, %s, %s, %s)
-        """, (
-            invoice_id,
-            amount_float,
-            datetime.now().date(),
-            'transfer',
-            f"Paiement campagne #{revenue['campaign_id']}",
-            g.user['id']
-        ), commit=True)
-        
+
+        result = settle(g.user['id'], revenue_ids=[revenue_id], idempotency_key=idempotency_key())
+        if not result['settled'] and not result['replayed']:
+            return jsonify({'success': False, 'error': 'Cette distribution est déjà payée'}), 409
+
         return jsonify({
             'success': True,
             'message': 'Paiement marqué comme effectué et facture créée',
-            'invoice_id': invoice_id,
+            'invoice_id': result['invoices'][0] if result['invoices'] else None,
             'invoice_status': 'paid'
         })
+    except IdempotencyConflict as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
     except Exception as e:
         print(f"Error in mark_revenue_paid: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-
 @campaigns_bp.route('/<int:campaign_id>/mark-all-paid', methods=['POST'])
 @login_required
 @permission_required('campaigns', 'write')
@@ -627,77 +637,36 @@ def mark_revenue_paid(revenue_id):
 def mark_all_paid(campaign_id):
     """Marquer tous les paiements d'une campagne comme effectués, créer les factures et les paiements"""
     try:
-        # Récupérer toutes les distributions non payées
-        revenues = execute_query("""
-            SELECT crd.*, e.name as partner_name, c.name as campaign_name
-            FROM campaign_revenue_distribution crd
-            JOIN entities e ON crd.entity_id = e.id
-            JOIN campaigns c ON crd.campaign_id = c.id
-            WHERE crd.campaign_id = %s AND crd.status != 'paid'
-        """, (campaign_id,), fetch_all=True)
-        
-        created_invoices = []
-
-        for revenue in revenues:
-            amount_float = float(revenue['amount'])
-            
-            # Marquer comme payé
-            execute_query("""
-                UPDATE campaign_revenue_distribution 
-                SET status = 'paid', paid_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-            """, (revenue['id'],), commit=True)
-            
-            # Créer la facture
-            invoice_number = f"INV-{datetime.now().strftime('%Y%m%d')}-{revenue['id']}"
-            
-            invoice = execute_query("""
-                INSERT INTO invoices (
-                    invoice_number, client_id, amount, tax_amount, total_amount,
-                    due_date, status, items, created_by, paid_amount
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id, total_amount, paid_amount
-            """, (
-                invoice_number,
-                revenue['entity_id'],
-                amount_float,
-                0,
-                amount_float,
-                datetime.now().date(),
-                'paid',
-                json.dumps([{
-                    'description': f"Paiement campagne: {revenue['campaign_name']}",
-                    'quantity': 1,
-                    'unit_price': amount_float,
-                    'total': amount_float
-                }]),
-                g.user['id'],
-                amount_float
-            ), fetch_one=True, commit=True)
-
-            invoice_id = invoice['id']
-            created_invoices.append(invoice_id)
-
-            # Enregistrer le paiement lié
-            execute_query("""
-                INSERT INTO payments (
-                    invoice_id, amount, payment_date, payment_method,
-                    reference, recorded_by
-                ) VALUES (%s, %s, %s, %s, %s, %s)
-            """, (
-                invoice_id,
-                amount_float,
-                datetime.now().date(),
-                'transfer',
-                f"Paiement campagne #{campaign_id}",
-                g.user['id']
-            ), commit=True)
-        
+        result = settle(g.user['id'], campaign_ids=[campaign_id], idempotency_key=idempotency_key())
         return jsonify({
             'success': True,
-            'message': f"Tous les paiements ont été marqués comme effectués ({len(revenues)} factures créées)",
-            'invoices': created_invoices
+            'message': f"Tous les paiements ont été marqués comme effectués ({result['settled']} factures créées)",
+            'invoices': result['invoices']
         })
+    except IdempotencyConflict as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@campaigns_bp.route('/settle', methods=['POST'])
+@login_required
+@permission_required('campaigns', 'write')
+@permission_required('finance', 'write')
+def settle_campaigns():
+    """Régler en une transaction les parts impayées d'un lot de campagnes"""
+    data = request.get_json(silent=True) or {}
+    try:
+        campaign_ids = [int(campaign_id) for campaign_id in data.get('campaign_ids', [])]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'campaign_ids invalide'}), 400
+    if not campaign_ids:
+        return jsonify({'success': False, 'error': 'Aucune campagne sélectionnée'}), 400
+
+    try:
+        result = settle(g.user['id'], campaign_ids=campaign_ids, idempotency_key=idempotency_key())
+        return jsonify({'success': True, **result})
+    except IdempotencyConflict as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -708,66 +677,67 @@ def mark_all_paid(campaign_id):
 def campaign_stats(campaign_id):
     """Récupérer les statistiques détaillées d'une campagne"""
     try:
-        # Statistiques de base
-        campaign = execute_query("""
-            SELECT c.*, e.name as client_name,
-                   u.first_name || ' ' || u.last_name as created_by_name
-            FROM campaigns c
-            LEFT JOIN entities e ON c.client_id = e.id
-            LEFT JOIN users u ON c.created_by = u.id
-            WHERE c.id = %s
-        """, (campaign_id,), fetch_one=True)
-        
-        if not campaign:
+        stats = campaign_stats_cache.get_stats(campaign_id)
+        if not stats:
             return jsonify({'success': False, 'error': 'Campagne introuvable'}), 404
         
-        # Répartition des revenus
-        revenue_distribution = execute_query("""
-            SELECT crd.*, e.name as entity_name,
-                   COUNT(cp.id) as proof_count
-            FROM campaign_revenue_distribution crd
-            JOIN entities e ON crd.entity_id = e.id
-            LEFT JOIN campaign_proofs cp ON crd.campaign_id = cp.campaign_id 
-                AND crd.entity_id = cp.partner_id
-            WHERE crd.campaign_id = %s
-            GROUP BY crd.id, e.name
-            ORDER BY crd.amount DESC
-        """, (campaign_id,), fetch_all=True)
-        
-        # Preuves de diffusion
-        proofs = execute_query("""
-            SELECT cp.*, s.name as site_name, 
-                   u.first_name || ' ' || u.last_name as uploaded_by_name
-            FROM campaign_proofs cp
-            LEFT JOIN sites s ON cp.site_id = s.id
-            LEFT JOIN users u ON cp.uploaded_by = u.id
-            WHERE cp.campaign_id = %s
-            ORDER BY cp.upload_date DESC
-        """, (campaign_id,), fetch_all=True)
-        
-        # Statistiques financières
-        financial_stats = execute_query("""
-            SELECT 
-                COUNT(*) as total_distributions,
-                COUNT(CASE WHEN status = 'paid' THEN 1 END) as paid_distributions,
-                SUM(amount) as total_amount,
-                SUM(CASE WHEN status = 'paid' THEN amount ELSE 0 END) as paid_amount,
-                SUM(CASE WHEN status = 'pending' THEN amount ELSE 0 END) as pending_amount
-            FROM campaign_revenue_distribution
-            WHERE campaign_id = %s
-        """, (campaign_id,), fetch_one=True)
+        # Première page des preuves; la suite via /<id>/stats/proofs
+        proofs, next_cursor = campaign_stats_cache.proofs_page(campaign_id, get_page_size(request.args.get('limit')))
         
         return jsonify({
             'success': True,
-            'campaign': campaign,
-            'revenue_distribution': revenue_distribution,
+            **stats,
             'proofs': proofs,
-            'financial_stats': financial_stats
+            'proofs_next_cursor': next_cursor
         })
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@campaigns_bp.route('/<int:campaign_id>/stats/proofs')
+@login_required
+@permission_required('campaigns', 'read')
+def campaign_stats_proofs(campaign_id):
+    """Preuves d'une campagne pour la fenêtre de statistiques (paginé)"""
+    limit = get_page_size(request.args.get('limit'))
+    try:
+        cursor = decode_cursor(request.args.get('cursor'), 2)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    items, next_cursor = campaign_stats_cache.proofs_page(campaign_id, limit, cursor)
+    return jsonify({'success': True, 'items': items, 'next_cursor': next_cursor})
+
+@campaigns_bp.route('/<int:campaign_id>/analytics')
+@login_required
+@permission_required('campaigns', 'read')
+def campaign_analytics(campaign_id):
+    """Preuves, preuves validées et sites actifs par partenaire, par jour ou par semaine"""
+    user_role = g.user.get('role_name') or g.user.get('role')
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in BUCKETS:
+        return jsonify({'success': False, 'error': 'bucket doit valoir day ou week'}), 400
+    
+    campaign = execute_query("""
+        SELECT id, name, client_id, start_date, end_date, status, sites_count
+        FROM campaigns WHERE id = %s
+    """, (campaign_id,), fetch_one=True)
+    if not campaign:
+        return jsonify({'success': False, 'error': 'Campagne introuvable'}), 404
+    
+    # Un partenaire ne voit que ses propres séries, un client que ses campagnes
+    partner_id = None
+    if user_role == 'partner':
+        partner_id = g.user['entity_id']
+    elif user_role == 'client' and campaign['client_id'] != g.user['entity_id']:
+        return jsonify({'success': False, 'error': 'Accès non autorisé'}), 403
+    
+    try:
+        analytics = delivery_analytics(campaign, bucket, partner_id)
+        return jsonify({'success': True, 'campaign': campaign, **analytics})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @campaigns_bp.route('/update-payments', methods=['POST'])
 @login_required
 @permission_required('campaigns', 'write')
@@ -775,15 +745,31 @@ def update_payments():
     """Mettre à jour les statuts de paiement"""
     try:
         data = request.get_json()
-        
-        for update in data.get('updates', []):
-            # CORRECTION: utiliser paid_at au lieu de payment_date
-            execute_query("""
-                UPDATE campaign_revenue_distribution 
-                SET status = %s, 
-                    paid_at = CASE WHEN %s = 'paid' THEN CURRENT_TIMESTAMP ELSE paid_at END
-                WHERE id = %s
-            """, (update['status'], update['status'], update['revenue_id']), commit=True)
+        updates = data.get('updates', [])
+        
+        # Statistiques périmées dans la même transaction (campagnes verrouillées avant leurs
+        # lignes de répartition, comme la redistribution)
+        conn, cur = get_db_cursor()
+        try:
+            cur.execute("""
+                SELECT DISTINCT campaign_id FROM campaign_revenue_distribution WHERE id = ANY(%s::int[])
+            """, ([update['revenue_id'] for update in updates],))
+            campaign_stats_cache.bump_stats_version(cur, [row['campaign_id'] for row in cur.fetchall()])
+            for update in updates:
+                # CORRECTION: utiliser paid_at au lieu de payment_date
+                cur.execute("""
+                    UPDATE campaign_revenue_distribution 
+                    SET status = %s, 
+                        paid_at = CASE WHEN %s = 'paid' THEN CURRENT_TIMESTAMP ELSE paid_at END
+                    WHERE id = %s
+                """, (update['status'], update['status'], update['revenue_id']))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            release_connection(conn)
         
         return jsonify({'success': True, 'message': 'Statuts de paiement mis à jour'})
     except Exception as e:
@@ -811,6 +797,75 @@ def list_proofs(campaign_id):
 
     return jsonify(proofs)
 
+@campaigns_bp.route('/proofs/<int:proof_id>/files/<path:filename>')
+@login_required
+@permission_required('campaigns', 'read')
+def proof_file(proof_id, filename):
+    """Fichier (ou miniature) d'une preuve : équipe interne, partenaire auteur et client de la campagne"""
+    user_role = g.user.get('role_name') or g.user.get('role')
+    proof = execute_query("""
+        SELECT cp.partner_id, cp.proof_data, c.client_id
+        FROM campaign_proofs cp
+        JOIN campaigns c ON cp.campaign_id = c.id
+        WHERE cp.id = %s
+    """, (proof_id,), fetch_one=True)
+    if not proof:
+        return jsonify({'error': 'Preuve introuvable'}), 404
+    
+    # L'équipe interne y accède par sa permission campaigns (read, ou all) vérifiée par le
+    # décorateur; un partenaire ne voit que ses preuves, un client que celles de ses campagnes
+    if user_role == 'partner' and proof['partner_id'] != g.user['entity_id']:
+        return jsonify({'error': 'Accès non autorisé'}), 403
+    if user_role == 'client' and proof['client_id'] != g.user['entity_id']:
+        return jsonify({'error': 'Accès non autorisé'}), 403
+    
+    # Seuls les fichiers déclarés par la preuve sont servis
+    names = {entry.get(key) for entry in proof_files(proof['proof_data']) for key in ('filename', 'thumbnail')}
+    path = proof_path(filename)
+    if filename not in names or not os.path.exists(path):
+        return jsonify({'error': 'Fichier introuvable'}), 404
+    
+    response = send_file(os.path.abspath(path), conditional=True, max_age=0)
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    return response
+
+@campaigns_bp.route('/proofs/review')
+@login_required
+@permission_required('campaigns', 'read')
+def review_queue():
+    """Preuves signalées par la vérification automatique, à revoir par un admin (paginé)"""
+    user_role = g.user.get('role_name') or g.user.get('role')
+    if user_role != 'super_admin':
+        return jsonify({'error': 'Accès réservé aux admins'}), 403
+
+    limit = get_page_size(request.args.get('limit'))
+    try:
+        cursor = decode_cursor(request.args.get('cursor'), 2)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    conditions = ["cp.verification_status = 'needs_review'", "cp.status = 'pending'"]
+    params = []
+    if cursor:
+        condition, values = keyset_condition(['cp.upload_date', 'cp.id'], cursor)
+        conditions.append(condition)
+        params.extend(values)
+
+    rows = execute_query(f"""
+        SELECT cp.id, cp.campaign_id, cp.site_id, cp.upload_date, cp.verification, cp.max_distance_m,
+               c.name as campaign_name, s.name as site_name, e.name as partner_name
+        FROM campaign_proofs cp
+        JOIN campaigns c ON cp.campaign_id = c.id
+        LEFT JOIN sites s ON cp.site_id = s.id
+        LEFT JOIN entities e ON cp.partner_id = e.id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY cp.upload_date DESC, cp.id DESC
+        LIMIT %s
+    """, (*params, limit + 1), fetch_all=True)
+
+    items, next_cursor = build_page(rows, limit, ['upload_date', 'id'])
+    return jsonify({'success': True, 'items': items, 'next_cursor': next_cursor})
+
 @campaigns_bp.route('/proofs/<int:proof_id>/validate', methods=['POST'])
 @login_required
 @permission_required('campaigns', 'write')
@@ -825,11 +880,30 @@ def validate_proof(proof_id):
     if status not in ['approved', 'rejected']:
         return jsonify({'error': 'Status invalide'}), 400
 
-    execute_query("""
-        UPDATE campaign_proofs
-        SET status = %s
-        WHERE id = %s
-    """, (status, proof_id), commit=True)
+    conn, cur = get_db_cursor()
+    try:
+        cur.execute("SELECT campaign_id, status FROM campaign_proofs WHERE id = %s FOR UPDATE", (proof_id,))
+        proof = cur.fetchone()
+        if not proof:
+            conn.rollback()
+            return jsonify({'error': 'Preuve introuvable'}), 404
+        cur.execute("""
+            UPDATE campaign_proofs
+            SET status = %s
+            WHERE id = %s
+        """, (status, proof_id))
+        # Compteur de preuves validées de l'agrégat journalier
+        delta = (status == 'approved') - (proof['status'] == 'approved')
+        if delta:
+            record_validations(cur, [proof_id], delta)
+        campaign_stats_cache.bump_stats_version(cur, [proof['campaign_id']])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        release_connection(conn)
 
     return jsonify({'success': True, 'message': f'Preuve {status}'})
 
@@ -0,0 +1,137 @@
+import json
+
+from blueprints.finance.aging import bump_version as bump_aging_version
+from database.db import get_db_cursor, release_connection
+from utils.numbering import document_prefix, reserve_numbers
+
+
+class IdempotencyConflict(Exception):
+    """Clé d'idempotence déjà utilisée pour un autre périmètre"""
+
+
+# Périme les statistiques des campagnes concernées; les campagnes sont verrouillées avant
+# leurs lignes de répartition, dans le même ordre que la redistribution
+BUMP_STATS_SQL = """
+    UPDATE campaigns SET stats_version = stats_version + 1
+    WHERE id IN (
+        SELECT crd.campaign_id FROM campaign_revenue_distribution crd
+        WHERE crd.status != 'paid'
+        AND (crd.campaign_id = ANY(%(campaign_ids)s::int[]) OR crd.id = ANY(%(revenue_ids)s::int[]))
+    )
+"""
+
+# Verrouille les lignes à régler : un second règlement concurrent attend puis ne voit plus rien
+LOCK_DUE_SQL = """
+    SELECT crd.id FROM campaign_revenue_distribution crd
+    WHERE crd.status != 'paid'
+    AND (crd.campaign_id = ANY(%(campaign_ids)s::int[]) OR crd.id = ANY(%(revenue_ids)s::int[]))
+    ORDER BY crd.id
+    FOR UPDATE
+"""
+
+# Factures, paiements et statuts en une requête; les id de facture sont tirés de la
+# séquence à l'avance pour relier chaque ligne à sa facture et à son paiement
+SETTLE_SQL = """
+    WITH due AS (
+        SELECT crd.id as revenue_id, crd.campaign_id, crd.entity_id, crd.amount, c.name as campaign_name,
+               nextval(pg_get_serial_sequence('invoices', 'id')) as invoice_id,
+               %(first_number)s + ROW_NUMBER() OVER (ORDER BY crd.id) - 1 as number
+        FROM campaign_revenue_distribution crd
+        JOIN campaigns c ON crd.campaign_id = c.id
+        WHERE crd.id = ANY(%(revenue_ids)s)
+    ),
+    created_invoices AS (
+        INSERT INTO invoices (
+            id, invoice_number, client_id, amount, tax_amount, total_amount,
+            invoice_date, due_date, status, items, created_by, paid_amount
+        )
+        SELECT invoice_id, %(prefix)s || '-' || lpad(number::text, 4, '0'), entity_id, amount, 0, amount,
+               CURRENT_DATE, CURRENT_DATE, 'paid',
+               jsonb_build_array(jsonb_build_object(
+                   'description', 'Paiement campagne: ' || campaign_name,
+                   'quantity', 1,
+                   'unit_price', amount,
+                   'total', amount
+               )),
+               %(user_id)s, amount
+        FROM due
+        RETURNING id
+    ),
+    created_payments AS (
+        INSERT INTO payments (invoice_id, amount, payment_date, payment_method, reference, recorded_by)
+        SELECT invoice_id, amount, CURRENT_DATE, 'transfer', 'Paiement campagne #' || campaign_id, %(user_id)s
+        FROM due
+        RETURNING id
+    )
+    UPDATE campaign_revenue_distribution crd
+    SET status = 'paid', paid_at = CURRENT_TIMESTAMP, invoice_id = due.invoice_id
+    FROM due
+    WHERE crd.id = due.revenue_id
+    RETURNING crd.id as revenue_id, crd.campaign_id, due.invoice_id, crd.amount
+"""
+
+
+def _claim_key(cur, key, scope, user_id):
+    """Enregistre la clé; renvoie le résultat déjà stocké si la requête a déjà été traitée"""
+    cur.execute("""
+        INSERT INTO settlement_requests (idempotency_key, scope, created_by)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING idempotency_key
+    """, (key, json.dumps(scope), user_id))
+    if cur.fetchone():
+        return None
+
+    # Conflit : la requête d'origine a été validée (l'INSERT attend sa fin le cas échéant)
+    cur.execute("SELECT scope, result FROM settlement_requests WHERE idempotency_key = %s", (key,))
+    previous = cur.fetchone()
+    if previous['scope'] != scope:
+        raise IdempotencyConflict("Clé d'idempotence déjà utilisée pour un autre règlement")
+    return previous['result']
+
+
+def settle(user_id, campaign_ids=(), revenue_ids=(), idempotency_key=None):
+    """Règle en une transaction les parts impayées des campagnes / lignes données"""
+    scope = {'campaign_ids': sorted(set(campaign_ids)), 'revenue_ids': sorted(set(revenue_ids))}
+    conn, cur = get_db_cursor()
+    try:
+        if idempotency_key:
+            previous = _claim_key(cur, idempotency_key, scope, user_id)
+            if previous is not None:
+                conn.rollback()
+                return dict(previous, replayed=True)
+
+        cur.execute(BUMP_STATS_SQL, scope)
+        cur.execute(LOCK_DUE_SQL, scope)
+        due_ids = [row['id'] for row in cur.fetchall()]
+
+        settled = []
+        if due_ids:
+            prefix = document_prefix('settlement')
+            first_number = reserve_numbers(cur, prefix, len(due_ids))
+            cur.execute(SETTLE_SQL, {
+                'revenue_ids': due_ids,
+                'first_number': first_number,
+                'prefix': prefix,
+                'user_id': user_id,
+            })
+            settled = cur.fetchall()
+            bump_aging_version(cur)
+
+        result = {
+            'settled': len(settled),
+            'invoices': [row['invoice_id'] for row in settled],
+            'revenues': [row['revenue_id'] for row in settled],
+            'total_amount': str(sum(row['amount'] for row in settled)),
+        }
+        if idempotency_key:
+            cur.execute("UPDATE settlement_requests SET result = %s WHERE idempotency_key = %s",
+                        (json.dumps(result), idempotency_key))
+        conn.commit()
+        return dict(result, replayed=False)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        release_connection(conn)
@@ -0,0 +1,275 @@
+import logging
+import os
+import random
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import lru_cache
+from itertools import combinations
+
+from psycopg2.extras import execute_values
+
+from config import Config
+from database.db import execute_query, get_db_cursor, release_connection
+from .proofs import IMAGE_EXTENSIONS, image_hashes, proof_path
+
+HASH_BITS = 64
+# Le hash est découpé en 3 tranches (décalage, largeur) : deux hashes à moins de t bits
+# l'un de l'autre ont forcément une tranche à moins de t // 3 bits (principe des tiroirs)
+CHUNKS = ((0, 22), (22, 21), (43, 21))
+EMPTY = -1
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def to_signed(value):
+    """Hash 64 bits non signé -> BIGINT PostgreSQL"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+@lru_cache(maxsize=None)
+def _masks(width, radius):
+    """Masques XOR d'au plus `radius` bits parmi `width`"""
+    masks = []
+    for bits in range(radius + 1):
+        for positions in combinations(range(width), bits):
+            mask = 0
+            for position in positions:
+                mask |= 1 << position
+            masks.append(mask)
+    return masks
+
+
+class HashIndex:
+    """Index multi-tranches des pHash 64 bits : une table d'entrée par tranche (tableau plat indexé
+    par la valeur de la tranche) et des listes chaînées dans des tableaux, ~60 Mo pour 1M hashes."""
+
+    def __init__(self):
+        self._hashes = array('Q')
+        self._items = array('i')
+        self._heads = [array('i', [EMPTY]) * (1 << width) for _, width in CHUNKS]
+        self._next = [array('i') for _ in CHUNKS]
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add(self, value, item):
+        slot = len(self._hashes)
+        self._hashes.append(value)
+        self._items.append(item)
+        for (shift, width), heads, chain in zip(CHUNKS, self._heads, self._next):
+            key = (value >> shift) & ((1 << width) - 1)
+            chain.append(heads[key])
+            heads[key] = slot
+
+    def search(self, value, threshold):
+        """[(distance, élément)] des hashes à au plus `threshold` bits de `value`, triés par distance"""
+        hashes = self._hashes
+        seen = set()
+        found = []
+        for (shift, width), heads, chain in zip(CHUNKS, self._heads, self._next):
+            key = (value >> shift) & ((1 << width) - 1)
+            for mask in _masks(width, threshold // len(CHUNKS)):
+                slot = heads[key ^ mask]
+                while slot != EMPTY:
+                    if slot not in seen:
+                        seen.add(slot)
+                        distance = (value ^ hashes[slot]).bit_count()
+                        if distance <= threshold:
+                            found.append((distance, self._items[slot]))
+                    slot = chain[slot]
+        found.sort()
+        return found
+
+
+class ProofHashIndex:
+    """Index des pHash des preuves, construit depuis proof_image_hashes au démarrage puis
+    complété par les lignes plus récentes toutes les `sync_seconds` (uploads des autres workers).
+
+    Les uploads concurrents ne committent pas dans l'ordre des ids : chaque synchronisation
+    relit les lignes créées depuis `margin_seconds` avant la plus récente déjà vue, et les
+    ids de cette fenêtre déjà indexés sont ignorés."""
+
+    def __init__(self, sync_seconds, margin_seconds):
+        self.sync_seconds = sync_seconds
+        self.margin = timedelta(seconds=margin_seconds)
+        self._index = None
+        self._latest = None  # created_at le plus récent déjà indexé
+        self._recent = {}  # id -> created_at des hashes indexés dans la fenêtre de relecture
+        self._synced_at = 0
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        """Construit l'index en arrière-plan pour ne pas retarder le démarrage"""
+        threading.Thread(target=self.get, name='proof-hash-index', daemon=True).start()
+
+    def get(self):
+        if self._index is None or time.monotonic() - self._synced_at > self.sync_seconds:
+            with self._lock:
+                if self._index is None:
+                    started = time.monotonic()
+                    self._index = HashIndex()
+                    self._sync()
+                    logging.info(f"Index pHash des preuves : {len(self._index)} hashes "
+                                 f"en {time.monotonic() - started:.1f}s")
+                elif time.monotonic() - self._synced_at > self.sync_seconds:
+                    self._sync()
+        return self._index
+
+    def _add(self, hash_id, proof_id, phash, created_at):
+        if hash_id in self._recent:
+            return
+        self._index.add(phash, proof_id)
+        if self._latest is None or created_at > self._latest:
+            self._latest = created_at
+        # Lignes lues de la plus récente à la plus ancienne : seules celles de la fenêtre
+        # de relecture sont retenues
+        if created_at > self._latest - self.margin:
+            self._recent[hash_id] = created_at
+
+    def _sync(self):
+        if self._latest is None:
+            rows = execute_query("""
+                SELECT id, proof_id, phash, created_at FROM proof_image_hashes
+                ORDER BY created_at DESC
+            """, fetch_all=True)
+        else:
+            rows = execute_query("""
+                SELECT id, proof_id, phash, created_at FROM proof_image_hashes
+                WHERE created_at > %s
+                ORDER BY created_at DESC
+            """, (self._latest - self.margin,), fetch_all=True)
+        for row in rows or []:
+            self._add(row['id'], row['proof_id'], to_unsigned(row['phash']), row['created_at'])
+        # Les ids sortis de la fenêtre ne seront plus relus
+        if self._latest:
+            cutoff = self._latest - self.margin
+            self._recent = {hash_id: created_at for hash_id, created_at in self._recent.items()
+                            if created_at > cutoff}
+        self._synced_at = time.monotonic()
+
+    def similar(self, phash, threshold):
+        """[{'proof_id', 'distance'}] des preuves ayant une image à au plus `threshold` bits"""
+        matches = {}
+        for distance, proof_id in self.get().search(phash, threshold):
+            matches.setdefault(proof_id, distance)
+        return [{'proof_id': proof_id, 'distance': distance} for proof_id, distance in matches.items()]
+
+    def added(self, hash_id, proof_id, phash, created_at):
+        """Ajoute un hash enregistré par ce processus sans attendre la prochaine synchronisation"""
+        if self._index is None:
+            return
+        with self._lock:
+            self._add(hash_id, proof_id, phash, created_at)
+
+
+proof_hash_index = ProofHashIndex(Config.PROOF_HASH_SYNC_SECONDS, Config.PROOF_HASH_SYNC_MARGIN_SECONDS)
+
+INSERT_HASHES_SQL = """
+    INSERT INTO proof_image_hashes (proof_id, filename, sha256, ahash, phash)
+    VALUES %s
+    ON CONFLICT (proof_id, filename) DO NOTHING
+    RETURNING id, proof_id, phash, created_at
+"""
+
+
+def save_hashes(cur, proof_id, files):
+    """Enregistre les hashes des images d'une preuve (dans la transaction de `cur`)"""
+    rows = [(proof_id, entry['filename'], entry.get('sha256'),
+             to_signed(int(entry['ahash'], 16)), to_signed(int(entry['phash'], 16)))
+            for entry in files if entry.get('phash')]
+    if not rows:
+        return []
+    return execute_values(cur, INSERT_HASHES_SQL, rows, fetch=True)
+
+
+def proof_files(proof_data):
+    """Fichiers d'une preuve (liste, ou ancien format {"files": [...]})"""
+    if isinstance(proof_data, dict):
+        return proof_data.get('files') or []
+    return proof_data or []
+
+
+def _hash_file(proof_id, entry):
+    filename = entry.get('filename') or ''
+    path = proof_path(filename)
+    if filename.rsplit('.', 1)[-1].lower() not in IMAGE_EXTENSIONS or not os.path.exists(path):
+        return None
+    hashes = image_hashes(path)
+    if not hashes:
+        return None
+    ahash, phash = hashes
+    return proof_id, filename, entry.get('sha256'), to_signed(ahash), to_signed(phash)
+
+
+def backfill_hashes(batch_size=500, workers=4):
+    """Calcule les hashes manquants des preuves existantes; renvoie (images hachées, ignorées)"""
+    hashed = skipped = 0
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='proof-hash') as executor:
+        while True:
+            proofs = execute_query("""
+                SELECT cp.id, cp.proof_data,
+                       ARRAY(SELECT h.filename FROM proof_image_hashes h WHERE h.proof_id = cp.id) as hashed
+                FROM campaign_proofs cp
+                WHERE cp.id > %s
+                ORDER BY cp.id
+                LIMIT %s
+            """, (last_id, batch_size), fetch_all=True)
+            if not proofs:
+                return hashed, skipped
+            last_id = proofs[-1]['id']
+
+            futures = [executor.submit(_hash_file, proof['id'], entry)
+                       for proof in proofs
+                       for entry in proof_files(proof['proof_data'])
+                       if entry.get('filename') not in proof['hashed']]
+            rows = []
+            for future in futures:
+                row = future.result()
+                if row:
+                    rows.append(row)
+                else:
+                    skipped += 1
+            if rows:
+                conn, cur = get_db_cursor()
+                try:
+                    execute_values(cur, INSERT_HASHES_SQL, rows, page_size=batch_size)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    cur.close()
+                    release_connection(conn)
+            hashed += len(rows)
+
+
+def benchmark(count=1000000, queries=1000, threshold=8, seed=42):
+    """Construit un index de `count` hashes aléatoires; renvoie (secondes de construction, latences ms)"""
+    rng = random.Random(seed)
+    hashes = [rng.getrandbits(HASH_BITS) for _ in range(count)]
+    started = time.perf_counter()
+    index = HashIndex()
+    for item, value in enumerate(hashes):
+        index.add(value, item)
+    build_seconds = time.perf_counter() - started
+
+    latencies = []
+    for _ in range(queries):
+        # Copie légèrement retouchée d'une image indexée : quelques bits inversés
+        value = rng.choice(hashes)
+        for bit in rng.sample(range(HASH_BITS), rng.randint(0, threshold)):
+            value ^= 1 << bit
+        started = time.perf_counter()
+        index.search(value, threshold)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return build_seconds, sorted(latencies)
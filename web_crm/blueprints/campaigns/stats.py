@@ -0,0 +1,132 @@
+import threading
+
+from database.db import execute_query
+from utils.pagination import keyset_condition, build_page
+
+# Campagne, agrégats financiers, compteurs de preuves et répartition (avec le nombre de
+# preuves de chaque partenaire) en une requête : chaque LATERAL agrège sa table à part,
+# sans jointure qui multiplierait les lignes avant les COUNT/SUM.
+STATS_SQL = """
+    SELECT c.*, e.name as client_name,
+           u.first_name || ' ' || u.last_name as created_by_name,
+           fin.total_distributions, fin.paid_distributions,
+           fin.total_amount, fin.paid_amount, fin.pending_amount,
+           pc.proof_count, pc.approved_proofs, pc.pending_proofs, pc.rejected_proofs,
+           COALESCE(dist.items, '[]'::json) as revenue_distribution
+    FROM campaigns c
+    LEFT JOIN entities e ON c.client_id = e.id
+    LEFT JOIN users u ON c.created_by = u.id
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) as total_distributions,
+               COUNT(*) FILTER (WHERE status = 'paid') as paid_distributions,
+               SUM(amount) as total_amount,
+               COALESCE(SUM(amount) FILTER (WHERE status = 'paid'), 0) as paid_amount,
+               COALESCE(SUM(amount) FILTER (WHERE status = 'pending'), 0) as pending_amount
+        FROM campaign_revenue_distribution
+        WHERE campaign_id = c.id
+    ) fin
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) as proof_count,
+               COUNT(*) FILTER (WHERE status = 'approved') as approved_proofs,
+               COUNT(*) FILTER (WHERE status = 'pending') as pending_proofs,
+               COUNT(*) FILTER (WHERE status = 'rejected') as rejected_proofs
+        FROM campaign_proofs
+        WHERE campaign_id = c.id
+    ) pc
+    CROSS JOIN LATERAL (
+        SELECT json_agg(d ORDER BY d.amount DESC, d.id) as items
+        FROM (
+            SELECT crd.*, en.name as entity_name, COALESCE(pp.proof_count, 0) as proof_count
+            FROM campaign_revenue_distribution crd
+            JOIN entities en ON crd.entity_id = en.id
+            LEFT JOIN (
+                SELECT partner_id, COUNT(*) as proof_count
+                FROM campaign_proofs
+                WHERE campaign_id = c.id
+                GROUP BY partner_id
+            ) pp ON pp.partner_id = crd.entity_id
+            WHERE crd.campaign_id = c.id
+        ) d
+    ) dist
+    WHERE c.id = %s
+"""
+
+FINANCIAL_KEYS = ('total_distributions', 'paid_distributions', 'total_amount', 'paid_amount', 'pending_amount')
+PROOF_KEYS = ('proof_count', 'approved_proofs', 'pending_proofs', 'rejected_proofs')
+
+# Version des statistiques d'une campagne (campaigns.stats_version) : chaque écriture qui
+# les change (preuves, répartition, règlements, statut) l'incrémente dans sa propre
+# transaction, quel que soit le processus (workers, commandes flask campaigns ...)
+BUMP_STATS_VERSION_SQL = """
+    UPDATE campaigns SET stats_version = stats_version + 1 WHERE id = ANY(%s)
+"""
+
+# Statistiques par campagne : (version, résultat). Chaque lecture compare la version en base
+# (une lecture par clé primaire) à celle du résultat gardé, calculé dans le même instantané
+# que sa version.
+_stats = {}
+_lock = threading.Lock()
+
+
+def bump_stats_version(cur, campaign_ids):
+    """Périme les statistiques des campagnes (dans la transaction de `cur`)"""
+    campaign_ids = sorted({int(campaign_id) for campaign_id in campaign_ids if campaign_id})
+    if campaign_ids:
+        cur.execute(BUMP_STATS_VERSION_SQL, (campaign_ids,))
+
+
+def _load(campaign_id):
+    row = execute_query(STATS_SQL, (campaign_id,), fetch_one=True)
+    if not row:
+        return None, None
+    campaign = dict(row)
+    version = campaign.pop('stats_version')
+    return version, {
+        'revenue_distribution': campaign.pop('revenue_distribution'),
+        'financial_stats': {key: campaign.pop(key) for key in FINANCIAL_KEYS},
+        'proof_counts': {key: campaign.pop(key) for key in PROOF_KEYS},
+        'campaign': campaign,
+    }
+
+
+def get_stats(campaign_id):
+    """Statistiques de la campagne (None si elle n'existe pas), servies depuis le cache si à jour"""
+    current = execute_query("SELECT stats_version FROM campaigns WHERE id = %s", (campaign_id,), fetch_one=True)
+    if not current:
+        with _lock:
+            _stats.pop(campaign_id, None)
+        return None
+    cached = _stats.get(campaign_id)
+    if cached and cached[0] == current['stats_version']:
+        return cached[1]
+    version, stats = _load(campaign_id)
+    if stats is not None:
+        with _lock:
+            # Un calcul plus lent mais plus ancien n'écrase pas une version plus récente
+            previous = _stats.get(campaign_id)
+            if not previous or previous[0] <= version:
+                _stats[campaign_id] = (version, stats)
+    return stats
+
+
+def proofs_page(campaign_id, limit, cursor=None):
+    """Page de preuves d'une campagne, des plus récentes aux plus anciennes; (lignes, curseur suivant)"""
+    conditions = ["cp.campaign_id = %s"]
+    params = [campaign_id]
+    if cursor:
+        condition, values = keyset_condition(['cp.upload_date', 'cp.id'], cursor)
+        conditions.append(condition)
+        params.extend(values)
+
+    rows = execute_query(f"""
+        SELECT cp.*, s.name as site_name, e.name as partner_name,
+               u.first_name || ' ' || u.last_name as uploaded_by_name
+        FROM campaign_proofs cp
+        LEFT JOIN sites s ON cp.site_id = s.id
+        LEFT JOIN entities e ON cp.partner_id = e.id
+        LEFT JOIN users u ON cp.uploaded_by = u.id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY cp.upload_date DESC, cp.id DESC
+        LIMIT %s
+    """, (*params, limit + 1), fetch_all=True)
+    return build_page(rows, limit, ['upload_date', 'id'])
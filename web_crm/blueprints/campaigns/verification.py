@@ -0,0 +1,126 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from psycopg2.extras import execute_values
+
+from blueprints.sites.spatial import haversine_km
+from database.db import get_db_cursor, release_connection
+from .analytics import record_validations
+from .similarity import proof_files
+from .stats import bump_stats_version
+
+# Preuves en attente jamais vérifiées, verrouillées pour qu'aucun autre worker ne les prenne
+CLAIM_SQL = """
+    SELECT cp.id, cp.campaign_id, cp.proof_data, s.latitude, s.longitude, c.start_date, c.end_date
+    FROM campaign_proofs cp
+    JOIN campaigns c ON cp.campaign_id = c.id
+    LEFT JOIN sites s ON cp.site_id = s.id
+    WHERE cp.status = 'pending' AND cp.verification_status IS NULL
+    ORDER BY cp.id
+    LIMIT %s
+    FOR UPDATE OF cp SKIP LOCKED
+"""
+
+SAVE_SQL = """
+    UPDATE campaign_proofs cp
+    SET status = v.status,
+        verification_status = v.verification_status,
+        verification = v.verification,
+        max_distance_m = v.max_distance_m,
+        verified_at = CURRENT_TIMESTAMP,
+        review_date = CASE WHEN v.status = 'approved' THEN CURRENT_TIMESTAMP ELSE cp.review_date END,
+        review_notes = CASE WHEN v.status = 'approved' THEN 'Validation automatique' ELSE cp.review_notes END
+    FROM (VALUES %s) AS v(id, status, verification_status, verification, max_distance_m)
+    WHERE cp.id = v.id
+"""
+
+
+def check_file(entry, site_position, start_date, end_date, max_distance_m):
+    """Écarts d'un fichier de preuve par rapport au site et à la période de la campagne"""
+    issues = []
+    distance_m = None
+
+    gps = entry.get('gps')
+    if not gps:
+        issues.append('gps_manquant')
+    elif not site_position:
+        issues.append('site_sans_position')
+    else:
+        distance_m = round(haversine_km(gps['lat'], gps['lng'], *site_position) * 1000, 1)
+        if distance_m > max_distance_m:
+            issues.append('hors_zone')
+
+    taken_at = entry.get('taken_at')
+    if not taken_at:
+        issues.append('date_manquante')
+    elif not start_date <= datetime.fromisoformat(taken_at).date() <= end_date:
+        issues.append('hors_periode')
+
+    if entry.get('duplicate_of'):
+        issues.append('doublon')
+    if entry.get('similar_to'):
+        issues.append('quasi_doublon')
+
+    return {'sha256': entry.get('sha256'), 'distance_m': distance_m, 'taken_at': taken_at, 'issues': issues}
+
+
+def verify_proof(proof, max_distance_m):
+    """(statut, statut de vérification, détails, distance max) : acceptée seulement si tout concorde"""
+    site_position = None
+    if proof['latitude'] is not None and proof['longitude'] is not None:
+        site_position = (float(proof['latitude']), float(proof['longitude']))
+
+    files = proof_files(proof['proof_data'])
+    checks = [check_file(entry, site_position, proof['start_date'], proof['end_date'], max_distance_m)
+              for entry in files]
+    distances = [check['distance_m'] for check in checks if check['distance_m'] is not None]
+    max_distance = max(distances) if distances else None
+
+    if checks and not any(check['issues'] for check in checks):
+        return 'approved', 'auto_approved', checks, max_distance
+    return 'pending', 'needs_review', checks or [{'issues': ['aucun_fichier']}], max_distance
+
+
+def _verify_batches(batch_size, max_distance_m):
+    """Boucle d'un worker : un lot par transaction jusqu'à épuisement"""
+    counts = {'auto_approved': 0, 'needs_review': 0}
+    while True:
+        conn, cur = get_db_cursor()
+        try:
+            cur.execute(CLAIM_SQL, (batch_size,))
+            proofs = cur.fetchall()
+            if not proofs:
+                conn.commit()
+                return counts
+
+            verdicts = []
+            for proof in proofs:
+                status, verification_status, checks, max_distance = verify_proof(proof, max_distance_m)
+                verdicts.append((proof['id'], status, verification_status, json.dumps(checks), max_distance))
+                counts[verification_status] += 1
+
+            execute_values(cur, SAVE_SQL, verdicts,
+                           template='(%s::int, %s, %s, %s::jsonb, %s::numeric)', page_size=batch_size)
+            # Preuves en attente acceptées : compteur de validées de l'agrégat journalier
+            record_validations(cur, [verdict[0] for verdict in verdicts if verdict[1] == 'approved'], 1)
+            bump_stats_version(cur, [proof['campaign_id'] for proof, verdict in zip(proofs, verdicts)
+                                     if verdict[1] == 'approved'])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            release_connection(conn)
+
+
+def verify_pending_proofs(batch_size=500, workers=4, max_distance_m=300):
+    """Vérifie toutes les preuves en attente sur `workers` connexions en parallèle"""
+    totals = {'auto_approved': 0, 'needs_review': 0}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='proof-verifier') as executor:
+        futures = [executor.submit(_verify_batches, batch_size, max_distance_m) for _ in range(workers)]
+        for future in futures:
+            for key, value in future.result().items():
+                totals[key] += value
+    return totals
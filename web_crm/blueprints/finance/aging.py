@@ -0,0 +1,132 @@
+import threading
+from datetime import date
+
+from database.db import execute_query
+from utils.pagination import build_page, keyset_condition
+
+# Factures dont le solde (total_amount - paid_amount) reste dû
+OPEN_STATUSES = ('sent', 'overdue', 'partially_paid')
+
+# Tranche -> (jours de retard min, max); 'current' = pas encore échue (ou sans échéance)
+BUCKETS = {
+    'current': (None, 0),
+    'days_1_30': (1, 30),
+    'days_31_60': (31, 60),
+    'days_61_90': (61, 90),
+    'days_90_plus': (91, None),
+}
+
+# Clé de tri des factures d'une tranche : les factures sans échéance passent en dernier
+DUE_KEY = "COALESCE(i.due_date, DATE '9999-12-31')"
+
+
+def _bucket_condition(bucket, days):
+    """Condition SQL d'appartenance à une tranche, `days` étant l'expression des jours de retard"""
+    low, high = BUCKETS[bucket]
+    if low is None:
+        return f"(i.due_date IS NULL OR {days} <= {high})"
+    if high is None:
+        return f"{days} >= {low}"
+    return f"{days} BETWEEN {low} AND {high}"
+
+
+AGING_DAYS = "(%(as_of)s::date - i.due_date)"
+BUCKET_COLUMNS = ',\n           '.join(
+    f"COALESCE(SUM(i.total_amount - i.paid_amount) FILTER (WHERE {_bucket_condition(bucket, AGING_DAYS)}), 0) as {bucket}"
+    for bucket in BUCKETS
+)
+
+# Une seule passe sur les factures ouvertes (idx_invoices_status_due) : soldes par client
+# et par tranche de retard
+AGING_SQL = f"""
+    SELECT i.client_id, e.name as client_name,
+           COUNT(*) as invoices_count,
+           COUNT(*) FILTER (WHERE i.due_date < %(as_of)s) as overdue_count,
+           SUM(i.total_amount - i.paid_amount) as total,
+           {BUCKET_COLUMNS}
+    FROM invoices i
+    JOIN entities e ON i.client_id = e.id
+    WHERE i.status = ANY(%(statuses)s) AND i.total_amount > i.paid_amount
+    GROUP BY i.client_id, e.name
+    ORDER BY total DESC
+"""
+
+# Version de la balance âgée (cache_versions 'aging') : chaque écriture sur les factures
+# (création, envoi, suppression, paiements, facturation par lot, règlements) l'incrémente
+# en fin de transaction, quel que soit le processus
+BUMP_VERSION_SQL = "UPDATE cache_versions SET version = version + 1 WHERE name = 'aging'"
+
+# Balance âgée gardée en mémoire : (version, rapport). Chaque lecture compare la version en
+# base (une ligne) à celle du rapport gardé.
+_snapshot = None
+_lock = threading.Lock()
+
+
+def bump_version(cur):
+    """Périme la balance âgée de tous les processus (dans la transaction de `cur`)"""
+    cur.execute(BUMP_VERSION_SQL)
+
+
+def _version():
+    row = execute_query("SELECT version FROM cache_versions WHERE name = 'aging'", fetch_one=True)
+    return row['version'] if row else None
+
+
+def _compute(as_of):
+    rows = execute_query(AGING_SQL, {'as_of': as_of, 'statuses': list(OPEN_STATUSES)}, fetch_all=True) or []
+    clients = [dict(row) for row in rows]
+    keys = ('total', 'invoices_count', 'overdue_count') + tuple(BUCKETS)
+    return {
+        'as_of': as_of.isoformat(),
+        'buckets': list(BUCKETS),
+        'clients': clients,
+        'totals': {key: sum((client[key] for client in clients), 0) for key in keys},
+    }
+
+
+def aging_report():
+    """Balance âgée des créances par client, servie depuis le cache si à jour"""
+    global _snapshot
+    today = date.today()
+    # Version lue avant le calcul : une écriture validée entre-temps ne peut que provoquer
+    # un recalcul de plus, jamais garder un rapport périmé
+    version = _version()
+    snapshot = _snapshot
+    if (snapshot and version is not None and snapshot[0] == version
+            and snapshot[1]['as_of'] == today.isoformat()):
+        return snapshot[1]
+    report = _compute(today)
+    if version is not None:
+        with _lock:
+            _snapshot = (version, report)
+    return report
+
+
+def invoices_page(client_id, bucket, limit, cursor=None):
+    """Factures ouvertes d'un client dans une tranche, de la plus ancienne échéance à la plus
+    récente; (lignes, curseur suivant)"""
+    today = date.today()
+    conditions = ["i.client_id = %s", "i.status = ANY(%s)", "i.total_amount > i.paid_amount",
+                  _bucket_condition(bucket, "(%s::date - i.due_date)")]
+    # Ordre des paramètres : jours de retard (SELECT), client, statuts, tranche
+    params = [today, client_id, list(OPEN_STATUSES), today]
+    if cursor:
+        condition, values = keyset_condition([DUE_KEY, 'i.id'], cursor, descending=False)
+        conditions.append(condition)
+        params.extend(values)
+    params.append(limit + 1)
+
+    rows = execute_query(f"""
+        SELECT i.id, i.invoice_number, i.invoice_date, i.due_date, i.status,
+               i.total_amount, i.paid_amount, (i.total_amount - i.paid_amount) as balance,
+               GREATEST(%s::date - i.due_date, 0) as days_overdue,
+               {DUE_KEY} as due_key
+        FROM invoices i
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {DUE_KEY}, i.id
+        LIMIT %s
+    """, params, fetch_all=True)
+    rows, next_cursor = build_page(rows, limit, ['due_key', 'id'])
+    for row in rows:
+        row.pop('due_key')
+    return rows, next_cursor
@@ -0,0 +1,247 @@
+import json
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from psycopg2.extras import execute_values
+
+from database.db import get_db_cursor, release_connection
+from .aging import bump_version as bump_aging_version
+from utils.numbering import next_numbers
+
+CENT = Decimal('0.01')
+DEFAULT_TAX_RATE = Decimal('20')
+DEFAULT_PAYMENT_TERMS = 'Paiement à 30 jours'
+# Verrou consultatif : deux facturations par lot ne facturent pas la même campagne
+BILLING_LOCK_KEY = 720471
+# Campagnes démarrées (les brouillons et campagnes programmées n'ont pas encore tourné)
+BILLABLE_STATUSES = ('active', 'paused', 'completed')
+
+
+class BillingError(ValueError):
+    """Lot refusé : `errors` liste les anomalies par facture"""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} facture(s) invalide(s)")
+        self.errors = errors
+
+
+def _money(value):
+    return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def _date(value, field):
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value))
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} invalide")
+
+
+def prepare_invoice(spec, client_ids=None):
+    """Valide une facture et calcule ses totaux; lève ValueError au premier champ invalide.
+    `client_ids` : ensemble des clients existants, vérifié s'il est fourni"""
+    if not spec.get('client_id'):
+        raise ValueError('client_id requis')
+    try:
+        client_id = int(spec['client_id'])
+    except (TypeError, ValueError):
+        raise ValueError('client_id invalide')
+    if client_ids is not None and client_id not in client_ids:
+        raise ValueError(f"Client {client_id} introuvable")
+    items = spec.get('items') or []
+    if not items:
+        raise ValueError('Au moins une ligne requise')
+
+    try:
+        lines = []
+        for item in items:
+            quantity = Decimal(str(item.get('quantity', 0)))
+            unit_price = _money(item.get('unit_price', 0))
+            lines.append(dict(item, quantity=float(quantity), unit_price=float(unit_price),
+                              total=float(_money(quantity * unit_price))))
+        subtotal = sum((_money(line['total']) for line in lines), Decimal('0'))
+        tax_rate = Decimal(str(spec.get('tax_rate', DEFAULT_TAX_RATE)))
+    except (InvalidOperation, TypeError):
+        raise ValueError('Quantité, prix ou taux de TVA invalide')
+
+    invoice_date = _date(spec.get('invoice_date') or date.today(), 'invoice_date')
+    due_date = _date(spec.get('due_date') or invoice_date + timedelta(days=30), 'due_date')
+    if due_date < invoice_date:
+        raise ValueError("due_date antérieure à invoice_date")
+
+    tax_amount = _money(subtotal * tax_rate / 100)
+    return {
+        'client_id': client_id,
+        'invoice_date': invoice_date,
+        'due_date': due_date,
+        'amount': subtotal,
+        'tax_amount': tax_amount,
+        'total_amount': subtotal + tax_amount,
+        'items': lines,
+        'payment_terms': spec.get('payment_terms', DEFAULT_PAYMENT_TERMS),
+        'campaign_ids': [int(campaign_id) for campaign_id in spec.get('campaign_ids', [])],
+    }
+
+
+def client_ids_of(cur, specs):
+    """Clients existants parmi ceux visés par le lot (une requête pour tout le lot)"""
+    ids = set()
+    for spec in specs:
+        try:
+            ids.add(int(spec.get('client_id')))
+        except (TypeError, ValueError):
+            pass
+    if not ids:
+        return set()
+    cur.execute("SELECT id FROM entities WHERE id = ANY(%s) AND type = 'client'", (list(ids),))
+    return {row['id'] for row in cur.fetchall()}
+
+
+def prepare_batch(specs, client_ids=None):
+    """Valide et totalise tout le lot en une passe; lève BillingError avec toutes les anomalies"""
+    invoices, errors = [], []
+    for index, spec in enumerate(specs):
+        try:
+            invoices.append(prepare_invoice(spec, client_ids))
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+    if errors:
+        raise BillingError(errors)
+    return invoices
+
+
+def month_bounds(period):
+    """Premier et dernier jour d'un mois 'YYYY-MM'"""
+    try:
+        start = date.fromisoformat(f"{period}-01")
+    except (TypeError, ValueError):
+        raise BillingError([{'index': None, 'error': 'Période attendue au format YYYY-MM'}])
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return start, end
+
+
+# Campagnes ayant tourné pendant le mois (actives, en pause ou terminées depuis), non encore
+# facturées pour ce mois : le budget est facturé au prorata des jours de campagne compris
+# dans le mois. La facturation tourne après la fin du mois, quand les campagnes achevées
+# dans le mois sont déjà passées à 'completed'.
+ACTIVE_CAMPAIGNS_SQL = """
+    SELECT c.id as campaign_id, c.name, c.client_id,
+           GREATEST(c.start_date, %(period_start)s) as billed_from,
+           LEAST(c.end_date, %(period_end)s) as billed_to,
+           round(c.budget * (LEAST(c.end_date, %(period_end)s) - GREATEST(c.start_date, %(period_start)s) + 1)
+                 / (c.end_date - c.start_date + 1), 2) as amount
+    FROM campaigns c
+    WHERE c.status = ANY(%(statuses)s)
+    AND c.start_date <= %(period_end)s AND c.end_date >= %(period_start)s
+    AND (%(client_ids)s::int[] IS NULL OR c.client_id = ANY(%(client_ids)s::int[]))
+    AND NOT EXISTS (
+        SELECT 1 FROM campaign_billings b
+        WHERE b.campaign_id = c.id AND b.period = %(period_start)s
+    )
+    ORDER BY c.client_id, c.id
+"""
+
+
+def active_campaign_specs(cur, period, client_ids=None, tax_rate=DEFAULT_TAX_RATE, due_days=30):
+    """Une facture par client regroupant ses campagnes ayant tourné pendant le mois `period` (YYYY-MM)"""
+    period_start, period_end = month_bounds(period)
+    cur.execute(ACTIVE_CAMPAIGNS_SQL, {
+        'period_start': period_start,
+        'period_end': period_end,
+        'client_ids': list(client_ids) if client_ids else None,
+        'statuses': list(BILLABLE_STATUSES),
+    })
+    specs = {}
+    for row in cur.fetchall():
+        spec = specs.setdefault(row['client_id'], {
+            'client_id': row['client_id'],
+            'invoice_date': period_end,
+            'due_date': period_end + timedelta(days=due_days),
+            'tax_rate': tax_rate,
+            'payment_terms': f"Paiement à {due_days} jours",
+            'items': [],
+            'campaign_ids': [],
+        })
+        spec['items'].append({
+            'description': f"Campagne {row['name']} du {row['billed_from']:%d/%m/%Y} au {row['billed_to']:%d/%m/%Y}",
+            'quantity': 1,
+            'unit_price': row['amount'],
+            'campaign_id': row['campaign_id'],
+        })
+        spec['campaign_ids'].append(row['campaign_id'])
+    return list(specs.values()), period_start
+
+
+INSERT_INVOICES_SQL = """
+    INSERT INTO invoices (
+        invoice_number, client_id, invoice_date, due_date, amount, tax_amount, total_amount,
+        paid_amount, status, items, payment_terms, created_by
+    ) VALUES %s
+    RETURNING id, invoice_number
+"""
+
+INSERT_BILLINGS_SQL = """
+    INSERT INTO campaign_billings (campaign_id, period, invoice_id) VALUES %s
+"""
+
+
+def _insert(cur, invoices, user_id, period_start=None):
+    numbers = next_numbers(cur, 'invoice', len(invoices))
+    rows = [
+        (number, invoice['client_id'], invoice['invoice_date'], invoice['due_date'],
+         invoice['amount'], invoice['tax_amount'], invoice['total_amount'], 0, 'draft',
+         json.dumps(invoice['items']), invoice['payment_terms'], user_id)
+        for number, invoice in zip(numbers, invoices)
+    ]
+    created = execute_values(cur, INSERT_INVOICES_SQL, rows, page_size=len(rows), fetch=True)
+    ids = {row['invoice_number']: row['id'] for row in created}
+
+    billings = [(campaign_id, period_start, ids[number])
+                for number, invoice in zip(numbers, invoices)
+                for campaign_id in invoice['campaign_ids']]
+    if period_start and billings:
+        execute_values(cur, INSERT_BILLINGS_SQL, billings, page_size=len(billings))
+
+    return [{
+        'id': ids[number],
+        'invoice_number': number,
+        'client_id': invoice['client_id'],
+        'total_amount': str(invoice['total_amount']),
+        'campaign_ids': invoice['campaign_ids'],
+    } for number, invoice in zip(numbers, invoices)]
+
+
+def generate_invoices(user_id, specs=None, period=None, client_ids=None,
+                      tax_rate=DEFAULT_TAX_RATE, dry_run=False):
+    """Crée en une transaction les factures `specs`, ou celles des campagnes actives du mois
+    `period`; en dry_run, renvoie les factures calculées sans rien écrire"""
+    conn, cur = get_db_cursor()
+    try:
+        period_start = None
+        if period:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (BILLING_LOCK_KEY,))
+            specs, period_start = active_campaign_specs(cur, period, client_ids, tax_rate)
+        specs = specs or []
+        invoices = prepare_batch(specs, client_ids_of(cur, specs))
+
+        if dry_run or not invoices:
+            conn.rollback()
+            return [{
+                'client_id': invoice['client_id'],
+                'amount': str(invoice['amount']),
+                'tax_amount': str(invoice['tax_amount']),
+                'total_amount': str(invoice['total_amount']),
+                'campaign_ids': invoice['campaign_ids'],
+            } for invoice in invoices]
+
+        created = _insert(cur, invoices, user_id, period_start)
+        bump_aging_version(cur)
+        conn.commit()
+        return created
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        release_connection(conn)
@@ -0,0 +1,161 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+
+from flask import current_app, render_template
+
+from config import Config
+from database.db import execute_query
+
+try:
+    from weasyprint import HTML
+except ImportError:  # PDF indisponible tant que WeasyPrint n'est pas installé
+    HTML = None
+PDF_AVAILABLE = HTML is not None
+
+# Type de document -> requête (ids en paramètre) renvoyant tout ce qui est imprimé.
+# La version du PDF est l'empreinte de ces données : il n'est régénéré que si la
+# facture, ses paiements ou les coordonnées du client changent.
+DOCUMENT_SQL = {
+    'invoice': """
+        SELECT i.id, i.invoice_number as number, i.invoice_date, i.due_date, i.status,
+               i.items, i.amount, i.tax_amount, i.total_amount, i.paid_amount, i.payment_terms,
+               e.name as client_name, e.address as client_address,
+               e.email as client_email, e.phone as client_phone,
+               q.quote_number,
+               COALESCE((
+                   SELECT json_agg(json_build_object(
+                       'payment_date', p.payment_date, 'amount', p.amount,
+                       'payment_method', p.payment_method, 'reference', p.reference
+                   ) ORDER BY p.payment_date, p.id)
+                   FROM payments p WHERE p.invoice_id = i.id
+               ), '[]') as payments
+        FROM invoices i
+        JOIN entities e ON i.client_id = e.id
+        LEFT JOIN quotes q ON i.quote_id = q.id
+        WHERE i.id = ANY(%s)
+    """,
+    'quote': """
+        SELECT q.id, q.quote_number as number, q.created_at::date as quote_date, q.validity_date,
+               q.status, q.items, q.amount, q.terms,
+               e.name as client_name, e.address as client_address,
+               e.email as client_email, e.phone as client_phone
+        FROM quotes q
+        JOIN entities e ON q.client_id = e.id
+        WHERE q.id = ANY(%s)
+    """,
+}
+
+DOCUMENT_TABLES = {'invoice': 'invoices', 'quote': 'quotes'}
+
+# Rendus hors des threads web; un même document n'est rendu qu'une fois à la fois
+pdf_executor = ThreadPoolExecutor(max_workers=Config.PDF_RENDER_WORKERS, thread_name_prefix='pdf-render')
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def document_version(document):
+    payload = json.dumps(document, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:20]
+
+
+def load_documents(document_type, ids):
+    """Données imprimées des documents `ids`, chacune avec sa version"""
+    rows = execute_query(DOCUMENT_SQL[document_type], (list(ids),), fetch_all=True) or []
+    documents = []
+    for row in rows:
+        document = dict(row)
+        document['version'] = document_version(row)
+        documents.append(document)
+    return documents
+
+
+def load_document(document_type, document_id):
+    documents = load_documents(document_type, [document_id])
+    return documents[0] if documents else None
+
+
+def document_ids(document_type, status=None):
+    rows = execute_query(
+        f"SELECT id FROM {DOCUMENT_TABLES[document_type]} WHERE %(status)s::text IS NULL OR status = %(status)s ORDER BY id",
+        {'status': status}, fetch_all=True) or []
+    return [row['id'] for row in rows]
+
+
+def pdf_path(document_type, document_id, version):
+    return os.path.join(Config.PDF_FOLDER, f"{document_type}-{document_id}-{version}.pdf")
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _render(app, document_type, document):
+    """Écrit le PDF de la version courante puis supprime les versions précédentes"""
+    path = pdf_path(document_type, document['id'], document['version'])
+    with app.app_context():
+        html = render_template(f'finance/pdf/{document_type}.html', document=document)
+    os.makedirs(Config.PDF_FOLDER, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=Config.PDF_FOLDER, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            HTML(string=html).write_pdf(f)
+        os.replace(tmp_path, path)
+    except Exception:
+        _remove(tmp_path)
+        raise
+
+    # Un autre rendu du même document peut supprimer les mêmes fichiers en parallèle
+    for old in glob.glob(os.path.join(Config.PDF_FOLDER, f"{document_type}-{document['id']}-*.pdf")):
+        if old != path:
+            _remove(old)
+    return path
+
+
+def submit(document_type, document):
+    """Future du PDF de `document`, partagée avec un rendu déjà en cours de la même version"""
+    key = (document_type, document['id'], document['version'])
+    with _pending_lock:
+        future = _pending.get(key)
+        if future is not None:
+            return future
+        future = pdf_executor.submit(_render, current_app._get_current_object(), document_type, document)
+        _pending[key] = future
+    # Hors du verrou : le callback s'exécute tout de suite si le rendu est déjà fini
+    future.add_done_callback(lambda done: _finished(key, done))
+    return future
+
+
+def _finished(key, future):
+    with _pending_lock:
+        _pending.pop(key, None)
+    if future.exception():
+        logging.error(f"Rendu PDF {key[0]} {key[1]} : {future.exception()}")
+
+
+def get_pdf(document_type, document, timeout=60):
+    """Chemin du PDF de `document`, rendu par le pool s'il n'est pas en cache"""
+    path = pdf_path(document_type, document['id'], document['version'])
+    if os.path.exists(path):
+        return path
+    return submit(document_type, document).result(timeout)
+
+
+def render_batch(document_type, ids, wait=False):
+    """Met en file le rendu des documents `ids` sans PDF à jour; renvoie le nombre mis en file"""
+    futures = [
+        submit(document_type, document)
+        for document in load_documents(document_type, ids)
+        if not os.path.exists(pdf_path(document_type, document['id'], document['version']))
+    ]
+    if wait:
+        wait_futures(futures)
+    return len(futures)
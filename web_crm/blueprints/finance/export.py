@@ -0,0 +1,168 @@
+import csv
+import io
+import json
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+from psycopg2.extras import RealDictCursor
+
+from database.db import get_db_cursor, release_connection
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet indisponible tant que pyarrow n'est pas installé
+    pa = pq = None
+PARQUET_AVAILABLE = pq is not None
+
+# Jeu de données -> (requête sur la période, colonnes (nom, type))
+DATASETS = {
+    'invoices': ("""
+        SELECT i.invoice_number, i.invoice_date, e.name as client,
+               i.amount as ht, i.tax_amount as tva, i.total_amount as ttc,
+               i.paid_amount, i.status
+        FROM invoices i
+        JOIN entities e ON i.client_id = e.id
+        WHERE i.invoice_date BETWEEN %s AND %s
+        ORDER BY i.invoice_date, i.id
+    """, (('invoice_number', 'string'), ('invoice_date', 'date'), ('client', 'string'),
+          ('ht', 'decimal'), ('tva', 'decimal'), ('ttc', 'decimal'),
+          ('paid_amount', 'decimal'), ('status', 'string'))),
+    'payments': ("""
+        SELECT p.payment_date, i.invoice_number, e.name as client, p.amount,
+               p.payment_method, p.reference
+        FROM payments p
+        JOIN invoices i ON p.invoice_id = i.id
+        JOIN entities e ON i.client_id = e.id
+        WHERE p.payment_date BETWEEN %s AND %s
+        ORDER BY p.payment_date, p.id
+    """, (('payment_date', 'date'), ('invoice_number', 'string'), ('client', 'string'),
+          ('amount', 'decimal'), ('payment_method', 'string'), ('reference', 'string'))),
+    'quotes': ("""
+        SELECT q.quote_number, q.created_at::date as quote_date, e.name as client,
+               q.amount, q.validity_date, q.status
+        FROM quotes q
+        JOIN entities e ON q.client_id = e.id
+        WHERE q.created_at::date BETWEEN %s AND %s
+        ORDER BY q.created_at, q.id
+    """, (('quote_number', 'string'), ('quote_date', 'date'), ('client', 'string'),
+          ('amount', 'decimal'), ('validity_date', 'date'), ('status', 'string'))),
+}
+
+# Format -> (type MIME, extension)
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_batches(dataset, start_date, end_date, batch_size):
+    """Lignes du jeu de données par lots de `batch_size`, lues par un curseur côté serveur"""
+    query = DATASETS[dataset][0]
+    # Curseur nommé : PostgreSQL garde le résultat et n'envoie que `batch_size` lignes à la fois
+    conn, default_cursor = get_db_cursor()
+    default_cursor.close()
+    cur = conn.cursor(name=f"export_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+    cur.itersize = batch_size
+    try:
+        cur.execute(query, (start_date, end_date))
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cur.close()
+        conn.rollback()
+        release_connection(conn)
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def csv_chunks(batches, columns):
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=[name for name, _ in columns])
+    writer.writeheader()
+    for rows in batches:
+        writer.writerows(rows)
+        if output.tell() >= CHUNK_SIZE:
+            yield output.getvalue().encode('utf-8')
+            output.seek(0)
+            output.truncate()
+    yield output.getvalue().encode('utf-8')
+
+
+def ndjson_chunks(batches, columns):
+    names = [name for name, _ in columns]
+    for rows in batches:
+        yield ''.join(
+            json.dumps({name: _json_value(row[name]) for name in names}, ensure_ascii=False) + '\n'
+            for row in rows
+        ).encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Fichier en écriture seule dont on récupère le contenu au fil de l'eau"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _arrow_schema(columns):
+    types = {'string': pa.string(), 'date': pa.date32(), 'decimal': pa.decimal128(12, 2)}
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+def parquet_chunks(batches, columns):
+    """Un row group Parquet par lot, envoyé dès qu'il est écrit"""
+    schema = _arrow_schema(columns)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    try:
+        for rows in batches:
+            writer.write_table(pa.Table.from_pylist([dict(row) for row in rows], schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+WRITERS = {
+    'csv': csv_chunks,
+    'ndjson': ndjson_chunks,
+    'parquet': parquet_chunks,
+}
+
+
+def export_chunks(dataset, export_format, start_date, end_date, batch_size=2000):
+    """Fichier d'export produit morceau par morceau"""
+    columns = DATASETS[dataset][1]
+    batches = iter_batches(dataset, start_date, end_date, batch_size)
+    return WRITERS[export_format](batches, columns)
@@ -0,0 +1,174 @@
+import json
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from database.db import execute_query, get_db_cursor, release_connection
+from .aging import BUMP_VERSION_SQL, OPEN_STATUSES, bump_version
+
+# Verrou consultatif : deux imports de relevé ne peuvent pas enregistrer la même ligne
+PAYMENT_IMPORT_LOCK_KEY = 720501
+
+# Nouveau statut d'une facture après ajout de `{amount}` à son montant payé
+PAID_STATUS = ("CASE WHEN invoices.paid_amount + {amount} >= invoices.total_amount THEN 'paid' "
+               "WHEN invoices.paid_amount + {amount} > 0 THEN 'partially_paid' "
+               "ELSE invoices.status END")
+
+# Un paiement en un aller-retour : l'UPDATE verrouille la facture (deux paiements
+# concurrents s'appliquent l'un après l'autre) et le paiement n'est inséré que si la
+# facture existe, dans la même instruction (qui périme aussi la balance âgée)
+RECORD_PAYMENT_SQL = f"""
+    WITH invoice AS (
+        UPDATE invoices
+        SET paid_amount = invoices.paid_amount + %(amount)s,
+            status = {PAID_STATUS.format(amount='%(amount)s')},
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = %(invoice_id)s
+        RETURNING id, status, total_amount, paid_amount
+    ),
+    payment AS (
+        INSERT INTO payments (
+            invoice_id, amount, payment_date, payment_method,
+            reference, notes, recorded_by
+        )
+        SELECT id, %(amount)s, %(payment_date)s, %(payment_method)s,
+               %(reference)s, %(notes)s, %(user_id)s
+        FROM invoice
+        RETURNING id
+    ),
+    aging_version AS (
+        {BUMP_VERSION_SQL} AND EXISTS (SELECT 1 FROM invoice)
+    )
+    SELECT payment.id as payment_id, invoice.status, invoice.total_amount, invoice.paid_amount
+    FROM invoice, payment
+"""
+
+# Import d'un relevé bancaire en une instruction : lignes rapprochées par numéro de facture
+# parmi les factures ouvertes, lignes déjà importées ou répétées dans le relevé (même facture
+# et même référence) ignorées, une mise à jour par facture pour la somme de ses lignes, puis
+# un INSERT multi-lignes des paiements
+IMPORT_PAYMENTS_SQL = f"""
+    WITH lines AS (
+        SELECT * FROM jsonb_to_recordset(%(lines)s::jsonb) AS l(
+            line INTEGER, invoice_number TEXT, amount DECIMAL(12,2), payment_date DATE,
+            payment_method TEXT, reference TEXT
+        )
+    ),
+    matched AS (
+        SELECT lines.*, i.id as invoice_id,
+               ROW_NUMBER() OVER (PARTITION BY i.id, lines.reference ORDER BY lines.line) as occurrence
+        FROM lines
+        JOIN invoices i ON i.invoice_number = lines.invoice_number
+        WHERE i.status = ANY(%(statuses)s)
+    ),
+    fresh AS (
+        SELECT * FROM matched m
+        WHERE COALESCE(m.reference, '') = '' OR (m.occurrence = 1 AND NOT EXISTS (
+            SELECT 1 FROM payments p WHERE p.invoice_id = m.invoice_id AND p.reference = m.reference
+        ))
+    ),
+    totals AS (
+        SELECT invoice_id, SUM(amount) as amount FROM fresh GROUP BY invoice_id
+    ),
+    updated AS (
+        UPDATE invoices
+        SET paid_amount = invoices.paid_amount + totals.amount,
+            status = {PAID_STATUS.format(amount='totals.amount')},
+            updated_at = CURRENT_TIMESTAMP
+        FROM totals
+        WHERE invoices.id = totals.invoice_id AND invoices.status = ANY(%(statuses)s)
+        RETURNING invoices.id, invoices.status, invoices.paid_amount, invoices.total_amount
+    ),
+    inserted AS (
+        INSERT INTO payments (invoice_id, amount, payment_date, payment_method, reference, notes, recorded_by)
+        SELECT fresh.invoice_id, fresh.amount, fresh.payment_date, fresh.payment_method,
+               fresh.reference, 'Import relevé bancaire', %(user_id)s
+        FROM fresh
+        JOIN updated ON updated.id = fresh.invoice_id
+        RETURNING id
+    )
+    SELECT lines.line, lines.invoice_number, matched.invoice_id,
+           CASE
+               WHEN matched.invoice_id IS NULL THEN 'unmatched'
+               WHEN fresh.line IS NULL THEN 'duplicate'
+               WHEN updated.id IS NULL THEN 'unmatched'
+               ELSE 'recorded'
+           END as result,
+           updated.status as invoice_status, updated.paid_amount, updated.total_amount
+    FROM lines
+    LEFT JOIN matched ON matched.line = lines.line
+    LEFT JOIN fresh ON fresh.line = lines.line
+    LEFT JOIN updated ON updated.id = matched.invoice_id
+    ORDER BY lines.line
+"""
+
+
+def record_payment(invoice_id, amount, payment_date, payment_method, user_id, reference='', notes=''):
+    """Enregistre un paiement et met à jour la facture en une instruction; renvoie
+    {payment_id, status, total_amount, paid_amount} ou None si la facture n'existe pas"""
+    return execute_query(RECORD_PAYMENT_SQL, {
+        'invoice_id': invoice_id,
+        'amount': amount,
+        'payment_date': payment_date,
+        'payment_method': payment_method,
+        'reference': reference,
+        'notes': notes,
+        'user_id': user_id,
+    }, fetch_one=True, commit=True)
+
+
+def _statement_line(index, line):
+    """Ligne de relevé normalisée; lève ValueError si elle est inexploitable"""
+    invoice_number = str(line.get('invoice_number') or '').strip()
+    if not invoice_number:
+        raise ValueError('Numéro de facture manquant')
+    try:
+        amount = Decimal(str(line.get('amount')).replace(',', '.'))
+    except InvalidOperation:
+        raise ValueError('Montant invalide')
+    if not amount.is_finite() or amount <= 0:
+        raise ValueError('Montant invalide')
+    try:
+        payment_date = date.fromisoformat(str(line.get('payment_date')))
+    except ValueError:
+        raise ValueError('Date invalide')
+    return {
+        'line': index,
+        'invoice_number': invoice_number,
+        'amount': str(amount),
+        'payment_date': payment_date.isoformat(),
+        'payment_method': line.get('payment_method') or 'transfer',
+        'reference': str(line.get('reference') or '').strip(),
+    }
+
+
+def import_statement(lines, user_id):
+    """Enregistre les lignes d'un relevé bancaire en une transaction; renvoie le résultat
+    de chaque ligne ('recorded', 'duplicate', 'unmatched' ou 'invalid'), dans l'ordre.
+    Une ligne visant une facture qui n'attend pas de paiement (brouillon, payée, annulée)
+    est 'unmatched'"""
+    results, valid = {}, []
+    for index, line in enumerate(lines):
+        try:
+            valid.append(_statement_line(index, line))
+        except ValueError as e:
+            results[index] = {'line': index, 'invoice_number': line.get('invoice_number'),
+                              'result': 'invalid', 'error': str(e)}
+
+    if valid:
+        conn, cur = get_db_cursor()
+        try:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (PAYMENT_IMPORT_LOCK_KEY,))
+            cur.execute(IMPORT_PAYMENTS_SQL, {'lines': json.dumps(valid), 'user_id': user_id,
+                                              'statuses': list(OPEN_STATUSES)})
+            for row in cur.fetchall():
+                results[row['line']] = dict(row)
+            bump_version(cur)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            release_connection(conn)
+
+    return [results[index] for index in sorted(results)]
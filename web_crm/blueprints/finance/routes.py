@@ -1,9 +1,18 @@
-from flask import render_template, request, jsonify, flash, redirect, url_for, g
+from flask import render_template, request, jsonify, flash, redirect, url_for, g, Response, send_file
 from . import finance_bp
-from database.db import execute_query
+from . import aging
+from . import payments as invoice_payments
+from .billing import BillingError, generate_invoices
+from .documents import DOCUMENT_SQL, PDF_AVAILABLE, get_pdf, load_document, render_batch
+from .export import DATASETS, FORMATS, PARQUET_AVAILABLE, export_chunks
+from config import Config
+from database.db import execute_query, get_db_cursor, release_connection
 from utils.decorators import login_required, permission_required
+from utils.numbering import next_number
+from utils.pagination import decode_cursor, get_page_size
 from datetime import datetime, date, timedelta
 import json
+import os
 
 @finance_bp.route('/')
 @login_required
@@ -32,7 +41,8 @@ def index():
         LIMIT 20
     """, fetch_all=True)
     
-    # Statistiques générales
+    # Statistiques générales (encours et retards lus dans la balance âgée en cache)
+    aging_totals = aging.aging_report()['totals']
     stats = {
         'revenue_month': execute_query("""
             SELECT COALESCE(SUM(total_amount), 0) as total
@@ -41,11 +51,7 @@ def index():
             AND DATE_TRUNC('month', created_at) = DATE_TRUNC('month', CURRENT_DATE)
         """, fetch_one=True)['total'] or 0,
         
-        'pending_invoices': execute_query("""
-            SELECT COALESCE(SUM(total_amount - paid_amount), 0) as total
-            FROM invoices 
-            WHERE status IN ('sent', 'overdue')
-        """, fetch_one=True)['total'] or 0,
+        'pending_invoices': aging_totals['total'],
         
         'quotes_pending': execute_query("""
             SELECT COUNT(*) as count
@@ -54,12 +60,7 @@ def index():
             AND validity_date >= CURRENT_DATE
         """, fetch_one=True)['count'] or 0,
         
-        'overdue_invoices': execute_query("""
-            SELECT COUNT(*) as count
-            FROM invoices 
-            WHERE status = 'sent'
-            AND due_date < CURRENT_DATE
-        """, fetch_one=True)['count'] or 0
+        'overdue_invoices': aging_totals['overdue_count']
     }
     
     # Factures récentes
@@ -90,14 +91,6 @@ def create_invoice():
     try:
         data = request.get_json()
         
-        # Générer le numéro de facture
-        current_month = datetime.now().strftime('%Y%m')
-        invoice_count = execute_query(
-            "SELECT COUNT(*) + 1 as num FROM invoices WHERE invoice_number LIKE %s",
-            (f"FACT-{current_month}-%",), fetch_one=True
-        )['num']
-        invoice_number = f"FACT-{current_month}-{invoice_count:04d}"
-        
         # Calculer les totaux
         items = data.get('items', [])
         subtotal = sum(float(item.get('quantity', 0)) * float(item.get('unit_price', 0)) for item in items)
@@ -105,26 +98,39 @@ def create_invoice():
         tax_amount = subtotal * (tax_rate / 100)
         total_amount = subtotal + tax_amount
         
-        invoice_id = execute_query("""
-            INSERT INTO invoices (
-                invoice_number, client_id, invoice_date, due_date,
-                total_amount, tax_amount, paid_amount, status, items,
-                payment_terms, created_by
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """, (
-            invoice_number,
-            data['client_id'],
-            data['invoice_date'],
-            data['due_date'],
-            total_amount,
-            tax_amount,
-            0.0,
-            'draft',
-            json.dumps(items),
-            data.get('payment_terms', 'Paiement à 30 jours'),
-            g.user['id']
-        ), fetch_one=True, commit=True)['id']
+        # Numéro réservé dans la transaction de création (rendu en cas d'échec)
+        conn, cur = get_db_cursor()
+        try:
+            invoice_number = next_number(cur, 'invoice')
+            cur.execute("""
+                INSERT INTO invoices (
+                    invoice_number, client_id, invoice_date, due_date,
+                    total_amount, tax_amount, paid_amount, status, items,
+                    payment_terms, created_by
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            """, (
+                invoice_number,
+                data['client_id'],
+                data['invoice_date'],
+                data['due_date'],
+                total_amount,
+                tax_amount,
+                0.0,
+                'draft',
+                json.dumps(items),
+                data.get('payment_terms', 'Paiement à 30 jours'),
+                g.user['id']
+            ))
+            invoice_id = cur.fetchone()['id']
+            aging.bump_version(cur)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            release_connection(conn)
         
         return jsonify({
             'success': True, 
@@ -136,6 +142,34 @@ def create_invoice():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@finance_bp.route('/invoices/batch', methods=['POST'])
+@login_required
+@permission_required('finance', 'create')
+def create_invoices_batch():
+    """Créer des factures par lot : liste 'invoices' ou campagnes ayant tourné pendant le mois 'period'"""
+    data = request.get_json() or {}
+    try:
+        invoices = generate_invoices(
+            g.user['id'],
+            specs=data.get('invoices'),
+            period=data.get('period'),
+            client_ids=data.get('client_ids'),
+            tax_rate=data.get('tax_rate', 20),
+            dry_run=bool(data.get('dry_run')),
+        )
+    except BillingError as e:
+        return jsonify({'success': False, 'error': str(e), 'errors': e.errors}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    dry_run = bool(data.get('dry_run'))
+    return jsonify({
+        'success': True,
+        'dry_run': dry_run,
+        'invoices': invoices,
+        'message': f"{len(invoices)} facture(s) {'calculée(s)' if dry_run else 'créée(s)'}"
+    })
+
 @finance_bp.route('/quotes/create', methods=['POST'])
 @login_required
 @permission_required('finance', 'create')
@@ -144,14 +178,6 @@ def create_quote():
     try:
         data = request.get_json()
         
-        # Générer le numéro de devis
-        current_month = datetime.now().strftime('%Y%m')
-        quote_count = execute_query(
-            "SELECT COUNT(*) + 1 as num FROM quotes WHERE quote_number LIKE %s",
-            (f"DEVIS-{current_month}-%",), fetch_one=True
-        )['num']
-        quote_number = f"DEVIS-{current_month}-{quote_count:04d}"
-        
         # Calculer les totaux
         items = data.get('items', [])
         subtotal = sum(float(item.get('quantity', 0)) * float(item.get('unit_price', 0)) for item in items)
@@ -159,22 +185,33 @@ def create_quote():
         tax_amount = subtotal * (tax_rate / 100)
         total_amount = subtotal + tax_amount
         
-        quote_id = execute_query("""
-            INSERT INTO quotes (
-                quote_number, client_id, amount, validity_date,
-                status, items, terms, created_by
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """, (
-            quote_number,
-            data['client_id'],
-            total_amount,
-            data['validity_date'],
-            'draft',
-            json.dumps(items),
-            data.get('terms', ''),
-            g.user['id']
-        ), fetch_one=True, commit=True)['id']
+        conn, cur = get_db_cursor()
+        try:
+            quote_number = next_number(cur, 'quote')
+            cur.execute("""
+                INSERT INTO quotes (
+                    quote_number, client_id, amount, validity_date,
+                    status, items, terms, created_by
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            """, (
+                quote_number,
+                data['client_id'],
+                total_amount,
+                data['validity_date'],
+                'draft',
+                json.dumps(items),
+                data.get('terms', ''),
+                g.user['id']
+            ))
+            quote_id = cur.fetchone()['id']
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            release_connection(conn)
         
         return jsonify({
             'success': True, 
@@ -194,47 +231,53 @@ def record_payment():
     try:
         data = request.get_json()
         
-        # Enregistrer le paiement
-        payment_id = execute_query("""
-            INSERT INTO payments (
-                invoice_id, amount, payment_date, payment_method,
-                reference, notes, recorded_by
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """, (
+        # Paiement et mise à jour de la facture en une seule instruction
+        payment = invoice_payments.record_payment(
             data['invoice_id'],
             data['amount'],
             data['payment_date'],
             data['payment_method'],
-            data.get('reference', ''),
-            data.get('notes', ''),
-            g.user['id']
-        ), fetch_one=True, commit=True)['id']
-        
-        # Mettre à jour le montant payé de la facture
-        invoice = execute_query("""
-            UPDATE invoices 
-            SET paid_amount = paid_amount + %s,
-                status = CASE 
-                    WHEN paid_amount + %s >= total_amount THEN 'paid'
-                    WHEN paid_amount + %s > 0 THEN 'partially_paid'
-                    ELSE status
-                END
-            WHERE id = %s
-            RETURNING status, total_amount, paid_amount
-        """, (data['amount'], data['amount'], data['amount'], data['invoice_id']), 
-            fetch_one=True, commit=True)
+            g.user['id'],
+            reference=data.get('reference', ''),
+            notes=data.get('notes', '')
+        )
+        if not payment:
+            return jsonify({'success': False, 'error': 'Facture introuvable'}), 404
         
         return jsonify({
             'success': True,
-            'payment_id': payment_id,
-            'invoice_status': invoice['status'],
+            'payment_id': payment['payment_id'],
+            'invoice_status': payment['status'],
             'message': 'Paiement enregistré avec succès'
         })
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@finance_bp.route('/payments/import', methods=['POST'])
+@login_required
+@permission_required('finance', 'write')
+def import_payments():
+    """Importer les lignes d'un relevé bancaire (rapprochées par numéro de facture)"""
+    data = request.get_json() or {}
+    lines = data.get('lines') or []
+    if not lines:
+        return jsonify({'success': False, 'error': 'Aucune ligne à importer'}), 400
+    try:
+        results = invoice_payments.import_statement(lines, g.user['id'])
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    counts = {}
+    for result in results:
+        counts[result['result']] = counts.get(result['result'], 0) + 1
+    return jsonify({
+        'success': True,
+        'counts': counts,
+        'lines': results,
+        'message': f"{counts.get('recorded', 0)} paiement(s) enregistré(s)"
+    })
+
 @finance_bp.route('/invoices/<int:invoice_id>/send', methods=['POST'])
 @login_required
 @permission_required('finance', 'write')
@@ -244,11 +287,15 @@ def send_invoice(invoice_id):
         data = request.get_json()
         
         # Mettre à jour le statut de la facture
-        execute_query("""
-            UPDATE invoices 
-            SET status = 'sent', 
-                sent_date = CURRENT_DATE
-            WHERE id = %s
+        execute_query(f"""
+            WITH sent AS (
+                UPDATE invoices 
+                SET status = 'sent', 
+                    sent_date = CURRENT_DATE
+                WHERE id = %s
+                RETURNING id
+            )
+            {aging.BUMP_VERSION_SQL} AND EXISTS (SELECT 1 FROM sent)
         """, (invoice_id,), commit=True)
         
         # Ici vous ajouteriez la logique d'envoi d'email
@@ -330,14 +377,6 @@ def convert_quote(quote_id):
         if not quote:
             return jsonify({'success': False, 'error': 'Devis introuvable'}), 404
         
-        # Générer le numéro de facture
-        current_month = datetime.now().strftime('%Y%m')
-        invoice_count = execute_query(
-            "SELECT COUNT(*) + 1 as num FROM invoices WHERE invoice_number LIKE %s",
-            (f"FACT-{current_month}-%",), fetch_one=True
-        )['num']
-        invoice_number = f"FACT-{current_month}-{invoice_count:04d}"
-        
         # Convertir le montant en Decimal si nécessaire
         amount = quote['amount']
         if not isinstance(amount, Decimal):
@@ -349,36 +388,48 @@ def convert_quote(quote_id):
         subtotal = amount / tax_rate  # Montant HT
         tax_amount = amount - subtotal  # Montant de la TVA
         
-        # Créer la facture
-        invoice_id = execute_query("""
-            INSERT INTO invoices (
-                invoice_number, client_id, quote_id, 
-                amount, tax_amount, total_amount,
-                invoice_date, due_date,
-                paid_amount, status, items,
-                payment_terms, created_by
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """, (
-            invoice_number,
-            quote['client_id'],
-            quote_id,
-            float(subtotal),  # Convertir en float pour l'insertion
-            float(tax_amount),
-            float(amount),
-            data.get('invoice_date', datetime.now().date()),
-            data.get('due_date'),
-            0.0,
-            'draft',
-            quote['items'] if isinstance(quote['items'], str) else json.dumps(quote['items']),
-            data.get('payment_terms', 'Paiement à 30 jours'),
-            g.user['id']
-        ), fetch_one=True, commit=True)['id']
-        
-        # Mettre à jour le statut du devis
-        execute_query("""
-            UPDATE quotes SET status = 'accepted' WHERE id = %s
-        """, (quote_id,), commit=True)
+        # Créer la facture et accepter le devis dans la même transaction que le numéro
+        conn, cur = get_db_cursor()
+        try:
+            invoice_number = next_number(cur, 'invoice')
+            cur.execute("""
+                INSERT INTO invoices (
+                    invoice_number, client_id, quote_id, 
+                    amount, tax_amount, total_amount,
+                    invoice_date, due_date,
+                    paid_amount, status, items,
+                    payment_terms, created_by
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            """, (
+                invoice_number,
+                quote['client_id'],
+                quote_id,
+                float(subtotal),  # Convertir en float pour l'insertion
+                float(tax_amount),
+                float(amount),
+                data.get('invoice_date', datetime.now().date()),
+                data.get('due_date'),
+                0.0,
+                'draft',
+                quote['items'] if isinstance(quote['items'], str) else json.dumps(quote['items']),
+                data.get('payment_terms', 'Paiement à 30 jours'),
+                g.user['id']
+            ))
+            invoice_id = cur.fetchone()['id']
+            
+            # Mettre à jour le statut du devis
+            cur.execute("""
+                UPDATE quotes SET status = 'accepted' WHERE id = %s
+            """, (quote_id,))
+            aging.bump_version(cur)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            release_connection(conn)
         
         return jsonify({
             'success': True,
@@ -409,7 +460,10 @@ def delete_invoice(invoice_id):
                 'error': 'Impossible de supprimer une facture avec des paiements'
             }), 400
         
-        execute_query("DELETE FROM invoices WHERE id = %s", (invoice_id,), commit=True)
+        execute_query(f"""
+            WITH deleted AS (DELETE FROM invoices WHERE id = %s RETURNING id)
+            {aging.BUMP_VERSION_SQL} AND EXISTS (SELECT 1 FROM deleted)
+        """, (invoice_id,), commit=True)
         
         return jsonify({
             'success': True,
@@ -521,6 +575,71 @@ def print_invoice(invoice_id):
     
     return render_template('finance/print_invoice.html', invoice=invoice)
 
+def _send_pdf(document_type, document_id):
+    """PDF en cache du document (ETag = version du contenu, requêtes Range acceptées)"""
+    if not PDF_AVAILABLE:
+        return jsonify({'success': False, 'error': 'Génération PDF indisponible (WeasyPrint non installé)'}), 503
+
+    document = load_document(document_type, document_id)
+    if not document:
+        return jsonify({'success': False, 'error': 'Document introuvable'}), 404
+
+    try:
+        path = get_pdf(document_type, document, Config.PDF_RENDER_TIMEOUT)
+    except TimeoutError:
+        return jsonify({'success': False, 'error': 'PDF en cours de génération, réessayez'}), 503
+
+    try:
+        response = send_file(os.path.abspath(path), mimetype='application/pdf',
+                             download_name=f"{document['number']}.pdf",
+                             conditional=True, etag=document['version'], max_age=0)
+    except FileNotFoundError:
+        # Version supprimée entre-temps par le rendu d'une version plus récente
+        return jsonify({'success': False, 'error': 'PDF en cours de génération, réessayez'}), 503
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@finance_bp.route('/invoices/<int:invoice_id>/pdf')
+@login_required
+@permission_required('finance', 'read')
+def invoice_pdf(invoice_id):
+    """Facture en PDF"""
+    return _send_pdf('invoice', invoice_id)
+
+@finance_bp.route('/quotes/<int:quote_id>/pdf')
+@login_required
+@permission_required('finance', 'read')
+def quote_pdf(quote_id):
+    """Devis en PDF"""
+    return _send_pdf('quote', quote_id)
+
+@finance_bp.route('/documents/pdf/batch', methods=['POST'])
+@login_required
+@permission_required('finance', 'write')
+def render_pdf_batch():
+    """Mettre en file la génération des PDF d'un lot de factures ou devis"""
+    data = request.get_json() or {}
+    document_type = data.get('type', 'invoice')
+    ids = data.get('ids') or []
+
+    if document_type not in DOCUMENT_SQL:
+        return jsonify({'success': False, 'error': 'Type de document invalide'}), 400
+    try:
+        if not isinstance(ids, list):
+            raise TypeError
+        ids = [int(document_id) for document_id in ids]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'ids invalide'}), 400
+    if not PDF_AVAILABLE:
+        return jsonify({'success': False, 'error': 'Génération PDF indisponible (WeasyPrint non installé)'}), 503
+
+    queued = render_batch(document_type, ids)
+    return jsonify({
+        'success': True,
+        'queued': queued,
+        'message': f"{queued} PDF en cours de génération"
+    }), 202
+
 @finance_bp.route('/clients/emails')
 @login_required
 @permission_required('finance', 'read')
@@ -647,6 +766,37 @@ def monthly_report(year, month):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@finance_bp.route('/reports/aging')
+@login_required
+@permission_required('finance', 'read')
+def aging_report():
+    """Balance âgée des créances par client (courant, 1-30, 31-60, 61-90, +90 jours)"""
+    try:
+        return jsonify({'success': True, **aging.aging_report()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@finance_bp.route('/reports/aging/<int:client_id>')
+@login_required
+@permission_required('finance', 'read')
+def aging_detail(client_id):
+    """Factures ouvertes d'un client dans une tranche de la balance âgée (paginé)"""
+    bucket = request.args.get('bucket', 'current')
+    if bucket not in aging.BUCKETS:
+        return jsonify({'success': False, 'error': 'Tranche invalide'}), 400
+    try:
+        cursor = decode_cursor(request.args.get('cursor'), 2)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    items, next_cursor = aging.invoices_page(client_id, bucket, get_page_size(request.args.get('limit')), cursor)
+    return jsonify({
+        'success': True,
+        'bucket': bucket,
+        'items': items,
+        'next_cursor': next_cursor
+    })
+
 @finance_bp.route('/reports/quarterly/<int:year>/<int:quarter>')
 @login_required
 @permission_required('finance', 'read')
@@ -751,51 +901,41 @@ def annual_report(year):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@finance_bp.route('/export/accounting', methods=['POST'])
+@finance_bp.route('/export/accounting', methods=['GET', 'POST'])
 @login_required
 @permission_required('finance', 'read')
 def export_accounting():
-    """Export comptable en CSV"""
+    """Export comptable (factures, paiements ou devis) en CSV, NDJSON ou Parquet, envoyé au fil de l'eau"""
+    data = request.get_json(silent=True) or request.args
+    start_date = data.get('start_date')
+    end_date = data.get('end_date')
+    dataset = data.get('dataset', 'invoices')
+    export_format = data.get('format', 'csv')
+    
+    if not start_date or not end_date:
+        return jsonify({'error': 'Période requise'}), 400
+    # Validées avant l'envoi des en-têtes : une erreur pendant le flux tronquerait le fichier
     try:
-        import csv
-        from io import StringIO
-        from flask import Response
-        
-        data = request.get_json()
-        start_date = data.get('start_date')
-        end_date = data.get('end_date')
-        
-        # Récupérer les données
-        invoices = execute_query("""
-            SELECT 
-                i.invoice_number,
-                i.invoice_date,
-                e.name as client,
-                i.amount as ht,
-                i.tax_amount as tva,
-                i.total_amount as ttc,
-                i.paid_amount,
-                i.status
-            FROM invoices i
-            JOIN entities e ON i.client_id = e.id
-            WHERE i.invoice_date BETWEEN %s AND %s
-            ORDER BY i.invoice_date
-        """, (start_date, end_date), fetch_all=True)
-        
-        # Créer le CSV
-        output = StringIO()
-        writer = csv.DictWriter(output, fieldnames=[
-            'invoice_number', 'invoice_date', 'client', 
-            'ht', 'tva', 'ttc', 'paid_amount', 'status'
-        ])
-        writer.writeheader()
-        writer.writerows(invoices)
-        
-        # Retourner le fichier CSV
-        return Response(
-            output.getvalue(),
-            mimetype='text/csv',
-            headers={"Content-Disposition": f"attachment;filename=export_comptable_{start_date}_{end_date}.csv"}
-        )
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        start_date = date.fromisoformat(str(start_date))
+        end_date = date.fromisoformat(str(end_date))
+    except ValueError:
+        return jsonify({'error': 'Dates attendues au format YYYY-MM-DD'}), 400
+    if start_date > end_date:
+        return jsonify({'error': 'La date de début doit précéder la date de fin'}), 400
+    if dataset not in DATASETS:
+        return jsonify({'error': f"Données inconnues : {dataset}"}), 400
+    if export_format not in FORMATS:
+        return jsonify({'error': f"Format inconnu : {export_format}"}), 400
+    if export_format == 'parquet' and not PARQUET_AVAILABLE:
+        return jsonify({'error': "Export Parquet indisponible (pyarrow non installé)"}), 400
+    
+    mimetype, extension = FORMATS[export_format]
+    filename = f"export_comptable_{dataset}_{start_date}_{end_date}.{extension}"
+    return Response(
+        export_chunks(dataset, export_format, start_date, end_date, Config.EXPORT_BATCH_SIZE),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f"attachment;filename={filename}",
+            "X-Accel-Buffering": "no",  # pas de mise en tampon par le proxy
+        }
+    )
\ No newline at end of file
@@ -0,0 +1,46 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from config import Config
+
+# Corps JSON sérialisé une seule fois, version gzip et ETag fort (sha256 du corps)
+CachedPayload = namedtuple('CachedPayload', ['body', 'gzipped', 'etag', 'loaded_at'])
+
+# LRU borné : les clés viennent de l'URL, seules les listes non vides sont gardées
+_payloads = OrderedDict()
+_lock = threading.Lock()
+
+
+def build_payload(data):
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return CachedPayload(
+        body=body,
+        gzipped=gzip.compress(body, compresslevel=9),
+        etag=hashlib.sha256(body).hexdigest(),
+        loaded_at=time.monotonic(),
+    )
+
+
+def get_payload(key, loader):
+    """Renvoie la liste en cache pour `key`, chargée via `loader()` au premier appel puis
+    rechargée après LOCATION_CACHE_MAX_AGE secondes (prise en compte d'un import GeoNames)"""
+    with _lock:
+        payload = _payloads.get(key)
+        if payload is not None and time.monotonic() - payload.loaded_at < Config.LOCATION_CACHE_MAX_AGE:
+            _payloads.move_to_end(key)
+            return payload
+
+    data = loader()
+    payload = build_payload(data)
+    # Code inconnu (liste vide) : réponse non mise en cache
+    if data:
+        with _lock:
+            _payloads[key] = payload
+            _payloads.move_to_end(key)
+            while len(_payloads) > Config.LOCATION_CACHE_MAX_ENTRIES:
+                _payloads.popitem(last=False)
+    return payload
@@ -1,40 +1,58 @@
-from . import location_bp
-from flask import jsonify
+from . import location_bp, cache
+from flask import jsonify, request, Response
+from config import Config
 from database.db import get_db_cursor, release_connection
 
-# --- Liste des pays ---
-@location_bp.route("/countries")
-def get_countries():
+def fetch_all(query, params=None):
     conn, cur = get_db_cursor()
     try:
-        cur.execute("SELECT iso2, name FROM countries ORDER BY name")
-        rows = cur.fetchall()
-        return jsonify([{"code": r["iso2"], "name": r["name"]} for r in rows])
+        cur.execute(query, params)
+        return cur.fetchall()
     finally:
         cur.close()
         release_connection(conn)
 
+def cached_response(payload):
+    """Réponse JSON servie depuis le cache (304 si l'ETag correspond, gzip si accepté).
+    Chaque encodage a son propre ETag fort : les corps gzip et identité diffèrent"""
+    gzipped = bool(request.accept_encodings["gzip"])
+    etag = f"{payload.etag}-gz" if gzipped else payload.etag
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif gzipped:
+        response = Response(payload.gzipped, mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(payload.body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = f"public, max-age={Config.LOCATION_CACHE_MAX_AGE}"
+    response.vary.add("Accept-Encoding")
+    return response
+
+# --- Liste des pays ---
+@location_bp.route("/countries")
+def get_countries():
+    def load():
+        rows = fetch_all("SELECT iso2, name FROM countries ORDER BY name")
+        return [{"code": r["iso2"], "name": r["name"]} for r in rows]
+    return cached_response(cache.get_payload(("countries",), load))
+
 # --- Liste des régions/admin1 par pays ---
 @location_bp.route("/regions/<country_code>")
 def get_regions(country_code):
-    conn, cur = get_db_cursor()
-    try:
-        cur.execute(
+    def load():
+        rows = fetch_all(
             "SELECT code, name FROM admin1 WHERE country_code = %s ORDER BY name",
             (country_code,)
         )
-        rows = cur.fetchall()
-        return jsonify([{"code": r["code"], "name": r["name"]} for r in rows])
-    finally:
-        cur.close()
-        release_connection(conn)
+        return [{"code": r["code"], "name": r["name"]} for r in rows]
+    return cached_response(cache.get_payload(("regions", country_code), load))
 
 # --- Liste des villes par pays + région ---
 @location_bp.route("/cities/<country_code>/<admin1_code>")
 def get_cities(country_code, admin1_code):
-    conn, cur = get_db_cursor()
-    try:
-        cur.execute(
+    def load():
+        rows = fetch_all(
             """
             SELECT geonameid, name
             FROM cities
@@ -43,8 +61,54 @@ def get_cities(country_code, admin1_code):
             """,
             (country_code, admin1_code)
         )
+        return [{"id": r["geonameid"], "name": r["name"]} for r in rows]
+    return cached_response(cache.get_payload(("cities", country_code, admin1_code), load))
+
+# --- Autocomplétion des villes (index trigrammes) ---
+@location_bp.route("/cities/search")
+def search_cities():
+    q = (request.args.get("q") or "").strip()
+    if len(q) < 2:
+        return jsonify([])
+
+    try:
+        limit = min(int(request.args.get("limit", Config.CITY_SEARCH_LIMIT)), Config.CITY_SEARCH_MAX_LIMIT)
+    except ValueError:
+        limit = Config.CITY_SEARCH_LIMIT
+    limit = max(limit, 1)
+
+    country = request.args.get("country")
+    prefix = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+    conn, cur = get_db_cursor()
+    try:
+        cur.execute(
+            f"""
+            SELECT geonameid, name, country_code, admin1_code, population,
+                   GREATEST(similarity(name, %(q)s), similarity(ascii_name, %(q)s),
+                            word_similarity(%(q)s, COALESCE(alternate_names, ''))) as score
+            FROM cities
+            WHERE (name ILIKE %(prefix)s OR ascii_name ILIKE %(prefix)s
+                   OR name %% %(q)s OR ascii_name %% %(q)s
+                   OR %(q)s <%% alternate_names)
+            {"AND country_code = %(country)s" if country else ""}
+            ORDER BY (name ILIKE %(prefix)s OR ascii_name ILIKE %(prefix)s) DESC,
+                     score DESC, population DESC NULLS LAST
+            LIMIT %(limit)s
+            """,
+            {"q": q, "prefix": prefix, "country": country, "limit": limit}
+        )
         rows = cur.fetchall()
-        return jsonify([{"id": r["geonameid"], "name": r["name"]} for r in rows])
+        return jsonify([
+            {
+                "id": r["geonameid"],
+                "name": r["name"],
+                "country": r["country_code"],
+                "region": r["admin1_code"],
+                "population": r["population"],
+            }
+            for r in rows
+        ])
     finally:
         cur.close()
         release_connection(conn)
@@ -2,75 +2,62 @@ from flask import render_template, request, jsonify, flash, redirect, url_for, g
 from . import prospects_bp
 from database.db import execute_query
 from utils.decorators import login_required, permission_required
+from utils.pagination import get_page_size, decode_cursor, keyset_condition, build_page
 from datetime import datetime, timedelta
 import json
 
+# Tris autorisés pour la liste paginée : clé -> (expression SQL, décroissant)
+PROSPECT_SORTS = {
+    'created_desc': ('p.created_at', True),
+    'created_asc': ('p.created_at', False),
+    'company_asc': ('p.company_name', False),
+    'company_desc': ('p.company_name', True),
+    'converted_desc': ('COALESCE(p.converted_at, p.created_at)', True),
+}
+
+# Onglets de la page : clé -> (condition SQL, tri par défaut)
+PROSPECT_TABS = {
+    'prospect': ('TRUE', 'created_desc'),
+    'client': ("p.status = 'Gagné' AND p.converted_to = 'client'", 'converted_desc'),
+    'partner': ("p.status = 'Gagné' AND p.converted_to = 'partner'", 'converted_desc'),
+}
+
+def build_prospect_filters(args):
+    """Construit les conditions SQL des filtres status/category/assigned_to/date"""
+    conditions = []
+    params = []
+
+    if args.get('status'):
+        conditions.append("p.status = %s")
+        params.append(args['status'])
+
+    if args.get('category'):
+        conditions.append("p.category = %s")
+        params.append(args['category'])
+
+    if args.get('assigned_to'):
+        conditions.append("p.assigned_to = %s")
+        params.append(int(args['assigned_to']))
+
+    if args.get('date_from'):
+        conditions.append("p.created_at >= %s")
+        params.append(args['date_from'])
+
+    if args.get('date_to'):
+        conditions.append("p.created_at < %s::date + 1")
+        params.append(args['date_to'])
+
+    return conditions, params
+
 @prospects_bp.route('/')
 @login_required
 @permission_required('prospects', 'read')
 def index():
-    """Liste des prospects, clients et partenaires"""
-    # Récupérer les filtres pour les prospects
+    """Liste des prospects, clients et partenaires (onglets chargés via l'API)"""
     status = request.args.get('status', '')
     category = request.args.get('category', '')
     assigned_to = request.args.get('assigned_to', '')
     
-    # Construire la requête pour les prospects
-    query = """
-        SELECT p.*, 
-               u.first_name || ' ' || u.last_name as assigned_to_name,
-               e.name as converted_entity_name
-        FROM prospects p
-        LEFT JOIN users u ON p.assigned_to = u.id
-        LEFT JOIN entities e ON p.converted_entity_id = e.id
-        WHERE 1=1
-    """
-    params = []
-    
-    if status:
-        query += " AND p.status = %s"
-        params.append(status)
-    
-    if category:
-        query += " AND p.category = %s"
-        params.append(category)
-    
-    if assigned_to:
-        query += " AND p.assigned_to = %s"
-        params.append(assigned_to)
-    
-    query += " ORDER BY p.created_at DESC"
-    
-    prospects = execute_query(query, params if params else None, fetch_all=True)
-    
-    # Récupérer les clients (prospects convertis en clients)
-    clients_query = """
-        SELECT p.*, 
-               u.first_name || ' ' || u.last_name as assigned_to_name,
-               e.name as converted_entity_name,
-               e.created_at as converted_at
-        FROM prospects p
-        LEFT JOIN users u ON p.assigned_to = u.id
-        LEFT JOIN entities e ON p.converted_entity_id = e.id
-        WHERE p.status = 'Gagné' AND p.converted_to = 'client'
-        ORDER BY p.converted_at DESC
-    """
-    clients = execute_query(clients_query, fetch_all=True)
-    
-    # Récupérer les partenaires (prospects convertis en partenaires)
-    partners_query = """
-        SELECT p.*, 
-               u.first_name || ' ' || u.last_name as assigned_to_name,
-               e.name as converted_entity_name,
-               e.created_at as converted_at
-        FROM prospects p
-        LEFT JOIN users u ON p.assigned_to = u.id
-        LEFT JOIN entities e ON p.converted_entity_id = e.id
-        WHERE p.status = 'Gagné' AND p.converted_to = 'partner'
-        ORDER BY p.converted_at DESC
-    """
-    partners = execute_query(partners_query, fetch_all=True)
-    
     # Récupérer les commerciaux pour le filtre
     commercials = execute_query("""
         SELECT u.id, u.first_name || ' ' || u.last_name as name
@@ -81,22 +68,140 @@ def index():
         ORDER BY name
     """, fetch_all=True)
     
-    # Statistiques
-    stats = {
-        'total': execute_query("SELECT COUNT(*) as count FROM prospects", fetch_one=True)['count'],
-        'new': execute_query("SELECT COUNT(*) as count FROM prospects WHERE status = 'Nouveau'", fetch_one=True)['count'],
-        'in_progress': execute_query("SELECT COUNT(*) as count FROM prospects WHERE status IN ('Contacté', 'En négociation')", fetch_one=True)['count'],
-        'won': execute_query("SELECT COUNT(*) as count FROM prospects WHERE status = 'Gagné'", fetch_one=True)['count']
-    }
+    # Statistiques en une seule passe
+    stats = execute_query("""
+        SELECT COUNT(*) as total,
+               COUNT(*) FILTER (WHERE status = 'Nouveau') as new,
+               COUNT(*) FILTER (WHERE status IN ('Contacté', 'En négociation')) as in_progress,
+               COUNT(*) FILTER (WHERE status = 'Gagné') as won
+        FROM prospects
+    """, fetch_one=True)
     
     return render_template('prospects/index.html',
-                         prospects=prospects,
-                         clients=clients,
-                         partners=partners,
                          commercials=commercials,
                          stats=stats,
                          filters={'status': status, 'category': category, 'assigned_to': assigned_to})
 
+@prospects_bp.route('/api/list')
+@login_required
+@permission_required('prospects', 'read')
+def api_list():
+    """Liste paginée (curseur keyset) des prospects, clients ou partenaires"""
+    tab = request.args.get('tab', 'prospect')
+    if tab not in PROSPECT_TABS:
+        return jsonify({'error': 'Onglet invalide'}), 400
+
+    tab_condition, default_sort = PROSPECT_TABS[tab]
+    sort = request.args.get('sort') or default_sort
+    if sort not in PROSPECT_SORTS:
+        return jsonify({'error': 'Tri invalide'}), 400
+    sort_column, descending = PROSPECT_SORTS[sort]
+
+    limit = get_page_size(request.args.get('limit'))
+
+    try:
+        conditions, params = build_prospect_filters(request.args)
+        cursor = decode_cursor(request.args.get('cursor'), 2)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    conditions.insert(0, tab_condition)
+    if cursor:
+        condition, cursor_params = keyset_condition([sort_column, 'p.id'], cursor, descending)
+        conditions.append(condition)
+        params.extend(cursor_params)
+
+    direction = 'DESC' if descending else 'ASC'
+    query = f"""
+        SELECT p.*,
+               u.first_name || ' ' || u.last_name as assigned_to_name,
+               e.name as converted_entity_name,
+               e.additional_data->>'partnership_type' as partnership_type,
+               {sort_column} as sort_value
+        FROM prospects p
+        LEFT JOIN users u ON p.assigned_to = u.id
+        LEFT JOIN entities e ON p.converted_entity_id = e.id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {sort_column} {direction}, p.id {direction}
+        LIMIT %s
+    """
+    params.append(limit + 1)
+
+    try:
+        rows = execute_query(query, params, fetch_all=True)
+        rows, next_cursor = build_page(rows, limit, ['sort_value', 'id'])
+        for row in rows:
+            row.pop('sort_value', None)
+            row.pop('search_vector', None)
+
+        return jsonify({
+            'success': True,
+            'items': rows,
+            'next_cursor': next_cursor
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def escape_like(value):
+    """Échappe les jokers LIKE d'une saisie utilisateur"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+@prospects_bp.route('/api/search')
+@login_required
+@permission_required('prospects', 'read')
+def api_search():
+    """Recherche plein texte classée (colonne search_vector + index GIN)"""
+    q = (request.args.get('q') or '').strip()
+    if len(q) < 2:
+        return jsonify({'success': True, 'items': []})
+    limit = get_page_size(request.args.get('limit'), default=20)
+
+    try:
+        # Requête évaluée avec les deux configurations utilisées par search_vector
+        items = execute_query("""
+            SELECT p.id, p.company_name, p.contact_name, p.contact_email,
+                   p.sector, p.category, p.status, p.created_at,
+                   ts_rank_cd(p.search_vector, query) as rank
+            FROM prospects p,
+                 (SELECT websearch_to_tsquery('simple', %s) || websearch_to_tsquery('french', %s) as query) q
+            WHERE p.search_vector @@ query
+            ORDER BY rank DESC, p.id DESC
+            LIMIT %s
+        """, (q, q, limit), fetch_all=True)
+
+        return jsonify({'success': True, 'items': items})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@prospects_bp.route('/api/suggest')
+@login_required
+@permission_required('prospects', 'read')
+def api_suggest():
+    """Suggestions (typeahead) par préfixe et similarité trigramme, tolérantes aux fautes"""
+    q = (request.args.get('q') or '').strip()
+    if len(q) < 2:
+        return jsonify({'success': True, 'items': []})
+    limit = get_page_size(request.args.get('limit'), default=10)
+    prefix = escape_like(q) + '%'
+
+    try:
+        items = execute_query("""
+            SELECT p.id, p.company_name, p.contact_name, p.status,
+                   GREATEST(word_similarity(%s, p.company_name),
+                            word_similarity(%s, COALESCE(p.contact_name, ''))) as score
+            FROM prospects p
+            WHERE p.company_name ILIKE %s
+               OR p.contact_name ILIKE %s
+               OR %s <%% p.company_name
+               OR %s <%% p.contact_name
+            ORDER BY (p.company_name ILIKE %s) DESC, score DESC, p.company_name
+            LIMIT %s
+        """, (q, q, prefix, prefix, q, q, prefix, limit), fetch_all=True)
+
+        return jsonify({'success': True, 'items': items})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @prospects_bp.route('/create', methods=['GET', 'POST'])
 @login_required
 @permission_required('prospects', 'write')
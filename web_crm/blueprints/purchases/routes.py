@@ -1,7 +1,8 @@
 from flask import render_template, request, jsonify, flash, redirect, url_for, g
 from . import purchases_bp
-from database.db import execute_query
+from database.db import execute_query, get_db_cursor, release_connection
 from utils.decorators import login_required, permission_required
+from utils.numbering import next_number
 from datetime import datetime
 import json
 
@@ -96,44 +97,52 @@ def create_purchase_order():
     data = request.get_json()
     
     try:
-        # Générer un numéro de commande
-        po_number = f"PO-{datetime.now().strftime('%Y%m%d')}-{execute_query('SELECT COUNT(*) FROM purchase_orders', fetch_one=True)['count'] + 1:04d}"
-        
         # Calculer le total
         total_amount = sum(line['quantity'] * line['unit_price'] for line in data['lines'])
         
-        # Créer la commande
-        order_id = execute_query("""
-            INSERT INTO purchase_orders (
-                po_number, supplier_id, order_date, expected_delivery, 
-                total_amount, notes, created_by, status
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, 'draft')
-            RETURNING id
-        """, (
-            po_number,
-            data['supplier_id'],
-            data['order_date'],
-            data.get('expected_delivery'),
-            total_amount,
-            data.get('notes'),
-            g.user['id']
-        ), fetch_one=True, commit=True)['id']
-        
-        # Ajouter les lignes de commande
-        for line in data['lines']:
-            execute_query("""
-                INSERT INTO purchase_order_lines (
-                    purchase_order_id, equipment_name, quantity, 
-                    unit_price, total_price, warehouse_id
-                ) VALUES (%s, %s, %s, %s, %s, %s)
+        # Numéro, commande et lignes dans une seule transaction
+        conn, cur = get_db_cursor()
+        try:
+            po_number = next_number(cur, 'purchase_order')
+            cur.execute("""
+                INSERT INTO purchase_orders (
+                    po_number, supplier_id, order_date, expected_delivery, 
+                    total_amount, notes, created_by, status
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, 'draft')
+                RETURNING id
             """, (
-                order_id,
-                line['equipment_name'],
-                line['quantity'],
-                line['unit_price'],
-                line['quantity'] * line['unit_price'],
-                line.get('warehouse_id')
-            ), commit=True)
+                po_number,
+                data['supplier_id'],
+                data['order_date'],
+                data.get('expected_delivery'),
+                total_amount,
+                data.get('notes'),
+                g.user['id']
+            ))
+            order_id = cur.fetchone()['id']
+            
+            # Ajouter les lignes de commande
+            for line in data['lines']:
+                cur.execute("""
+                    INSERT INTO purchase_order_lines (
+                        purchase_order_id, equipment_name, quantity, 
+                        unit_price, total_price, warehouse_id
+                    ) VALUES (%s, %s, %s, %s, %s, %s)
+                """, (
+                    order_id,
+                    line['equipment_name'],
+                    line['quantity'],
+                    line['unit_price'],
+                    line['quantity'] * line['unit_price'],
+                    line.get('warehouse_id')
+                ))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            release_connection(conn)
         
         return jsonify({'success': True, 'order_id': order_id, 'po_number': po_number})
         
@@ -0,0 +1,167 @@
+from flask import request, jsonify, url_for, g
+from . import search_bp
+from database.db import execute_query
+from utils.decorators import login_required
+from concurrent.futures import ThreadPoolExecutor
+
+# Pool partagé entre les requêtes : borne le nombre de connexions prises par la recherche
+search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='search')
+
+RESULTS_PER_SOURCE = 5
+
+# Source -> (module de permission, requête). Chaque requête reçoit
+# %(q)s, %(pattern)s, %(limit)s et %(entity_id)s, et renvoie id, label, detail, score.
+SEARCH_SOURCES = {
+    'entity': ('admin', """
+        SELECT id, name as label, type as detail,
+               CASE WHEN lower(name) = lower(%(q)s) THEN 1 ELSE similarity(name, %(q)s) END as score
+        FROM entities
+        WHERE name ILIKE %(pattern)s OR name %% %(q)s
+        ORDER BY score DESC
+        LIMIT %(limit)s
+    """),
+    'prospect': ('prospects', """
+        SELECT id, company_name as label, contact_name as detail,
+               CASE WHEN lower(company_name) = lower(%(q)s) THEN 1 ELSE similarity(company_name, %(q)s) END as score
+        FROM prospects
+        WHERE company_name ILIKE %(pattern)s OR company_name %% %(q)s
+        ORDER BY score DESC
+        LIMIT %(limit)s
+    """),
+    'site': ('sites', """
+        SELECT id, name as label, address as detail,
+               CASE WHEN lower(name) = lower(%(q)s) THEN 1 ELSE similarity(name, %(q)s) END as score
+        FROM sites
+        WHERE (name ILIKE %(pattern)s OR name %% %(q)s)
+        {partner_scope}
+        ORDER BY score DESC
+        LIMIT %(limit)s
+    """),
+    'campaign': ('campaigns', """
+        SELECT c.id, c.name as label, c.status as detail,
+               CASE WHEN lower(c.name) = lower(%(q)s) THEN 1 ELSE similarity(c.name, %(q)s) END as score
+        FROM campaigns c
+        WHERE (c.name ILIKE %(pattern)s OR c.name %% %(q)s)
+        {campaign_scope}
+        ORDER BY score DESC
+        LIMIT %(limit)s
+    """),
+    'invoice': ('finance', """
+        SELECT id, invoice_number as label, status as detail,
+               CASE WHEN upper(invoice_number) = upper(%(q)s) THEN 1 ELSE similarity(invoice_number, %(q)s) END as score
+        FROM invoices
+        WHERE invoice_number ILIKE %(pattern)s
+        {client_scope}
+        ORDER BY score DESC
+        LIMIT %(limit)s
+    """),
+    'purchase_order': ('purchases', """
+        SELECT id, po_number as label, status as detail,
+               CASE WHEN upper(po_number) = upper(%(q)s) THEN 1 ELSE similarity(po_number, %(q)s) END as score
+        FROM purchase_orders
+        WHERE po_number ILIKE %(pattern)s
+        ORDER BY score DESC
+        LIMIT %(limit)s
+    """),
+    'equipment': ('stock', """
+        SELECT id, serial_number as label, name as detail,
+               CASE WHEN upper(serial_number) = upper(%(q)s) THEN 1 ELSE similarity(serial_number, %(q)s) END as score
+        FROM equipment
+        WHERE serial_number ILIKE %(pattern)s
+        ORDER BY score DESC
+        LIMIT %(limit)s
+    """),
+}
+
+# Filtrage par entité, identique à sites.index et campaigns.index
+ROLE_SCOPES = {
+    'partner': {
+        'partner_scope': "AND entity_id = %(entity_id)s",
+        'campaign_scope': """AND EXISTS (
+            SELECT 1 FROM campaign_revenue_distribution crd
+            WHERE crd.campaign_id = c.id AND crd.entity_id = %(entity_id)s
+        )""",
+        'client_scope': "AND client_id = %(entity_id)s",
+    },
+    'client': {
+        'partner_scope': "",
+        'campaign_scope': "AND c.client_id = %(entity_id)s",
+        'client_scope': "AND client_id = %(entity_id)s",
+    },
+}
+NO_SCOPE = {'partner_scope': "", 'campaign_scope': "", 'client_scope': ""}
+
+def allowed_sources():
+    """Sources autorisées selon les permissions (même règle que permission_required)"""
+    perms = g.permissions or {}
+    role = g.user.get('role_name')
+    if role == 'super_admin' or perms.get('all') is True:
+        return list(SEARCH_SOURCES)
+
+    sources = []
+    for source, (module, _) in SEARCH_SOURCES.items():
+        if module == 'admin':
+            allowed = any(action in perms.get('admin', []) for action in ['read', 'write', 'manage'])
+        else:
+            allowed = 'read' in perms.get(module, [])
+        if allowed:
+            sources.append(source)
+    return sources
+
+def result_url(source, item_id):
+    """Lien vers la page du module correspondant"""
+    if source == 'invoice':
+        return url_for('finance.invoice_detail', invoice_id=item_id)
+    return url_for({
+        'entity': 'admin.entities',
+        'prospect': 'prospects.index',
+        'site': 'sites.index',
+        'campaign': 'campaigns.index',
+        'purchase_order': 'purchases.index',
+        'equipment': 'stock.index',
+    }[source])
+
+def run_source(query, params):
+    return execute_query(query, params, fetch_all=True)
+
+@search_bp.route('/')
+@login_required
+def global_search():
+    """Recherche globale sur les modules accessibles à l'utilisateur"""
+    q = (request.args.get('q') or '').strip()
+    if len(q) < 2:
+        return jsonify({'success': True, 'results': []})
+
+    scope = ROLE_SCOPES.get(g.user.get('role_name'), NO_SCOPE)
+    escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    params = {
+        'q': q,
+        'pattern': f'%{escaped}%',
+        'limit': RESULTS_PER_SOURCE,
+        'entity_id': g.user.get('entity_id'),
+    }
+
+    # Requêtes lancées en parallèle, une par module
+    futures = {
+        source: search_executor.submit(run_source, SEARCH_SOURCES[source][1].format(**scope), params)
+        for source in allowed_sources()
+    }
+
+    results = []
+    errors = {}
+    for source, future in futures.items():
+        try:
+            for row in future.result(timeout=5):
+                results.append({
+                    'type': source,
+                    'id': row['id'],
+                    'label': row['label'],
+                    'detail': row['detail'],
+                    'score': float(row['score'] or 0),
+                    'url': result_url(source, row['id']),
+                })
+        except Exception as e:
+            errors[source] = str(e)
+
+    results.sort(key=lambda r: r['score'], reverse=True)
+    return jsonify({'success': True, 'results': results, 'errors': errors})
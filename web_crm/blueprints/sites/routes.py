@@ -1,9 +1,16 @@
 from flask import render_template, request, jsonify, flash, redirect, url_for, g
 from . import sites_bp
-from database.db import execute_query
+from database.db import execute_query, get_db_cursor, release_connection
 from utils.decorators import login_required, permission_required
+from utils.pagination import get_page_size
+from config import Config
+from .spatial import SharedSiteIndex
+from blueprints.campaigns.revenue import queue_redistribution
 import json
 
+# Index spatial des sites actifs, partagé par les requêtes de ce processus
+site_index = SharedSiteIndex(Config.SITE_INDEX_REFRESH_SECONDS)
+
 @sites_bp.route('/')
 @login_required
 @permission_required('sites', 'read')
@@ -96,31 +103,52 @@ def create():
                 'is_active': data.get('is_active', True)
             }
 
-            # Insertion dans la base de données
-            site_id = execute_query("""
-                INSERT INTO sites (
-                    name, type, entity_id, city_id, address,
-                    latitude, longitude, opening_hours, capacity, is_active
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id
-            """, (
-                site_data['name'],
-                site_data['type'],
-                site_data['entity_id'],
-                site_data['city_id'],
-                site_data['address'],
-                site_data['latitude'],
-                site_data['longitude'],
-                json.dumps(site_data['opening_hours']),
-                site_data['capacity'],
-                site_data['is_active']
-            ), fetch_one=True, commit=True)['id']
+            # Un site ne peut être rattaché qu'à un partenaire
+            partner = execute_query("SELECT 1 FROM entities WHERE id = %s AND type = 'partner'",
+                                    (entity_id,), fetch_one=True)
+            if not partner:
+                return jsonify({'success': False, 'error': 'Partenaire introuvable'}), 400
 
-            # Log d'audit
-            execute_query("""
-                INSERT INTO audit_logs (user_id, action, resource_type, resource_id)
-                VALUES (%s, 'create_site', 'site', %s)
-            """, (g.user['id'], site_id), commit=True)
+            # Insertion, file de redistribution et audit dans la même transaction
+            conn, cur = get_db_cursor()
+            try:
+                cur.execute("""
+                    INSERT INTO sites (
+                        name, type, entity_id, city_id, address,
+                        latitude, longitude, opening_hours, capacity, is_active
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING id
+                """, (
+                    site_data['name'],
+                    site_data['type'],
+                    site_data['entity_id'],
+                    site_data['city_id'],
+                    site_data['address'],
+                    site_data['latitude'],
+                    site_data['longitude'],
+                    json.dumps(site_data['opening_hours']),
+                    site_data['capacity'],
+                    site_data['is_active']
+                ))
+                site_id = cur.fetchone()['id']
+                if site_data['is_active']:
+                    queue_redistribution([entity_id], cur)
+
+                # Log d'audit
+                cur.execute("""
+                    INSERT INTO audit_logs (user_id, action, resource_type, resource_id)
+                    VALUES (%s, 'create_site', 'site', %s)
+                """, (g.user['id'], site_id))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+                release_connection(conn)
+
+            site_index.site_changed(site_id, site_data['latitude'], site_data['longitude'],
+                                    int(entity_id), site_data['is_active'])
 
             # Réponse JSON pour le modal
             return jsonify({
@@ -140,6 +168,129 @@ def create():
         print(f"CRITICAL ERROR: {error_msg}")
         return jsonify({'success': False, 'error': error_msg}), 500
 
+# Champ JSON -> colonne modifiable de sites
+SITE_FIELDS = {
+    'name': 'name',
+    'type': 'type',
+    'partner': 'entity_id',
+    'city': 'city_id',
+    'address_line': 'address',
+    'latitude': 'latitude',
+    'longitude': 'longitude',
+    'capacity': 'capacity',
+    'is_active': 'is_active',
+}
+
+@sites_bp.route('/<int:site_id>/update', methods=['POST'])
+@login_required
+@permission_required('sites', 'write')
+def update(site_id):
+    """Modifier un site (JSON); désactivation et réaffectation relancent la répartition des revenus"""
+    data = request.get_json()
+    if not data:
+        return jsonify({'success': False, 'error': 'Données JSON manquantes'}), 400
+
+    changes = {column: (data[field] if data[field] != '' else None)
+               for field, column in SITE_FIELDS.items() if field in data}
+    if not changes:
+        return jsonify({'success': False, 'error': 'Aucune modification'}), 400
+    if 'name' in changes and not changes['name']:
+        return jsonify({'success': False, 'error': 'Le champ name est obligatoire'}), 400
+
+    try:
+        # Un site ne peut être rattaché qu'à un partenaire
+        if 'entity_id' in changes:
+            partner = changes['entity_id'] and execute_query(
+                "SELECT 1 FROM entities WHERE id = %s AND type = 'partner'",
+                (changes['entity_id'],), fetch_one=True)
+            if not partner:
+                return jsonify({'success': False, 'error': 'Partenaire introuvable'}), 400
+
+        # Modification, file de redistribution et audit dans la même transaction
+        conn, cur = get_db_cursor()
+        try:
+            cur.execute("SELECT entity_id, is_active FROM sites WHERE id = %s FOR UPDATE", (site_id,))
+            site = cur.fetchone()
+            if not site:
+                conn.rollback()
+                return jsonify({'success': False, 'error': 'Site introuvable'}), 404
+
+            assignments = ', '.join(f"{column} = %s" for column in changes)
+            cur.execute(f"""
+                UPDATE sites SET {assignments}, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+                RETURNING id, entity_id, latitude, longitude, is_active
+            """, (*changes.values(), site_id))
+            updated = cur.fetchone()
+
+            if (site['entity_id'], site['is_active']) != (updated['entity_id'], updated['is_active']):
+                queue_redistribution([site['entity_id'], updated['entity_id']], cur)
+
+            cur.execute("""
+                INSERT INTO audit_logs (user_id, action, resource_type, resource_id, new_values)
+                VALUES (%s, 'update_site', 'site', %s, %s)
+            """, (g.user['id'], site_id, json.dumps(changes, default=str)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            release_connection(conn)
+
+        site_index.site_changed(site_id, updated['latitude'], updated['longitude'],
+                                updated['entity_id'], updated['is_active'])
+        return jsonify({'success': True, 'message': 'Site modifié avec succès'})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@sites_bp.route('/nearby')
+@login_required
+@permission_required('sites', 'read')
+def nearby():
+    """Sites actifs les plus proches d'un point (rayon en km optionnel)"""
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+        radius_km = float(request.args['radius_km']) if request.args.get('radius_km') else None
+    except (KeyError, ValueError):
+        return jsonify({'success': False, 'error': 'Paramètres lat, lng (et radius_km) invalides'}), 400
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180) or (radius_km is not None and radius_km <= 0):
+        return jsonify({'success': False, 'error': 'Coordonnées hors limites'}), 400
+
+    limit = get_page_size(request.args.get('limit'), default=20)
+
+    # Un partenaire ne voit que ses propres sites
+    if g.user.get('role_name') == 'partner':
+        entity_id = g.user['entity_id']
+    else:
+        entity_id = request.args.get('entity_id', type=int)
+
+    try:
+        matches = site_index.get().nearby(lat, lng, radius_km=radius_km, limit=limit, entity_id=entity_id)
+        if not matches:
+            return jsonify({'success': True, 'items': []})
+
+        rows = execute_query("""
+            SELECT s.id, s.name, s.type, s.address, s.latitude, s.longitude, s.entity_id,
+                   e.name as entity_name, c.name as city_name
+            FROM sites s
+            LEFT JOIN entities e ON s.entity_id = e.id
+            LEFT JOIN cities c ON s.city_id = c.geonameid
+            WHERE s.id = ANY(%s)
+        """, ([site_id for _, site_id in matches],), fetch_all=True)
+        sites = {row['id']: row for row in rows}
+
+        items = []
+        for distance, site_id in matches:
+            site = sites.get(site_id)
+            if site:
+                site['distance_km'] = round(distance, 3)
+                items.append(site)
+        return jsonify({'success': True, 'items': items})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @sites_bp.route('/<int:site_id>')
 @login_required
 @permission_required('sites', 'read')
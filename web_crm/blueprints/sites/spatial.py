@@ -0,0 +1,150 @@
+import heapq
+import math
+import threading
+import time
+
+from database.db import execute_query
+
+EARTH_RADIUS_KM = 6371.0088
+# Cellule de grille en degrés (~5,5 km en latitude)
+CELL_SIZE = 0.05
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _cell(lat, lng):
+    return int(math.floor(lat / CELL_SIZE)), int(math.floor(lng / CELL_SIZE))
+
+
+class SiteIndex:
+    """Grille lat/lng en mémoire des sites actifs géolocalisés, mise à jour site par site"""
+
+    def __init__(self):
+        self._cells = {}
+        self._sites = {}  # site_id -> (lat, lng, entity_id)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._sites)
+
+    def upsert(self, site_id, lat, lng, entity_id):
+        with self._lock:
+            self._discard(site_id)
+            self._sites[site_id] = (lat, lng, entity_id)
+            self._cells.setdefault(_cell(lat, lng), set()).add(site_id)
+
+    def remove(self, site_id):
+        with self._lock:
+            self._discard(site_id)
+
+    def _discard(self, site_id):
+        previous = self._sites.pop(site_id, None)
+        if previous:
+            cell = _cell(previous[0], previous[1])
+            bucket = self._cells.get(cell)
+            bucket.discard(site_id)
+            if not bucket:
+                del self._cells[cell]
+
+    def _ring(self, center, ring):
+        """Cellules situées exactement à `ring` cellules du centre"""
+        row, col = center
+        if ring == 0:
+            yield center
+            return
+        for dc in range(-ring, ring + 1):
+            yield row - ring, col + dc
+            yield row + ring, col + dc
+        for dr in range(-ring + 1, ring):
+            yield row + dr, col - ring
+            yield row + dr, col + ring
+
+    def _ring_reach_km(self, lat, ring):
+        """Distance minimale d'un site situé au-delà des anneaux 0..ring-1"""
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + ring * CELL_SIZE, 89.9))), 0.01)
+        return max(ring - 1, 0) * CELL_SIZE * KM_PER_DEGREE * cos_lat
+
+    def nearby(self, lat, lng, radius_km=None, limit=20, entity_id=None):
+        """Sites triés par distance : les `limit` plus proches, bornés à radius_km si fourni"""
+        found = []  # tas max (-distance, site_id) des `limit` meilleurs
+
+        def consider(site_id):
+            site_lat, site_lng, site_entity = self._sites[site_id]
+            if entity_id is not None and site_entity != entity_id:
+                return
+            distance = haversine_km(lat, lng, site_lat, site_lng)
+            if radius_km is not None and distance > radius_km:
+                return
+            if len(found) < limit:
+                heapq.heappush(found, (-distance, site_id))
+            elif distance < -found[0][0]:
+                heapq.heapreplace(found, (-distance, site_id))
+
+        with self._lock:
+            max_ring = None
+            if radius_km is not None:
+                cos_lat = max(math.cos(math.radians(min(abs(lat) + radius_km / KM_PER_DEGREE, 89.9))), 0.01)
+                max_ring = math.ceil(radius_km / (CELL_SIZE * KM_PER_DEGREE * cos_lat)) + 1
+
+            center = _cell(lat, lng)
+            ring = probes = 0
+            while max_ring is None or ring <= max_ring:
+                if len(found) >= limit and -found[0][0] <= self._ring_reach_km(lat, ring):
+                    break
+                if probes > len(self._sites) // 4:
+                    # Grille trop creuse autour du point : un parcours complet coûte moins cher
+                    found = []
+                    for site_id in self._sites:
+                        consider(site_id)
+                    break
+                for cell in self._ring(center, ring):
+                    probes += 1
+                    for site_id in self._cells.get(cell, ()):
+                        consider(site_id)
+                ring += 1
+
+        return sorted((-d, site_id) for d, site_id in found)
+
+
+class SharedSiteIndex:
+    """Index chargé au premier appel puis reconstruit toutes les `refresh_seconds`
+    (les autres workers ne voient pas les mises à jour incrémentales de ce processus)"""
+
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self._index = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._index is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+            with self._lock:
+                if self._index is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+                    self._index = self._load()
+                    self._loaded_at = time.monotonic()
+        return self._index
+
+    def _load(self):
+        index = SiteIndex()
+        rows = execute_query("""
+            SELECT id, entity_id, latitude, longitude FROM sites
+            WHERE is_active = TRUE AND latitude IS NOT NULL AND longitude IS NOT NULL
+        """, fetch_all=True)
+        for row in rows or []:
+            index.upsert(row['id'], float(row['latitude']), float(row['longitude']), row['entity_id'])
+        return index
+
+    def site_changed(self, site_id, lat, lng, entity_id, is_active=True):
+        """Répercute une création/modification de site sans recharger l'index"""
+        if self._index is None:
+            return
+        if is_active and lat is not None and lng is not None:
+            self._index.upsert(site_id, float(lat), float(lng), entity_id)
+        else:
+            self._index.remove(site_id)
@@ -2,6 +2,7 @@ from flask import render_template, request, jsonify, flash, redirect, url_for, g
 from . import stock_bp
 from database.db import execute_query
 from utils.decorators import login_required, permission_required
+from utils.pagination import get_page_size, decode_cursor, keyset_condition, build_page
 from datetime import date, datetime
 
 @stock_bp.route('/')
@@ -216,30 +217,115 @@ def get_equipment_warehouses(equipment_id):
 @login_required
 @permission_required('stock', 'read')
 def movements():
-    """Historique des mouvements de stock"""
-    movements = execute_query("""
-        SELECT sm.*, e.name as equipment_name,
-               u.first_name || ' ' || u.last_name as performed_by_name,
-               CASE 
-                   WHEN sm.from_type = 'warehouse' THEN wf.name
-                   WHEN sm.from_type = 'site' THEN sf.name
-               END as from_location,
-               CASE 
-                   WHEN sm.to_type = 'warehouse' THEN wt.name
-                   WHEN sm.to_type = 'site' THEN st.name
-               END as to_location
-        FROM stock_movements sm
-        JOIN equipment e ON sm.equipment_id = e.id
-        LEFT JOIN users u ON sm.performed_by = u.id
-        LEFT JOIN warehouses wf ON sm.from_type = 'warehouse' AND sm.from_id = wf.id
-        LEFT JOIN sites sf ON sm.from_type = 'site' AND sm.from_id = sf.id
-        LEFT JOIN warehouses wt ON sm.to_type = 'warehouse' AND sm.to_id = wt.id
-        LEFT JOIN sites st ON sm.to_type = 'site' AND sm.to_id = st.id
-        ORDER BY sm.created_at DESC
-        LIMIT 100
+    """Historique des mouvements de stock (chargé page par page via l'API)"""
+    equipment_list = execute_query("SELECT id, name FROM equipment ORDER BY name", fetch_all=True)
+    warehouses = execute_query("SELECT id, name FROM warehouses ORDER BY name", fetch_all=True)
+    sites = execute_query("SELECT id, name FROM sites WHERE is_active = TRUE ORDER BY name", fetch_all=True)
+    users = execute_query("""
+        SELECT id, first_name || ' ' || last_name as name
+        FROM users
+        WHERE is_active = TRUE
+        ORDER BY name
     """, fetch_all=True)
     
-    return render_template('stock/movements.html', movements=movements)
+    return render_template('stock/movements.html',
+                         equipment_list=equipment_list,
+                         warehouses=warehouses,
+                         sites=sites,
+                         users=users)
+
+def resolve_locations(movements):
+    """Résout les noms des origines/destinations des seules lignes de la page"""
+    ids = {'warehouse': set(), 'site': set()}
+    for movement in movements:
+        for side in ('from', 'to'):
+            location_type = movement[f'{side}_type']
+            if location_type in ids and movement[f'{side}_id'] is not None:
+                ids[location_type].add(movement[f'{side}_id'])
+
+    names = {'warehouse': {}, 'site': {}}
+    for location_type, table in (('warehouse', 'warehouses'), ('site', 'sites')):
+        if ids[location_type]:
+            rows = execute_query(
+                f"SELECT id, name FROM {table} WHERE id = ANY(%s)",
+                (list(ids[location_type]),), fetch_all=True
+            )
+            names[location_type] = {row['id']: row['name'] for row in rows}
+
+    for movement in movements:
+        for side in ('from', 'to'):
+            movement[f'{side}_location'] = names.get(movement[f'{side}_type'], {}).get(movement[f'{side}_id'])
+    return movements
+
+@stock_bp.route('/api/movements')
+@login_required
+@permission_required('stock', 'read')
+def api_movements():
+    """Mouvements de stock paginés par curseur sur (created_at, id)"""
+    conditions = []
+    params = []
+
+    try:
+        if request.args.get('equipment_id'):
+            conditions.append("sm.equipment_id = %s")
+            params.append(int(request.args['equipment_id']))
+
+        for location_type in ('warehouse', 'site'):
+            location_id = request.args.get(f'{location_type}_id')
+            if location_id:
+                conditions.append("""((sm.from_type = %s AND sm.from_id = %s)
+                                      OR (sm.to_type = %s AND sm.to_id = %s))""")
+                params.extend([location_type, int(location_id), location_type, int(location_id)])
+
+        if request.args.get('user_id'):
+            conditions.append("sm.performed_by = %s")
+            params.append(int(request.args['user_id']))
+
+        if request.args.get('date_from'):
+            conditions.append("sm.created_at >= %s")
+            params.append(request.args['date_from'])
+
+        if request.args.get('date_to'):
+            conditions.append("sm.created_at < %s::date + 1")
+            params.append(request.args['date_to'])
+
+        cursor = decode_cursor(request.args.get('cursor'), 2)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if cursor:
+        condition, cursor_params = keyset_condition(['sm.created_at', 'sm.id'], cursor)
+        conditions.append(condition)
+        params.extend(cursor_params)
+
+    limit = get_page_size(request.args.get('limit'))
+    params.append(limit + 1)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    try:
+        # La page est découpée avant les jointures sur equipment et users
+        movements_page = execute_query(f"""
+            SELECT sm.*, e.name as equipment_name,
+                   u.first_name || ' ' || u.last_name as performed_by_name
+            FROM (
+                SELECT * FROM stock_movements sm
+                {where}
+                ORDER BY sm.created_at DESC, sm.id DESC
+                LIMIT %s
+            ) sm
+            JOIN equipment e ON sm.equipment_id = e.id
+            LEFT JOIN users u ON sm.performed_by = u.id
+            ORDER BY sm.created_at DESC, sm.id DESC
+        """, params, fetch_all=True)
+
+        movements_page, next_cursor = build_page(movements_page, limit, ['created_at', 'id'])
+        return jsonify({
+            'success': True,
+            'items': resolve_locations(movements_page),
+            'next_cursor': next_cursor
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @stock_bp.route('/transfer', methods=['GET', 'POST'])
 @login_required
@@ -0,0 +1,5 @@
+from .audit import audit_cli
+from .campaigns import campaigns_cli
+from .finance import finance_cli
+from .geo import geo_cli
+from .sites import sites_cli
\ No newline at end of file
@@ -0,0 +1,26 @@
+import click
+from flask.cli import AppGroup
+from config import Config
+from database.audit_partitions import ensure_partitions, convert_to_partitioned, archive_partitions
+
+audit_cli = AppGroup('audit', help="Maintenance des logs d'audit")
+
+@audit_cli.command('partition')
+def partition():
+    """Convertit audit_logs en table partitionnée par mois"""
+    if convert_to_partitioned(Config.AUDIT_PARTITIONS_AHEAD):
+        click.echo("audit_logs convertie en table partitionnée")
+    else:
+        click.echo("audit_logs est déjà partitionnée")
+
+@audit_cli.command('rotate')
+@click.option('--retention', type=int, default=None, help='Nombre de mois conservés en base')
+def rotate(retention):
+    """Crée les partitions à venir et archive celles hors rétention (à lancer par cron)"""
+    created = ensure_partitions(Config.AUDIT_PARTITIONS_AHEAD)
+    for table in created:
+        click.echo(f"Partition créée : {table}")
+
+    months = retention if retention is not None else Config.AUDIT_RETENTION_MONTHS
+    for path in archive_partitions(months, Config.AUDIT_ARCHIVE_FOLDER):
+        click.echo(f"Partition archivée : {path}")
@@ -0,0 +1,78 @@
+import time
+
+import click
+from flask.cli import AppGroup
+from config import Config
+from blueprints.campaigns.revenue import redistribute_pending
+from blueprints.campaigns.verification import verify_pending_proofs
+from blueprints.campaigns.similarity import backfill_hashes, benchmark
+from blueprints.campaigns.lifecycle import apply_transitions
+from blueprints.campaigns.analytics import rebuild
+
+campaigns_cli = AppGroup('campaigns', help="Traitements des campagnes")
+
+@campaigns_cli.command('redistribute')
+@click.option('--batch-size', type=int, default=None, help='Partenaires traités par transaction')
+def redistribute(batch_size):
+    """Recalcule les parts des partenaires dont les sites ont changé (à lancer par cron)"""
+    partners, campaigns = redistribute_pending(batch_size or Config.REDISTRIBUTION_BATCH_SIZE)
+    click.echo(f"{partners} partenaire(s) traité(s), {campaigns} campagne(s) recalculée(s)")
+
+
+@campaigns_cli.command('lifecycle')
+@click.option('--batch-size', type=int, default=500, help='Campagnes par UPDATE')
+def lifecycle(batch_size):
+    """Démarre et termine les campagnes selon leurs dates (comme le planificateur intégré)"""
+    counts = apply_transitions(batch_size)
+    if counts is None:
+        click.echo("Un autre processus applique déjà les transitions")
+        return
+    click.echo(f"{counts['started']} campagne(s) démarrée(s), {counts['completed']} terminée(s)")
+
+
+@campaigns_cli.command('rebuild-analytics')
+@click.option('--campaign', 'campaign_id', type=int, default=None, help='Une seule campagne')
+def rebuild_analytics(campaign_id):
+    """Recalcule l'agrégat journalier des preuves depuis campaign_proofs"""
+    rows = rebuild(campaign_id)
+    click.echo(f"{rows} ligne(s) journalière(s) recalculée(s)")
+
+
+@campaigns_cli.command('verify-proofs')
+@click.option('--batch-size', type=int, default=None, help='Preuves par transaction')
+@click.option('--workers', type=int, default=None, help='Workers en parallèle')
+def verify_proofs(batch_size, workers):
+    """Valide automatiquement les preuves dont GPS et date concordent, les autres vont en revue"""
+    started = time.monotonic()
+    totals = verify_pending_proofs(batch_size or Config.PROOF_VERIFY_BATCH_SIZE,
+                                   workers or Config.PROOF_VERIFY_WORKERS,
+                                   Config.PROOF_MAX_DISTANCE_M)
+    elapsed = time.monotonic() - started
+    processed = totals['auto_approved'] + totals['needs_review']
+    click.echo(f"{processed} preuve(s) vérifiée(s) en {elapsed:.1f}s : "
+               f"{totals['auto_approved']} acceptée(s), {totals['needs_review']} à revoir")
+
+
+
+@campaigns_cli.command('backfill-hashes')
+@click.option('--batch-size', type=int, default=500, help='Preuves lues par lot')
+@click.option('--workers', type=int, default=4, help='Images hachées en parallèle')
+def backfill_proof_hashes(batch_size, workers):
+    """Calcule les hashes perceptuels des images de preuve qui n'en ont pas encore"""
+    started = time.monotonic()
+    hashed, skipped = backfill_hashes(batch_size, workers)
+    click.echo(f"{hashed} image(s) hachée(s) en {time.monotonic() - started:.1f}s, "
+               f"{skipped} fichier(s) ignoré(s) (vidéo, absent ou illisible)")
+
+
+@campaigns_cli.command('bench-hashes')
+@click.option('--count', type=int, default=1000000, help='Hashes aléatoires indexés')
+@click.option('--queries', type=int, default=1000, help='Recherches mesurées')
+@click.option('--threshold', type=int, default=None, help='Distance de Hamming max')
+def bench_hashes(count, queries, threshold):
+    """Mesure la construction et la recherche de quasi-doublons sur un index synthétique"""
+    threshold = Config.PROOF_PHASH_THRESHOLD if threshold is None else threshold
+    build_seconds, latencies = benchmark(count, queries, threshold)
+    click.echo(f"{count} hashes indexés en {build_seconds:.1f}s")
+    click.echo(f"Recherche (seuil {threshold}) : p50 {latencies[len(latencies) // 2]:.2f} ms, "
+               f"p99 {latencies[int(len(latencies) * 0.99)]:.2f} ms, max {latencies[-1]:.2f} ms")
\ No newline at end of file
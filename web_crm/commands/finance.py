@@ -0,0 +1,59 @@
+import csv
+
+import click
+from flask.cli import AppGroup
+from blueprints.finance.billing import BillingError, generate_invoices
+from blueprints.finance.documents import DOCUMENT_SQL, PDF_AVAILABLE, document_ids, render_batch
+from blueprints.finance.payments import import_statement
+
+finance_cli = AppGroup('finance', help="Traitements de facturation")
+
+@finance_cli.command('bill-campaigns')
+@click.option('--period', required=True, help='Mois facturé (YYYY-MM)')
+@click.option('--client', 'client_ids', type=int, multiple=True, help='Limiter à ces clients')
+@click.option('--tax-rate', type=float, default=20, help='Taux de TVA (%)')
+@click.option('--dry-run', is_flag=True, help='Calculer les factures sans les créer')
+def bill_campaigns(period, client_ids, tax_rate, dry_run):
+    """Facture les campagnes ayant tourné pendant le mois, une facture par client (à lancer par cron)"""
+    try:
+        invoices = generate_invoices(None, period=period, client_ids=client_ids,
+                                     tax_rate=tax_rate, dry_run=dry_run)
+    except BillingError as e:
+        for error in e.errors:
+            where = f"Facture {error['index']} : " if error['index'] is not None else ''
+            click.echo(f"{where}{error['error']}", err=True)
+        raise click.Abort()
+
+    for invoice in invoices:
+        number = invoice.get('invoice_number', '(simulation)')
+        click.echo(f"{number} client {invoice['client_id']} : {invoice['total_amount']} "
+                   f"({len(invoice['campaign_ids'])} campagne(s))")
+    click.echo(f"{len(invoices)} facture(s) {'calculée(s)' if dry_run else 'créée(s)'}")
+
+
+@finance_cli.command('render-pdfs')
+@click.option('--type', 'document_type', type=click.Choice(sorted(DOCUMENT_SQL)), default='invoice')
+@click.option('--status', default=None, help='Seulement les documents dans ce statut')
+def render_pdfs(document_type, status):
+    """Génère les PDF manquants ou périmés (factures ou devis) sur le pool de rendu"""
+    if not PDF_AVAILABLE:
+        raise click.ClickException("WeasyPrint n'est pas installé")
+    queued = render_batch(document_type, document_ids(document_type, status), wait=True)
+    click.echo(f"{queued} PDF généré(s)")
+
+
+@finance_cli.command('import-payments')
+@click.argument('statement', type=click.File(encoding='utf-8-sig'))
+@click.option('--delimiter', default=';', help='Séparateur du CSV')
+def import_payments(statement, delimiter):
+    """Importe un relevé bancaire CSV (invoice_number, amount, payment_date, reference, payment_method)"""
+    results = import_statement(list(csv.DictReader(statement, delimiter=delimiter)), None)
+    counts = {}
+    for result in results:
+        counts[result['result']] = counts.get(result['result'], 0) + 1
+        if result['result'] != 'recorded':
+            click.echo(f"Ligne {result['line'] + 2} ({result['invoice_number']}) : "
+                       f"{result.get('error') or result['result']}", err=True)
+    click.echo(f"{counts.get('recorded', 0)} paiement(s) enregistré(s), "
+               f"{counts.get('duplicate', 0)} déjà importé(s), {counts.get('unmatched', 0)} non rapproché(s), "
+               f"{counts.get('invalid', 0)} invalide(s)")
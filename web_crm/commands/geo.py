@@ -0,0 +1,19 @@
+import click
+from flask.cli import AppGroup
+from config import Config
+from database.geonames import import_dump, default_dumps
+
+geo_cli = AppGroup('geo', help="Données de référence GeoNames (pays, régions, villes)")
+
+@geo_cli.command('import')
+@click.argument('files', nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option('--folder', default=None, help='Dossier des dumps (tous les .txt sont importés)')
+def import_geonames(files, folder):
+    """Importe countryInfo.txt, admin1CodesASCII.txt et les dumps par pays (CM.txt, ...)"""
+    paths = list(files) or default_dumps(folder or Config.GEONAMES_FOLDER)
+    for path in paths:
+        rows, written, seconds = import_dump(path)
+        rate = rows / seconds if seconds else rows
+        click.echo(f"{path} : {rows} lignes lues, {written} insérées/mises à jour "
+                   f"en {seconds:.1f}s ({rate:.0f} lignes/s)")
+    click.echo(f"Les listes de localisation en cache seront rechargées sous {Config.LOCATION_CACHE_MAX_AGE}s")
@@ -0,0 +1,40 @@
+import random
+import time
+
+import click
+from flask.cli import AppGroup
+from blueprints.sites.spatial import SiteIndex
+
+sites_cli = AppGroup('sites', help="Outils sur les sites")
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+@sites_cli.command('bench-nearby')
+@click.option('--sites', 'site_count', type=int, default=100000, help='Nombre de sites simulés')
+@click.option('--queries', type=int, default=1000, help='Nombre de requêtes par scénario')
+@click.option('--seed', type=int, default=42)
+def bench_nearby(site_count, queries, seed):
+    """Mesure la latence de l'index spatial sur des sites simulés (Cameroun)"""
+    rng = random.Random(seed)
+    index = SiteIndex()
+    started = time.perf_counter()
+    for site_id in range(site_count):
+        index.upsert(site_id, rng.uniform(2.0, 13.0), rng.uniform(8.5, 16.0), rng.randint(1, 200))
+    click.echo(f"Index de {site_count} sites construit en {time.perf_counter() - started:.2f}s")
+
+    scenarios = {
+        'rayon 5 km': {'radius_km': 5, 'limit': 200},
+        '20 plus proches': {'limit': 20},
+        '20 plus proches (partenaire)': {'limit': 20, 'entity_id': 1},
+    }
+    for label, options in scenarios.items():
+        timings = []
+        for _ in range(queries):
+            lat, lng = rng.uniform(2.0, 13.0), rng.uniform(8.5, 16.0)
+            started = time.perf_counter()
+            index.nearby(lat, lng, **options)
+            timings.append((time.perf_counter() - started) * 1000)
+        click.echo(f"{label} : p50 {percentile(timings, 0.5):.3f} ms, "
+                   f"p95 {percentile(timings, 0.95):.3f} ms, p99 {percentile(timings, 0.99):.3f} ms")
@@ -21,6 +21,9 @@ class Config:
     # Configuration uploads
     UPLOAD_FOLDER = 'static/uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max
+    # Preuves rangées par SHA-256 hors de static/ : servies par /campaigns/proofs/<id>/files/...
+    PROOF_UPLOAD_FOLDER = os.environ.get('PROOF_UPLOAD_FOLDER', 'storage/proofs')
+    PROOF_THUMBNAIL_WORKERS = int(os.environ.get('PROOF_THUMBNAIL_WORKERS', 4))
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'xlsx', 'xls', 'doc', 'docx'}
     
     # Configuration email
@@ -31,6 +34,51 @@ class Config:
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER', 'noreply@ads360.com')
     
+    # Autocomplétion des villes
+    CITY_SEARCH_LIMIT = int(os.environ.get('CITY_SEARCH_LIMIT', 10))
+    CITY_SEARCH_MAX_LIMIT = 50
+    
+    # Pays/régions/villes servis depuis la mémoire (Cache-Control et durée du cache en secondes)
+    LOCATION_CACHE_MAX_AGE = int(os.environ.get('LOCATION_CACHE_MAX_AGE', 86400))
+    LOCATION_CACHE_MAX_ENTRIES = int(os.environ.get('LOCATION_CACHE_MAX_ENTRIES', 2000))
+    
+    # Index spatial des sites (/sites/nearby) : rechargement complet périodique
+    SITE_INDEX_REFRESH_SECONDS = int(os.environ.get('SITE_INDEX_REFRESH_SECONDS', 300))
+    
+    # Passage automatique brouillon -> active -> terminée selon les dates des campagnes
+    CAMPAIGN_LIFECYCLE_ENABLED = os.environ.get('CAMPAIGN_LIFECYCLE_ENABLED', 'true').lower() == 'true'
+    CAMPAIGN_LIFECYCLE_INTERVAL_SECONDS = int(os.environ.get('CAMPAIGN_LIFECYCLE_INTERVAL_SECONDS', 300))
+    
+    # Redistribution des revenus après changement de sites ('flask campaigns redistribute')
+    REDISTRIBUTION_BATCH_SIZE = int(os.environ.get('REDISTRIBUTION_BATCH_SIZE', 100))
+    
+    # Vérification automatique des preuves ('flask campaigns verify-proofs')
+    PROOF_MAX_DISTANCE_M = int(os.environ.get('PROOF_MAX_DISTANCE_M', 300))
+    PROOF_VERIFY_BATCH_SIZE = 500
+    PROOF_VERIFY_WORKERS = int(os.environ.get('PROOF_VERIFY_WORKERS', 4))
+    
+    # Quasi-doublons d'images (distance de Hamming max entre pHash 64 bits)
+    PROOF_PHASH_THRESHOLD = int(os.environ.get('PROOF_PHASH_THRESHOLD', 8))
+    PROOF_HASH_SYNC_SECONDS = int(os.environ.get('PROOF_HASH_SYNC_SECONDS', 60))
+    # Fenêtre relue à chaque synchronisation (uploads committés dans le désordre)
+    PROOF_HASH_SYNC_MARGIN_SECONDS = int(os.environ.get('PROOF_HASH_SYNC_MARGIN_SECONDS', 600))
+    
+    # Export comptable : lignes lues par aller-retour avec le curseur serveur
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 2000))
+    
+    # PDF des factures et devis (WeasyPrint), gardés par version hors du dossier static
+    PDF_FOLDER = os.environ.get('PDF_FOLDER', 'storage/pdf')
+    PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', 2))
+    PDF_RENDER_TIMEOUT = int(os.environ.get('PDF_RENDER_TIMEOUT', 60))
+    
+    # Dumps GeoNames importés par 'flask geo import'
+    GEONAMES_FOLDER = os.environ.get('GEONAMES_FOLDER', 'database')
+    
     # Configuration des logs
     LOG_FILE = 'logs/crm_ads360.log'
-    LOG_LEVEL = 'INFO'
\ No newline at end of file
+    LOG_LEVEL = 'INFO'
+    
+    # Rétention des logs d'audit (partitions mensuelles)
+    AUDIT_RETENTION_MONTHS = int(os.environ.get('AUDIT_RETENTION_MONTHS', 12))
+    AUDIT_PARTITIONS_AHEAD = 3
+    AUDIT_ARCHIVE_FOLDER = os.environ.get('AUDIT_ARCHIVE_FOLDER', 'archives/audit_logs')
\ No newline at end of file
@@ -0,0 +1,211 @@
+import gzip
+import logging
+import os
+import re
+from datetime import date
+
+from database.db import get_db_cursor, release_connection
+
+PARTITION_PATTERN = re.compile(r'^audit_logs_(\d{4})_(\d{2})$')
+
+# Même définition que dans schema_final.sql (utilisée pour la conversion)
+AUDIT_LOGS_DDL = """
+    CREATE SEQUENCE IF NOT EXISTS audit_logs_id_seq;
+    CREATE TABLE IF NOT EXISTS audit_logs (
+        id INTEGER NOT NULL DEFAULT nextval('audit_logs_id_seq'),
+        user_id INTEGER REFERENCES users(id),
+        action VARCHAR(100) NOT NULL,
+        resource_type VARCHAR(50),
+        resource_id INTEGER,
+        old_values JSONB,
+        new_values JSONB,
+        ip_address VARCHAR(45),
+        user_agent TEXT,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+    ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id;
+    CREATE TABLE IF NOT EXISTS audit_logs_default PARTITION OF audit_logs DEFAULT;
+    CREATE INDEX IF NOT EXISTS idx_audit_logs_created ON audit_logs(created_at DESC, id DESC);
+    CREATE INDEX IF NOT EXISTS idx_audit_logs_user ON audit_logs(user_id, created_at DESC, id DESC);
+    CREATE INDEX IF NOT EXISTS idx_audit_logs_action ON audit_logs(action, created_at DESC, id DESC);
+    CREATE INDEX IF NOT EXISTS idx_audit_logs_resource ON audit_logs(resource_type, created_at DESC, id DESC);
+"""
+
+AUDIT_COLUMNS = ('id, user_id, action, resource_type, resource_id, old_values, '
+                 'new_values, ip_address, user_agent, created_at')
+
+
+def add_months(day, months):
+    """Premier jour du mois décalé de `months` mois"""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"audit_logs_{month:%Y_%m}"
+
+
+def _is_partitioned(cur):
+    cur.execute("""
+        SELECT c.relkind FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relname = 'audit_logs'
+    """)
+    row = cur.fetchone()
+    return bool(row) and row['relkind'] == 'p'
+
+
+def _monthly_tables(cur):
+    """Partitions mensuelles existantes (attachées ou détachées)"""
+    cur.execute("""
+        SELECT c.relname, c.relispartition FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relkind = 'r'
+        AND c.relname ~ '^audit_logs_[0-9]{4}_[0-9]{2}$'
+        ORDER BY c.relname
+    """)
+    tables = []
+    for row in cur.fetchall():
+        match = PARTITION_PATTERN.match(row['relname'])
+        month = date(int(match.group(1)), int(match.group(2)), 1)
+        tables.append((month, row['relname'], row['relispartition']))
+    return tables
+
+
+def _create_partition(cur, month):
+    """Crée la partition de `month` en y déplaçant les lignes du mois déjà tombées dans la
+    partition par défaut (sinon PostgreSQL refuse la nouvelle plage)"""
+    table = partition_name(month)
+    bounds = (month, add_months(month, 1))
+    # Bloque les écritures dans la partition par défaut jusqu'à l'attachement
+    cur.execute("LOCK TABLE audit_logs_default IN EXCLUSIVE MODE")
+    cur.execute(f"CREATE TABLE {table} (LIKE audit_logs INCLUDING DEFAULTS)")
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM audit_logs_default
+            WHERE created_at >= %s AND created_at < %s
+            RETURNING {AUDIT_COLUMNS}
+        )
+        INSERT INTO {table} ({AUDIT_COLUMNS}) SELECT {AUDIT_COLUMNS} FROM moved
+    """, bounds)
+    cur.execute(f"ALTER TABLE audit_logs ATTACH PARTITION {table} FOR VALUES FROM (%s) TO (%s)", bounds)
+
+
+def _create_partitions(cur, first_month, last_month):
+    existing = {month for month, _, attached in _monthly_tables(cur) if attached}
+    created = []
+    month = first_month
+    while month <= last_month:
+        if month not in existing:
+            _create_partition(cur, month)
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+
+def ensure_partitions(months_ahead=3):
+    """Crée les partitions du mois courant et des `months_ahead` mois suivants"""
+    conn, cur = get_db_cursor()
+    try:
+        if not _is_partitioned(cur):
+            raise RuntimeError("audit_logs n'est pas partitionnée (lancer 'flask audit partition')")
+        current = add_months(date.today(), 0)
+        created = _create_partitions(cur, current, add_months(current, months_ahead))
+        conn.commit()
+        return created
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        release_connection(conn)
+
+
+def convert_to_partitioned(months_ahead=3):
+    """Convertit une table audit_logs classique en table partitionnée par mois"""
+    conn, cur = get_db_cursor()
+    try:
+        if _is_partitioned(cur):
+            return False
+
+        cur.execute("ALTER TABLE audit_logs RENAME TO audit_logs_legacy")
+        cur.execute("ALTER SEQUENCE IF EXISTS audit_logs_id_seq OWNED BY NONE")
+        cur.execute("DROP INDEX IF EXISTS idx_audit_logs_user")
+        cur.execute("DROP INDEX IF EXISTS idx_audit_logs_created")
+        cur.execute(AUDIT_LOGS_DDL)
+
+        cur.execute("SELECT MIN(created_at) as first_log FROM audit_logs_legacy")
+        first_log = cur.fetchone()['first_log'] or date.today()
+        current = add_months(date.today(), 0)
+        _create_partitions(cur, add_months(first_log, 0), add_months(current, months_ahead))
+
+        cur.execute(f"""
+            INSERT INTO audit_logs ({AUDIT_COLUMNS})
+            SELECT id, user_id, action, resource_type, resource_id, old_values,
+                   new_values, ip_address, user_agent, COALESCE(created_at, CURRENT_TIMESTAMP)
+            FROM audit_logs_legacy
+        """)
+        cur.execute("SELECT setval('audit_logs_id_seq', COALESCE(MAX(id), 0) + 1, false) FROM audit_logs")
+        cur.execute("DROP TABLE audit_logs_legacy")
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        release_connection(conn)
+
+
+def archive_partitions(retention_months, archive_folder):
+    """Détache, exporte (CSV gzip) puis supprime les partitions plus anciennes que la rétention"""
+    os.makedirs(archive_folder, exist_ok=True)
+    cutoff = add_months(date.today(), -retention_months)
+    archived = []
+
+    conn, cur = get_db_cursor()
+    try:
+        for month, table, attached in _monthly_tables(cur):
+            if month >= cutoff:
+                continue
+
+            # Détacher d'abord : la partition sort des requêtes du journal
+            if attached:
+                cur.execute(f"ALTER TABLE audit_logs DETACH PARTITION {table}")
+                conn.commit()
+
+            path = os.path.join(archive_folder, f"{table}.csv.gz")
+            with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as archive:
+                cur.copy_expert(f"COPY {table} TO STDOUT WITH (FORMAT csv, HEADER)", archive)
+            os.replace(path + '.tmp', path)
+
+            # Supprimer seulement une fois l'archive écrite
+            cur.execute(f"DROP TABLE {table}")
+            conn.commit()
+            archived.append(path)
+            logging.info(f"Partition {table} archivée dans {path}")
+
+        # Lignes hors rétention restées dans la partition par défaut (écrites avant la
+        # création de leur partition mensuelle) : exportées et supprimées dans la même transaction
+        cur.execute("SELECT EXISTS (SELECT 1 FROM audit_logs_default WHERE created_at < %s) as stale", (cutoff,))
+        if cur.fetchone()['stale']:
+            path = os.path.join(archive_folder, f"audit_logs_default_before_{cutoff:%Y_%m}.csv.gz")
+            with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as archive:
+                cur.copy_expert(f"""
+                    COPY (DELETE FROM audit_logs_default WHERE created_at < '{cutoff.isoformat()}'
+                          RETURNING {AUDIT_COLUMNS})
+                    TO STDOUT WITH (FORMAT csv, HEADER)
+                """, archive)
+            os.replace(path + '.tmp', path)
+            conn.commit()
+            archived.append(path)
+            logging.info(f"Logs de la partition par défaut antérieurs à {cutoff} archivés dans {path}")
+
+        return archived
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        release_connection(conn)
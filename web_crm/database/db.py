@@ -1,6 +1,6 @@
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from psycopg2.pool import SimpleConnectionPool
+from psycopg2.pool import ThreadedConnectionPool
 from config import Config
 import logging
 
@@ -11,7 +11,7 @@ def init_db():
     """Initialise le pool de connexions"""
     global connection_pool
     try:
-        connection_pool = SimpleConnectionPool(
+        connection_pool = ThreadedConnectionPool(
             1, 20,  # min et max connexions
             host=Config.DB_HOST,
             port=Config.DB_PORT,
@@ -0,0 +1,130 @@
+import io
+import os
+import time
+
+from database.db import get_db_cursor, release_connection
+
+COPY_OPTIONS = "WITH (FORMAT text, DELIMITER E'\\t', NULL '', ENCODING 'UTF8')"
+
+COUNTRY_COLUMNS = ('iso2', 'iso3', 'iso_numeric', 'fips', 'name', 'capital', 'area', 'population',
+                   'continent', 'tld', 'currency_code', 'currency_name', 'phone',
+                   'postal_code_format', 'postal_code_regex', 'languages', 'geonameid',
+                   'neighbours', 'extra')
+
+CITY_COLUMNS = ('geonameid', 'name', 'ascii_name', 'alternate_names', 'latitude', 'longitude',
+                'feature_class', 'feature_code', 'country_code', 'cc2', 'admin1_code',
+                'admin2_code', 'admin3_code', 'admin4_code', 'population', 'elevation', 'dem',
+                'timezone', 'modification_date')
+
+ADMIN1_COLUMNS = ('geonameid', 'country_code', 'code', 'name', 'ascii_name')
+
+
+def _upsert(table, columns, select, changed):
+    """INSERT ... SELECT ... ON CONFLICT (geonameid) qui ne réécrit que les lignes modifiées"""
+    updates = ', '.join(f"{col} = EXCLUDED.{col}" for col in columns if col != 'geonameid')
+    return f"""
+        INSERT INTO {table} ({', '.join(columns)})
+        {select}
+        ON CONFLICT (geonameid) DO UPDATE SET {updates}
+        WHERE {changed}
+    """
+
+
+def _copy(cur, staging, source):
+    cur.copy_expert(f"COPY {staging} FROM STDIN {COPY_OPTIONS}", source)
+    cur.execute(f"SELECT COUNT(*) as total FROM {staging}")
+    return cur.fetchone()['total']
+
+
+def _load_countries(cur, path):
+    # countryInfo.txt commence par un en-tête commenté (#)
+    with open(path, encoding='utf-8') as source:
+        data = io.StringIO(''.join(line for line in source if not line.startswith('#')))
+    cur.execute("CREATE TEMP TABLE geo_staging_countries (LIKE countries) ON COMMIT DROP")
+    rows = _copy(cur, 'geo_staging_countries', data)
+    cur.execute(_upsert(
+        'countries', COUNTRY_COLUMNS,
+        "SELECT * FROM geo_staging_countries WHERE geonameid IS NOT NULL",
+        "(countries.*) IS DISTINCT FROM (EXCLUDED.*)"
+    ))
+    return rows
+
+
+def _load_admin1(cur, path):
+    cur.execute("""
+        CREATE TEMP TABLE geo_staging_admin1 (
+            code_full TEXT,
+            name TEXT,
+            ascii_name TEXT,
+            geonameid BIGINT
+        ) ON COMMIT DROP
+    """)
+    with open(path, encoding='utf-8') as source:
+        rows = _copy(cur, 'geo_staging_admin1', source)
+    cur.execute(_upsert(
+        'admin1', ADMIN1_COLUMNS,
+        """SELECT geonameid, split_part(code_full, '.', 1), split_part(code_full, '.', 2),
+                  name, ascii_name
+           FROM geo_staging_admin1""",
+        "(admin1.country_code, admin1.code, admin1.name, admin1.ascii_name) IS DISTINCT FROM "
+        "(EXCLUDED.country_code, EXCLUDED.code, EXCLUDED.name, EXCLUDED.ascii_name)"
+    ))
+    return rows
+
+
+def _load_cities(cur, path):
+    cur.execute("CREATE TEMP TABLE geo_staging_cities (LIKE cities) ON COMMIT DROP")
+    with open(path, encoding='utf-8') as source:
+        rows = _copy(cur, 'geo_staging_cities', source)
+    # Dumps par pays : seules les localités (classe P) alimentent cities,
+    # et les lignes dont modification_date n'a pas bougé sont ignorées
+    cur.execute(_upsert(
+        'cities', CITY_COLUMNS,
+        """SELECT s.* FROM geo_staging_cities s
+           LEFT JOIN cities c ON c.geonameid = s.geonameid
+           WHERE s.feature_class = 'P'
+           AND (c.geonameid IS NULL OR c.modification_date IS DISTINCT FROM s.modification_date)""",
+        "cities.modification_date IS DISTINCT FROM EXCLUDED.modification_date"
+    ))
+    return rows
+
+
+def dump_kind(path):
+    """Type de fichier GeoNames d'après son nom"""
+    name = os.path.basename(path)
+    if name == 'countryInfo.txt':
+        return 'countries'
+    if name == 'admin1CodesASCII.txt':
+        return 'admin1'
+    return 'cities'
+
+
+LOADERS = {
+    'countries': _load_countries,
+    'admin1': _load_admin1,
+    'cities': _load_cities,
+}
+
+
+def import_dump(path):
+    """Importe un fichier GeoNames; renvoie (lignes lues, lignes écrites, secondes)"""
+    started = time.monotonic()
+    conn, cur = get_db_cursor()
+    try:
+        rows = LOADERS[dump_kind(path)](cur, path)
+        written = cur.rowcount
+        conn.commit()
+        return rows, written, time.monotonic() - started
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        release_connection(conn)
+
+
+def default_dumps(folder):
+    """Fichiers du dossier, dans l'ordre pays, régions puis villes"""
+    order = {'countries': 0, 'admin1': 1, 'cities': 2}
+    paths = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith('.txt')]
+    return sorted(paths, key=lambda path: (order[dump_kind(path)], path))
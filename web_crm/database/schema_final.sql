@@ -167,7 +167,7 @@ CREATE TABLE IF NOT EXISTS campaigns (
     partners_share DECIMAL(12,2), -- 30% du budget
     start_date DATE NOT NULL,
     end_date DATE NOT NULL,
-    status VARCHAR(50) DEFAULT 'draft', -- 'draft', 'active', 'paused', 'completed'
+    status VARCHAR(50) DEFAULT 'draft', -- 'draft', 'scheduled' (validée, démarre à start_date), 'active', 'paused', 'completed'
     creative_assets JSONB, -- Liens vers les créas publicitaires
     targeting JSONB, -- Critères de ciblage
     created_by INTEGER REFERENCES users(id),
@@ -188,6 +188,15 @@ CREATE TABLE IF NOT EXISTS campaign_revenue_distribution (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Sites rattachés à chaque campagne (fait foi pour les listes et la répartition)
+CREATE TABLE IF NOT EXISTS campaign_sites (
+    campaign_id INTEGER REFERENCES campaigns(id) ON DELETE CASCADE,
+    site_id INTEGER REFERENCES sites(id),
+    entity_id INTEGER REFERENCES entities(id),
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (campaign_id, site_id)
+);
+
 -- Table des preuves de diffusion des campagnes
 CREATE TABLE IF NOT EXISTS campaign_proofs (
     id SERIAL PRIMARY KEY,
@@ -203,6 +212,52 @@ CREATE TABLE IF NOT EXISTS campaign_proofs (
     review_notes TEXT
 );
 
+-- Agrégat journalier des preuves par campagne et partenaire (/campaigns/<id>/analytics)
+CREATE TABLE IF NOT EXISTS campaign_delivery_daily (
+    campaign_id INTEGER REFERENCES campaigns(id) ON DELETE CASCADE,
+    partner_id INTEGER REFERENCES entities(id),
+    day DATE NOT NULL,
+    proofs_count INTEGER NOT NULL DEFAULT 0,
+    validated_count INTEGER NOT NULL DEFAULT 0,
+    site_ids INTEGER[] NOT NULL DEFAULT '{}', -- sites ayant reçu une preuve ce jour-là
+    PRIMARY KEY (campaign_id, partner_id, day)
+);
+
+-- Hashes perceptuels des images de preuve (détection des quasi-doublons)
+CREATE TABLE IF NOT EXISTS proof_image_hashes (
+    id SERIAL PRIMARY KEY,
+    proof_id INTEGER REFERENCES campaign_proofs(id) ON DELETE CASCADE,
+    filename VARCHAR(255) NOT NULL,
+    sha256 VARCHAR(64),
+    ahash BIGINT NOT NULL,
+    phash BIGINT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (proof_id, filename)
+);
+
+-- File des partenaires dont les sites ont changé (redistribution des revenus en différé)
+CREATE TABLE IF NOT EXISTS revenue_redistribution_queue (
+    id SERIAL PRIMARY KEY,
+    entity_id INTEGER REFERENCES entities(id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP
+);
+
+-- Compteurs de numérotation des documents (voir utils/numbering.py)
+CREATE TABLE IF NOT EXISTS document_counters (
+    prefix VARCHAR(50) PRIMARY KEY,
+    last_value INTEGER NOT NULL DEFAULT 0
+);
+
+-- Règlements des partenaires déjà traités, par clé d'idempotence
+CREATE TABLE IF NOT EXISTS settlement_requests (
+    idempotency_key VARCHAR(100) PRIMARY KEY,
+    scope JSONB NOT NULL,
+    result JSONB,
+    created_by INTEGER REFERENCES users(id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Table des fournisseurs
 CREATE TABLE IF NOT EXISTS suppliers (
     id SERIAL PRIMARY KEY,
@@ -367,6 +422,23 @@ CREATE TABLE IF NOT EXISTS invoices (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Campagnes déjà facturées par mois (facturation par lot, 'flask finance bill-campaigns')
+CREATE TABLE IF NOT EXISTS campaign_billings (
+    campaign_id INTEGER REFERENCES campaigns(id) ON DELETE CASCADE,
+    period DATE NOT NULL, -- premier jour du mois facturé
+    invoice_id INTEGER REFERENCES invoices(id) ON DELETE CASCADE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (campaign_id, period)
+);
+
+-- Versions des caches applicatifs partagés par les workers et les commandes : chaque écriture
+-- concernée incrémente sa ligne dans sa transaction ('aging' : balance âgée des créances)
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO cache_versions (name) VALUES ('aging') ON CONFLICT (name) DO NOTHING;
+
 -- Table des paiements
 CREATE TABLE IF NOT EXISTS payments (
     id SERIAL PRIMARY KEY,
@@ -380,9 +452,11 @@ CREATE TABLE IF NOT EXISTS payments (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Table des logs d'audit
+-- Table des logs d'audit, partitionnée par mois sur created_at
+-- Les partitions mensuelles sont créées et archivées par 'flask audit rotate'
+CREATE SEQUENCE IF NOT EXISTS audit_logs_id_seq;
 CREATE TABLE IF NOT EXISTS audit_logs (
-    id SERIAL PRIMARY KEY,
+    id INTEGER NOT NULL DEFAULT nextval('audit_logs_id_seq'),
     user_id INTEGER REFERENCES users(id),
     action VARCHAR(100) NOT NULL,
     resource_type VARCHAR(50),
@@ -391,8 +465,33 @@ CREATE TABLE IF NOT EXISTS audit_logs (
     new_values JSONB,
     ip_address VARCHAR(45),
     user_agent TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id;
+CREATE TABLE IF NOT EXISTS audit_logs_default PARTITION OF audit_logs DEFAULT;
+-- Partitions du mois courant et des 3 suivants (comme 'flask audit rotate'); les lignes
+-- déjà écrites dans la partition par défaut pour ces mois y sont déplacées
+DO $$
+DECLARE
+    month DATE;
+    next_month DATE;
+    part TEXT;
+BEGIN
+    FOR i IN 0..3 LOOP
+        month := (date_trunc('month', CURRENT_DATE) + make_interval(months => i))::date;
+        next_month := (month + INTERVAL '1 month')::date;
+        part := 'audit_logs_' || to_char(month, 'YYYY_MM');
+        IF to_regclass(part) IS NULL THEN
+            LOCK TABLE audit_logs_default IN EXCLUSIVE MODE;
+            EXECUTE format('CREATE TABLE %I (LIKE audit_logs INCLUDING DEFAULTS)', part);
+            EXECUTE format('WITH moved AS (DELETE FROM audit_logs_default WHERE created_at >= %L AND created_at < %L RETURNING *) '
+                           'INSERT INTO %I SELECT * FROM moved', month, next_month, part);
+            EXECUTE format('ALTER TABLE audit_logs ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           part, month, next_month);
+        END IF;
+    END LOOP;
+END $$;
 
 -- Table des paramètres système
 CREATE TABLE IF NOT EXISTS system_settings (
@@ -452,6 +551,57 @@ ALTER TABLE quotes ADD COLUMN IF NOT EXISTS terms TEXT;
 ALTER TABLE quotes ADD COLUMN IF NOT EXISTS sent_to VARCHAR(255);
 ALTER TABLE invoices 
 ADD COLUMN IF NOT EXISTS quote_id INTEGER REFERENCES quotes(id);
+ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS sites_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS stats_version BIGINT NOT NULL DEFAULT 0; -- incrémentée à chaque écriture qui change les statistiques
+ALTER TABLE campaign_revenue_distribution ADD COLUMN IF NOT EXISTS invoice_id INTEGER REFERENCES invoices(id);
+ALTER TABLE campaign_proofs ADD COLUMN IF NOT EXISTS verification_status VARCHAR(50); -- 'auto_approved', 'needs_review'
+ALTER TABLE campaign_proofs ADD COLUMN IF NOT EXISTS verification JSONB; -- écarts et distances par fichier
+ALTER TABLE campaign_proofs ADD COLUMN IF NOT EXISTS max_distance_m DECIMAL(12,1);
+ALTER TABLE campaign_proofs ADD COLUMN IF NOT EXISTS verified_at TIMESTAMP;
+
+-- Reprise : rattacher aux campagnes existantes les sites des partenaires qui y ont une part
+INSERT INTO campaign_sites (campaign_id, site_id, entity_id)
+SELECT crd.campaign_id, s.id, s.entity_id
+FROM campaign_revenue_distribution crd
+JOIN entities e ON crd.entity_id = e.id AND e.type = 'partner'
+JOIN sites s ON s.entity_id = crd.entity_id AND s.is_active = TRUE
+ON CONFLICT (campaign_id, site_id) DO NOTHING;
+UPDATE campaigns c SET sites_count = (SELECT COUNT(*) FROM campaign_sites cs WHERE cs.campaign_id = c.id);
+
+-- Reprise : compteurs de numérotation alignés sur les numéros déjà attribués
+INSERT INTO document_counters (prefix, last_value)
+SELECT prefix, MAX(value) FROM (
+    SELECT substring(invoice_number from '^(.*)-[0-9]+$') as prefix,
+           substring(invoice_number from '-([0-9]+)$')::int as value
+    FROM invoices
+    UNION ALL
+    SELECT substring(quote_number from '^(.*)-[0-9]+$'), substring(quote_number from '-([0-9]+)$')::int
+    FROM quotes
+    UNION ALL
+    SELECT substring(po_number from '^(.*)-[0-9]+$'), substring(po_number from '-([0-9]+)$')::int
+    FROM purchase_orders
+) numbers
+WHERE prefix IS NOT NULL
+GROUP BY prefix
+ON CONFLICT (prefix) DO UPDATE SET last_value = GREATEST(document_counters.last_value, EXCLUDED.last_value);
+
+-- Reprise : agrégat journalier des preuves existantes
+INSERT INTO campaign_delivery_daily (campaign_id, partner_id, day, proofs_count, validated_count, site_ids)
+SELECT campaign_id, partner_id, upload_date::date, COUNT(*),
+       COUNT(*) FILTER (WHERE status = 'approved'),
+       COALESCE(array_agg(DISTINCT site_id) FILTER (WHERE site_id IS NOT NULL), '{}')
+FROM campaign_proofs
+WHERE campaign_id IS NOT NULL AND partner_id IS NOT NULL
+GROUP BY campaign_id, partner_id, upload_date::date
+ON CONFLICT (campaign_id, partner_id, day) DO NOTHING;
+
+-- Recherche plein texte sur les prospects (noms/emails sans racinisation, secteur/notes en français)
+ALTER TABLE prospects ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', COALESCE(company_name, '')), 'A') ||
+    setweight(to_tsvector('simple', COALESCE(contact_name, '') || ' ' || COALESCE(contact_email, '')), 'B') ||
+    setweight(to_tsvector('french', COALESCE(sector, '')), 'C') ||
+    setweight(to_tsvector('french', COALESCE(notes, '')), 'D')
+) STORED;
 
 -- -------------------------------
 -- Table des pays
@@ -499,15 +649,6 @@ CREATE TABLE admin1 (
     extra TEXT
 );
 
-DROP TABLE IF EXISTS tmp_admin1 CASCADE;
--- Créer une table temporaire pour l'import
-CREATE TEMP TABLE tmp_admin1 (
-    code_full TEXT,
-    name TEXT,
-    ascii_name TEXT,
-    geonameid BIGINT
-);
-
 -- -------------------------------
 -- Table des villes / cities
 -- -------------------------------
@@ -680,15 +821,52 @@ CREATE TABLE IF NOT EXISTS requests (      -- table des demandes
 
 
 -- Index pour améliorer les performances
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
 CREATE INDEX idx_users_email ON users(email);
 CREATE INDEX idx_users_role ON users(role_id);
 CREATE INDEX idx_prospects_status ON prospects(status);
 CREATE INDEX idx_prospects_assigned ON prospects(assigned_to);
+CREATE INDEX idx_prospects_search ON prospects USING GIN (search_vector);
+CREATE INDEX idx_prospects_company_trgm ON prospects USING GIN (company_name gin_trgm_ops);
+CREATE INDEX idx_prospects_contact_trgm ON prospects USING GIN (contact_name gin_trgm_ops);
+CREATE INDEX idx_prospects_created ON prospects(created_at DESC, id DESC);
+CREATE INDEX idx_prospects_status_created ON prospects(status, created_at DESC, id DESC);
+CREATE INDEX idx_prospects_converted ON prospects(converted_to, (COALESCE(converted_at, created_at)) DESC, id DESC) WHERE status = 'Gagné';
 CREATE INDEX idx_campaigns_status ON campaigns(status);
 CREATE INDEX idx_campaigns_dates ON campaigns(start_date, end_date);
 CREATE INDEX idx_sites_entity ON sites(entity_id);
-CREATE INDEX idx_audit_logs_user ON audit_logs(user_id);
-CREATE INDEX idx_audit_logs_created ON audit_logs(created_at DESC);
+CREATE INDEX idx_campaigns_client_created ON campaigns(client_id, created_at DESC);
+CREATE INDEX idx_campaign_proofs_unverified ON campaign_proofs(id) WHERE status = 'pending' AND verification_status IS NULL;
+CREATE INDEX idx_campaign_proofs_review ON campaign_proofs(upload_date DESC, id DESC) WHERE verification_status = 'needs_review' AND status = 'pending';
+CREATE INDEX idx_campaign_proofs_data ON campaign_proofs USING GIN (proof_data jsonb_path_ops);
+CREATE INDEX idx_campaign_proofs_campaign ON campaign_proofs(campaign_id, upload_date DESC, id DESC);
+CREATE INDEX idx_proof_image_hashes_created ON proof_image_hashes(created_at DESC);
+CREATE INDEX idx_campaign_sites_entity ON campaign_sites(entity_id, campaign_id);
+CREATE INDEX idx_campaign_sites_site ON campaign_sites(site_id);
+CREATE INDEX idx_crd_campaign_entity ON campaign_revenue_distribution(campaign_id, entity_id);
+CREATE INDEX idx_crd_entity_status ON campaign_revenue_distribution(entity_id, status);
+CREATE INDEX idx_redistribution_queue_pending ON revenue_redistribution_queue(id) WHERE processed_at IS NULL;
+CREATE INDEX idx_entities_name_trgm ON entities USING GIN (name gin_trgm_ops);
+CREATE INDEX idx_sites_name_trgm ON sites USING GIN (name gin_trgm_ops);
+CREATE INDEX idx_campaigns_name_trgm ON campaigns USING GIN (name gin_trgm_ops);
+CREATE INDEX idx_invoices_status_due ON invoices(status, due_date) INCLUDE (client_id, total_amount, paid_amount);
+CREATE INDEX idx_invoices_number_trgm ON invoices USING GIN (invoice_number gin_trgm_ops);
+CREATE INDEX idx_purchase_orders_number_trgm ON purchase_orders USING GIN (po_number gin_trgm_ops);
+CREATE INDEX idx_equipment_serial_trgm ON equipment USING GIN (serial_number gin_trgm_ops);
+CREATE INDEX idx_stock_movements_created ON stock_movements(created_at DESC, id DESC);
+CREATE INDEX idx_stock_movements_equipment ON stock_movements(equipment_id, created_at DESC, id DESC);
+CREATE INDEX idx_stock_movements_from ON stock_movements(from_type, from_id, created_at DESC, id DESC);
+CREATE INDEX idx_stock_movements_to ON stock_movements(to_type, to_id, created_at DESC, id DESC);
+CREATE INDEX idx_stock_movements_user ON stock_movements(performed_by, created_at DESC, id DESC);
+CREATE UNIQUE INDEX idx_countries_geonameid ON countries(geonameid);
+CREATE INDEX idx_cities_country_admin1 ON cities(country_code, admin1_code, population DESC);
+CREATE INDEX idx_cities_name_trgm ON cities USING GIN (name gin_trgm_ops);
+CREATE INDEX idx_cities_ascii_name_trgm ON cities USING GIN (ascii_name gin_trgm_ops);
+CREATE INDEX idx_cities_alternate_names_trgm ON cities USING GIN (alternate_names gin_trgm_ops);
+CREATE INDEX idx_audit_logs_created ON audit_logs(created_at DESC, id DESC);
+CREATE INDEX idx_audit_logs_user ON audit_logs(user_id, created_at DESC, id DESC);
+CREATE INDEX idx_audit_logs_action ON audit_logs(action, created_at DESC, id DESC);
+CREATE INDEX idx_audit_logs_resource ON audit_logs(resource_type, created_at DESC, id DESC);
 
 -- Insertion des rôles par défaut
 INSERT INTO roles (name, description, permissions) VALUES
@@ -714,42 +892,4 @@ SELECT 'crm@ads360.digital', '$2b$12$SOAQrefNoT0IYP7YpQw5x.Z5nq1us6xpDB7Z6p1XKtS
        (SELECT id FROM entities WHERE type = 'admin' LIMIT 1)
 WHERE NOT EXISTS (SELECT 1 FROM users WHERE email = 'crm@ads360.digital');
 
-\COPY cities(
-    geonameid, 
-    name, 
-    ascii_name, 
-    alternate_names, 
-    latitude, 
-    longitude, 
-    feature_class, 
-    feature_code, 
-    country_code, 
-    cc2, 
-    admin1_code, 
-    admin2_code, 
-    admin3_code, 
-    admin4_code, 
-    population, 
-    elevation, 
-    dem, 
-    timezone, 
-    modification_date
-)
-FROM '/home/benounet/Dev_project/CRM-ADS360/web_crm/database/cities500.txt'
-WITH (FORMAT text, DELIMITER E'\t', NULL '', ENCODING 'UTF8');
-
-\COPY countries FROM '/home/benounet/Dev_project/CRM-ADS360/web_crm/database/countryInfo.txt' WITH (FORMAT text, DELIMITER E'\t', NULL '', ENCODING 'UTF8');
-
--- Copier les données brutes dans la table temporaire
-\COPY tmp_admin1 FROM '/home/benounet/Dev_project/CRM-ADS360/web_crm/database/admin1CodesASCII.txt' WITH (FORMAT text, DELIMITER E'\t', NULL '', ENCODING 'UTF8');
-
-
--- Insérer dans la table admin1 finale
-INSERT INTO admin1 (geonameid, country_code, code, name, ascii_name)
-SELECT
-    geonameid,
-    split_part(code_full, '.', 1) AS country_code,
-    split_part(code_full, '.', 2) AS code,
-    name,
-    ascii_name
-FROM tmp_admin1;
\ No newline at end of file
+-- Données de référence (pays, régions, villes) : flask geo import
\ No newline at end of file
@@ -0,0 +1,9 @@
+# Configuration gunicorn : gunicorn -c gunicorn.conf.py app:app
+bind = '0.0.0.0:8000'
+workers = 4
+
+
+def post_worker_init(worker):
+    """Démarre les tâches de fond dans chaque worker, une fois l'application chargée"""
+    from app import start_background_tasks
+    start_background_tasks()
@@ -1,19 +1,17 @@
-// Script pour charger les pays
+// Script pour charger les pays (référentiel local, mis en cache côté serveur et navigateur)
 async function loadCountries() {
     try {
-        const response = await fetch('https://restcountries.com/v3.1/all');
+        const response = await fetch('/location/countries');
         const countries = await response.json();
         
         const countrySelect = document.getElementById('country');
         countrySelect.innerHTML = '<option value="">Sélectionner un pays</option>';
         
-        // Trier les pays par nom
-        countries.sort((a, b) => a.name.common.localeCompare(b.name.common));
-        
+        // Déjà triés par nom côté serveur
         countries.forEach(country => {
             const option = document.createElement('option');
-            option.value = country.cca2; // Code du pays
-            option.textContent = country.name.common;
+            option.value = country.code; // Code ISO2 du pays
+            option.textContent = country.name;
             countrySelect.appendChild(option);
         });
     } catch (error) {
@@ -21,25 +19,52 @@ async function loadCountries() {
     }
 }
 
-// Charger les villes basé sur le pays sélectionné
-async function loadCities(countryCode) {
+// Charger les régions (admin1) du pays sélectionné
+async function loadRegions(countryCode) {
+    const regionSelect = document.getElementById('region');
+    regionSelect.disabled = true;
+    regionSelect.innerHTML = '<option value="">Chargement des régions...</option>';
+    
+    try {
+        const response = await fetch(`/location/regions/${encodeURIComponent(countryCode)}`);
+        const regions = await response.json();
+        
+        regionSelect.innerHTML = '<option value="">Sélectionner une région</option>';
+        
+        if (regions.length > 0) {
+            regions.forEach(region => {
+                const option = document.createElement('option');
+                option.value = region.code;
+                option.textContent = region.name;
+                regionSelect.appendChild(option);
+            });
+            regionSelect.disabled = false;
+        } else {
+            regionSelect.innerHTML = '<option value="">Aucune région trouvée</option>';
+        }
+    } catch (error) {
+        console.error('Erreur lors du chargement des régions:', error);
+        regionSelect.innerHTML = '<option value="">Erreur de chargement</option>';
+    }
+}
+
+// Charger les villes basé sur le pays et la région sélectionnés
+async function loadCities(countryCode, regionCode) {
     const citySelect = document.getElementById('city');
     citySelect.disabled = true;
     citySelect.innerHTML = '<option value="">Chargement des villes...</option>';
     
     try {
-        // Utilisation de l'API Geonames (gratuite avec inscription)
-        // Note: Vous devrez obtenir un nom d'utilisateur gratuit sur geonames.org
-        const username = 'your_geonames_username'; // À remplacer
-        const response = await fetch(`http://api.geonames.org/searchJSON?country=${countryCode}&featureClass=P&maxRows=100&username=${username}`);
-        const data = await response.json();
+        const response = await fetch(`/location/cities/${encodeURIComponent(countryCode)}/${encodeURIComponent(regionCode)}`);
+        const cities = await response.json();
         
         citySelect.innerHTML = '<option value="">Sélectionner une ville</option>';
         
-        if (data.geonames && data.geonames.length > 0) {
-            data.geonames.forEach(city => {
+        if (cities.length > 0) {
+            // Triées par population décroissante côté serveur
+            cities.forEach(city => {
                 const option = document.createElement('option');
-                option.value = city.name;
+                option.value = city.id;
                 option.textContent = city.name;
                 citySelect.appendChild(option);
             });
@@ -0,0 +1,48 @@
+from datetime import date
+
+# Compteurs de numérotation : une ligne par préfixe (type de document + période),
+# incrémentée par un upsert ... RETURNING dans la transaction appelante. Le verrou de
+# ligne sérialise les réservations concurrentes et un rollback rend les numéros, ce qui
+# garantit une suite sans trou ni doublon tant que le document est créé dans la même
+# transaction que la réservation.
+
+# Type de document -> (préfixe, format de la période, nombre de chiffres)
+DOCUMENT_TYPES = {
+    'invoice': ('FACT', '%Y%m', 4),
+    'quote': ('DEVIS', '%Y%m', 4),
+    'purchase_order': ('PO', '%Y%m%d', 4),
+    'settlement': ('INV', '%Y%m', 4),
+}
+
+
+def reserve_numbers(cur, prefix, count=1):
+    """Réserve `count` numéros consécutifs pour `prefix`; renvoie le premier"""
+    cur.execute("""
+        INSERT INTO document_counters (prefix, last_value) VALUES (%s, %s)
+        ON CONFLICT (prefix) DO UPDATE SET last_value = document_counters.last_value + EXCLUDED.last_value
+        RETURNING last_value
+    """, (prefix, count))
+    return cur.fetchone()['last_value'] - count + 1
+
+
+def format_number(prefix, value, width=4):
+    return f"{prefix}-{value:0{width}d}"
+
+
+def document_prefix(document_type, on=None):
+    """Préfixe du compteur d'un type de document pour la période de `on` (aujourd'hui par défaut)"""
+    prefix, period, _ = DOCUMENT_TYPES[document_type]
+    return f"{prefix}-{(on or date.today()).strftime(period)}"
+
+
+def next_numbers(cur, document_type, count, on=None):
+    """Réserve `count` numéros formatés d'un type de document (traitements par lot)"""
+    prefix = document_prefix(document_type, on)
+    width = DOCUMENT_TYPES[document_type][2]
+    first = reserve_numbers(cur, prefix, count)
+    return [format_number(prefix, first + offset, width) for offset in range(count)]
+
+
+def next_number(cur, document_type, on=None):
+    """Numéro suivant d'un type de document, ex. FACT-202610-0042"""
+    return next_numbers(cur, document_type, 1, on)[0]
@@ -0,0 +1,62 @@
+import base64
+import json
+from datetime import datetime, date
+from decimal import Decimal
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def get_page_size(value, default=DEFAULT_PAGE_SIZE):
+    """Normalise le paramètre limit (borné entre 1 et MAX_PAGE_SIZE)"""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def _serialize(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values):
+    """Encode les valeurs de la dernière ligne d'une page en curseur opaque"""
+    raw = json.dumps([_serialize(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """Décode un curseur; lève ValueError s'il est invalide"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('Curseur invalide')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Curseur invalide')
+    return values
+
+
+def keyset_condition(columns, values, descending=True):
+    """Condition SQL "(c1, c2) < (%s, %s)" reprenant après le curseur"""
+    operator = '<' if descending else '>'
+    placeholders = ', '.join(['%s'] * len(columns))
+    return f"({', '.join(columns)}) {operator} ({placeholders})", list(values)
+
+
+def build_page(rows, limit, cursor_keys):
+    """Coupe le résultat (LIMIT limit + 1) et calcule le curseur suivant"""
+    rows = list(rows or [])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more and rows:
+        next_cursor = encode_cursor([rows[-1][key] for key in cursor_keys])
+    return rows, next_cursor